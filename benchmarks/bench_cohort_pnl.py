@@ -0,0 +1,78 @@
+# 群体盈亏排行榜性能测试：合成成交数据上计算所有地址的盈亏，并抽样与逐地址计算的结果比对
+# 用法: python benchmarks/bench_cohort_pnl.py --trades 3000000 --addresses 150000
+#       python benchmarks/bench_cohort_pnl.py --trades 200000 --addresses 2000 --check 200
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cohort_pnl import cohort_leaderboard
+from lot_engine import METHOD_AVERAGE, METHOD_FIFO, LotBook
+from position_engine import compute_positions, signed_quantity
+
+
+def make_tape(trades, addresses, seed=3):
+    """合成成交：价格随机游走，少量活跃卖方地址，包含自成交"""
+    rng = np.random.default_rng(seed)
+    users = np.array([f"0x{i:040x}" for i in range(addresses)])
+    times = pd.Timestamp("2025-07-01") + pd.to_timedelta(np.sort(rng.integers(0, 7 * 86400000, trades)), unit="ms")
+    return pd.DataFrame({
+        "px": (100000 + np.cumsum(rng.normal(0, 20, trades))).round(1),
+        "sz": rng.choice([0.05, 0.1, 0.2, 0.5], trades),
+        "time": times,
+        "user1": pd.Categorical(users[rng.integers(0, addresses, trades)]),
+        "user2": pd.Categorical(users[rng.integers(0, max(addresses // 2, 1), trades)]),
+        "tid": np.arange(trades),
+    })
+
+
+def reference(df, address, start, method, mark):
+    """逐地址计算：FIFO 用 LotBook 逐笔撮合，平均成本用 compute_positions"""
+    qty = signed_quantity(df, address)
+    mask = qty != 0
+    px, qty = df['px'].to_numpy()[mask], qty[mask]
+    in_window = (df['time'] >= start).to_numpy()[mask]
+    if method == METHOD_FIFO:
+        book = LotBook(METHOD_FIFO)
+        realized = np.array([book.trade(q, p) for q, p in zip(qty, px)])
+        return realized[in_window].sum(), book.unrealized_pnl(mark), book.position
+    columns, state = compute_positions(px, qty)
+    realized = np.diff(np.concatenate([[0.0], columns["realized_pnl"]]))
+    unrealized = state.position * (mark - state.entry_price) if state.position else 0.0
+    return realized[in_window].sum(), unrealized, state.position
+
+
+def main():
+    parser = argparse.ArgumentParser(description="群体盈亏排行榜性能测试")
+    parser.add_argument("--trades", type=int, default=1000000)
+    parser.add_argument("--addresses", type=int, default=100000)
+    parser.add_argument("--check", type=int, default=50, help="抽样比对的地址数")
+    args = parser.parse_args()
+
+    df = make_tape(args.trades, args.addresses)
+    start = df['time'].iloc[len(df) // 2]
+    mark = float(df['px'].iloc[-1])
+    print(f"{args.trades} 笔成交, {args.addresses} 个地址, 窗口从 {start} 开始")
+    for method in (METHOD_FIFO, METHOD_AVERAGE):
+        started = time.perf_counter()
+        board = cohort_leaderboard(df, start, method)
+        elapsed = time.perf_counter() - started
+        sample = board.sample(min(args.check, len(board)), random_state=0)
+        bad = 0
+        for row in sample.itertuples():
+            realized, unrealized, position = reference(df, row.address, start, method, mark)
+            if not (np.isclose(row.realized_pnl, realized, rtol=1e-6, atol=1e-6)
+                    and np.isclose(row.unrealized_pnl, unrealized, rtol=1e-6, atol=1e-6)
+                    and abs(row.position - position) < 1e-9):
+                bad += 1
+        print(f"{method:>8}: {elapsed:.2f}秒, {len(board)} 个地址, 抽样 {len(sample)} 个 "
+              f"{'✅ 一致' if not bad else f'❌ {bad} 个不一致'}")
+
+
+if __name__ == "__main__":
+    main()
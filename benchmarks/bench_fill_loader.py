@@ -0,0 +1,92 @@
+# 成交加载器并行扩展性测试：比较不同 --workers 下 load_fills 的耗时，并校验结果与串行一致
+# 用法: python benchmarks/bench_fill_loader.py --files 16 --rows 200000 --workers 1,2,4,8
+#       python benchmarks/bench_fill_loader.py --dir ./trading_data_cache/fills --symbol BTC
+import argparse
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fill_loader import load_fills
+from fill_sink import FILL_HEADERS
+
+
+def make_synthetic_files(folder, files, rows, addresses=5000, seed=1):
+    """生成与记录器格式相同的合成会话文件"""
+    rng = np.random.default_rng(seed)
+    start = datetime(2025, 7, 1)
+    users = np.array([f"0x{i:040x}" for i in range(addresses)])
+    paths = []
+    for i in range(files):
+        file_start = start + timedelta(hours=6 * i)
+        seconds = np.sort(rng.integers(0, 6 * 3600 * 1000, rows)) / 1000
+        times = pd.to_datetime(file_start) + pd.to_timedelta(seconds, unit="s")
+        df = pd.DataFrame({
+            "coin": "BTC",
+            "px": (100000 + rng.normal(0, 500, rows)).round(1),
+            "sz": rng.exponential(0.05, rows).round(5),
+            "side": rng.choice(["Buy", "Sell"], rows),
+            "time": times.strftime("%Y-%m-%dT%H:%M:%S.%f"),
+            "user1": users[rng.integers(0, addresses, rows)],
+            "user2": users[rng.integers(0, addresses, rows)],
+            "hash": "0x" + "0" * 64,
+            "tid": np.arange(i * rows, (i + 1) * rows),
+        })[FILL_HEADERS]
+        path = os.path.join(folder, f"{file_start.strftime('%Y_%m_%dT%H_%M_%S')}_BTC_trade_data.csv")
+        df.to_csv(path, index=False)
+        paths.append(path)
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description="load_fills 并行扩展性测试")
+    parser.add_argument("--dir", type=str, default=None, help="使用已有的成交目录（默认生成合成数据）")
+    parser.add_argument("--symbol", type=str, default="BTC")
+    parser.add_argument("--files", type=int, default=8, help="合成文件数量")
+    parser.add_argument("--rows", type=int, default=200000, help="每个合成文件的行数")
+    parser.add_argument("--workers", type=str, default="1,2,4,8", help="逗号分隔的进程数列表")
+    parser.add_argument("--side", type=str, default="Buy", help="下推的方向过滤，空字符串表示不过滤")
+    args = parser.parse_args()
+
+    tmp_dir = None
+    if args.dir:
+        from fill_catalog import FillCatalog
+        files = FillCatalog(args.dir).refresh().lookup(args.symbol)
+    else:
+        tmp_dir = tempfile.TemporaryDirectory(prefix="bench_fills_")
+        print(f"生成合成数据: {args.files} 个文件 x {args.rows} 行 ...")
+        files = make_synthetic_files(tmp_dir.name, args.files, args.rows)
+    total_mb = sum(os.path.getsize(f) for f in files) / 1024 / 1024
+    print(f"{len(files)} 个文件, 共 {total_mb:.1f} MB, CPU {os.cpu_count()} 核")
+
+    side = args.side or None
+    baseline = None
+    baseline_time = None
+    print(f"{'workers':>8} {'秒':>8} {'加速比':>8} {'行数':>10} {'MB/s':>8}  一致")
+    for workers in [int(w) for w in args.workers.split(",")]:
+        start = time.perf_counter()
+        df = load_fills(files, side=side, workers=workers)
+        elapsed = time.perf_counter() - start
+        if baseline is None:
+            baseline, baseline_time = df, elapsed
+            same = True
+        else:
+            try:
+                pd.testing.assert_frame_equal(df, baseline)
+                same = True
+            except AssertionError:
+                same = False
+        print(f"{workers:>8} {elapsed:>8.2f} {baseline_time / elapsed:>8.2f} {len(df):>10} {total_mb / elapsed:>8.1f}  {'✅' if same else '❌'}")
+
+    if tmp_dir:
+        tmp_dir.cleanup()
+
+
+if __name__ == "__main__":
+    main()
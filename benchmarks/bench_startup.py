@@ -0,0 +1,90 @@
+# 命令行启动耗时测试：对每个入口脚本运行 python -X importtime <脚本> --help，
+# 统计冷启动总耗时和累计导入耗时最多的模块，用于跟踪延迟导入的效果
+# 用法: python benchmarks/bench_startup.py
+#       python benchmarks/bench_startup.py --runs 5 --top 8 --scripts hyperliquid-analysis-tool.py,user_analysis.py
+#       python benchmarks/bench_startup.py --out startup.csv     追加一行记录到CSV，方便对比不同提交
+import argparse
+import csv
+import os
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ENTRY_POINTS = [
+    "hyperliquid-analysis-tool.py",
+    "user_analysis.py",
+    "trade_analysis.py",
+    "compact_fills.py",
+    "download_trade_data.py",
+    "user_position.py",
+]
+
+
+def parse_importtime(stderr):
+    """解析 -X importtime 输出，返回 {顶层模块: 累计微秒}"""
+    cumulative = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        parts = line[len("import time:"):].split("|")
+        if len(parts) != 3 or not parts[1].strip().isdigit():
+            continue
+        name = parts[2].rstrip()
+        # 只统计顶层导入（多出的缩进表示被其他模块导入）
+        if len(name) - len(name.lstrip()) == 1:
+            name = name.strip()
+            cumulative[name] = cumulative.get(name, 0) + int(parts[1])
+    return cumulative
+
+
+def measure(script, runs):
+    """返回 (最短墙钟耗时秒, 总导入耗时秒, 最慢的模块列表)"""
+    best_wall = None
+    best_imports = None
+    for _ in range(runs):
+        started = time.perf_counter()
+        result = subprocess.run([sys.executable, "-X", "importtime", script, "--help"],
+                                cwd=ROOT, capture_output=True, text=True)
+        wall = time.perf_counter() - started
+        if result.returncode not in (0, 2):
+            raise RuntimeError(f"{script} --help 失败:\n{result.stderr[-2000:]}")
+        imports = parse_importtime(result.stderr)
+        if best_wall is None or wall < best_wall:
+            best_wall, best_imports = wall, imports
+    total = sum(best_imports.values()) / 1e6
+    slowest = sorted(best_imports.items(), key=lambda item: -item[1])
+    return best_wall, total, slowest
+
+
+def main():
+    parser = argparse.ArgumentParser(description="入口脚本冷启动耗时测试 (python -X importtime)")
+    parser.add_argument("--scripts", type=str, default=",".join(ENTRY_POINTS), help="逗号分隔的入口脚本")
+    parser.add_argument("--runs", type=int, default=3, help="每个脚本运行次数，取最快的一次")
+    parser.add_argument("--top", type=int, default=5, help="每个脚本显示最慢的N个顶层模块")
+    parser.add_argument("--out", type=str, default=None, help="把结果追加到CSV文件")
+    args = parser.parse_args()
+
+    rows = []
+    for script in [s.strip() for s in args.scripts.split(",") if s.strip()]:
+        wall, total, slowest = measure(script, args.runs)
+        print(f"\n{script}: 启动 {wall * 1000:.0f} ms, 导入 {total * 1000:.0f} ms")
+        for name, us in slowest[:args.top]:
+            print(f"    {us / 1000:>8.1f} ms  {name}")
+        rows.append({"time": datetime.now().isoformat(timespec="seconds"), "script": script,
+                     "wall_ms": round(wall * 1000, 1), "import_ms": round(total * 1000, 1),
+                     "slowest": ";".join(name for name, _ in slowest[:args.top])})
+
+    if args.out:
+        exists = os.path.exists(args.out)
+        with open(args.out, "a", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=list(rows[0]))
+            if not exists:
+                writer.writeheader()
+            writer.writerows(rows)
+        print(f"\n结果已追加到 {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+# 本地 Hyperliquid /info 接口模拟：离线测试 user_position.py 的并发轮询、限流和单地址失败处理
+# 用法: python benchmarks/info_stub_server.py --serve --port 18081                只启动模拟服务
+#       python benchmarks/info_stub_server.py --addresses 200 --workers 1,8,16    比较不同并发数的一轮耗时
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from user_position import INFO_PATH, USER_STATE_WEIGHT, StatePoller
+
+COINS = ["BTC", "ETH", "SOL"]
+
+
+class StubState:
+    def __init__(self, latency, weight_limit, failing):
+        self.latency = latency
+        self.weight_limit = weight_limit
+        self.failing = set(failing)  # 总是返回 500 的地址
+        self.lock = threading.Lock()
+        self.minute = 0
+        self.used = 0
+        self.requests = 0
+        self.positions = {}  # 地址 -> {代币: 持仓}，测试中可以直接修改
+
+    def user_state(self, address):
+        positions = self.positions.setdefault(address, {coin: random.choice([0.0, 1.0, -1.0]) for coin in COINS})
+        return {
+            "assetPositions": [
+                {"type": "oneWay", "position": {"coin": coin, "szi": str(szi), "entryPx": "100.0"}}
+                for coin, szi in positions.items() if szi
+            ],
+            "time": int(time.time() * 1000),
+        }
+
+
+def make_handler(state):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # 支持 keep-alive
+
+        def log_message(self, *args):
+            pass
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            if self.path != INFO_PATH or body.get("type") != "clearinghouseState":
+                self._reply(400, {"error": "unsupported"})
+                return
+            with state.lock:
+                minute = int(time.time() // 60)
+                if minute != state.minute:
+                    state.minute, state.used = minute, 0
+                state.used += USER_STATE_WEIGHT
+                state.requests += 1
+                used = state.used
+            if used > state.weight_limit:
+                self._reply(429, {"error": "rate limited"}, {"Retry-After": str(int(60 - time.time() % 60) + 1)})
+                return
+            time.sleep(state.latency)
+            if body["user"] in state.failing:
+                self._reply(500, {"error": "internal"})
+                return
+            with state.lock:
+                result = state.user_state(body["user"])
+            self._reply(200, result)
+
+        def _reply(self, status, body, headers=None):
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+    return Handler
+
+
+def start_stub_server(port=0, latency=0.15, weight_limit=1200, failing=None):
+    """在后台线程启动模拟服务，返回 (server, base_url, state)"""
+    state = StubState(latency, weight_limit, failing or [])
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(state))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}", state
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Hyperliquid /info 接口本地模拟")
+    parser.add_argument("--serve", action="store_true", help="只启动服务")
+    parser.add_argument("--port", type=int, default=18081)
+    parser.add_argument("--latency", type=float, default=0.15, help="每次请求的模拟延迟（秒）")
+    parser.add_argument("--weight_limit", type=int, default=100000, help="模拟的每分钟权重上限（真实接口为 1200）")
+    parser.add_argument("--addresses", type=int, default=200)
+    parser.add_argument("--failing", type=int, default=2, help="总是失败的地址数")
+    parser.add_argument("--workers", type=str, default="1,8,16", help="逗号分隔的并发数列表")
+    args = parser.parse_args()
+
+    addresses = [f"0x{i:040x}" for i in range(args.addresses)]
+    server, base_url, state = start_stub_server(0 if not args.serve else args.port, args.latency,
+                                                args.weight_limit, addresses[:args.failing])
+    if args.serve:
+        print(f"模拟服务: {base_url}{INFO_PATH}")
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            server.shutdown()
+        return
+
+    print(f"{'workers':>8} {'秒':>8} {'成功':>6} {'失败':>6}  p95(ms)")
+    for workers in [int(w) for w in args.workers.split(",")]:
+        poller = StatePoller(base_url, workers=workers, weight_per_minute=args.weight_limit)
+        stats = poller.poll(addresses)
+        latencies = sorted(stats["latencies"])
+        p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000 if latencies else 0
+        ok = len(stats["latencies"]) == args.addresses - args.failing and len(stats["errors"]) == args.failing
+        print(f"{workers:>8} {stats['cycle']:>8.2f} {len(stats['latencies']):>6} {len(stats['errors']):>6}  "
+              f"{p95:>7.0f} {'✅' if ok else '❌'}")
+        poller.close()
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
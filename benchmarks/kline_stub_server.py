@@ -0,0 +1,141 @@
+# 本地币安K线接口模拟：离线测试 kline_downloader 的分段、限流和拼接
+# 用法: python benchmarks/kline_stub_server.py --serve --port 18080          只启动模拟服务
+#       python benchmarks/kline_stub_server.py --days 90 --interval 5m --workers 1,4,8
+#                                                                       启动服务并比较不同并发数的下载耗时
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from kline_downloader import KLINES_PATH, KlineDownloader, interval_to_milliseconds
+
+
+class StubState:
+    def __init__(self, latency, weight_limit, missing):
+        self.latency = latency
+        self.weight_limit = weight_limit
+        self.missing = missing  # 模拟缺失的K线区间 [(start_ms, end_ms)]
+        self.lock = threading.Lock()
+        self.minute = 0
+        self.used = 0
+        self.requests = 0
+
+
+def make_kline(open_time, interval_ms):
+    # 价格由时间确定，便于校验拼接结果
+    price = 100000 + (open_time // interval_ms) % 1000
+    return [open_time, f"{price:.2f}", f"{price + 5:.2f}", f"{price - 5:.2f}", f"{price + 1:.2f}", "1.5",
+            open_time + interval_ms - 1, "150000.0", 10, "0.7", "70000.0", "0"]
+
+
+def make_handler(state):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # 支持 keep-alive
+
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            if url.path != KLINES_PATH:
+                self.send_error(404)
+                return
+            query = {k: v[0] for k, v in parse_qs(url.query).items()}
+            with state.lock:
+                minute = int(time.time() // 60)
+                if minute != state.minute:
+                    state.minute, state.used = minute, 0
+                state.used += 2
+                state.requests += 1
+                used = state.used
+            if used > state.weight_limit:
+                # 与币安一致：Retry-After 为距离当前分钟窗口结束的秒数
+                retry_after = int(60 - time.time() % 60) + 1
+                self._reply(429, {"code": -1003, "msg": "Too many requests"}, used, {"Retry-After": str(retry_after)})
+                return
+            time.sleep(state.latency)
+
+            interval_ms = interval_to_milliseconds(query["interval"])
+            start = int(query["startTime"])
+            end = int(query.get("endTime", int(time.time() * 1000)))
+            limit = int(query.get("limit", 500))
+            open_time = start + (-start) % interval_ms
+            klines = []
+            while open_time <= end and len(klines) < limit:
+                if not any(s <= open_time <= e for s, e in state.missing):
+                    klines.append(make_kline(open_time, interval_ms))
+                open_time += interval_ms
+            self._reply(200, klines, used)
+
+        def _reply(self, status, body, used, headers=None):
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.send_header("X-MBX-USED-WEIGHT-1M", str(used))
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+    return Handler
+
+
+def start_stub_server(port=0, latency=0.05, weight_limit=6000, missing=None):
+    """在后台线程启动模拟服务，返回 (server, base_url, state)"""
+    state = StubState(latency, weight_limit, missing or [])
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(state))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}", state
+
+
+def main():
+    parser = argparse.ArgumentParser(description="币安K线接口本地模拟")
+    parser.add_argument("--serve", action="store_true", help="只启动服务")
+    parser.add_argument("--port", type=int, default=18080)
+    parser.add_argument("--latency", type=float, default=0.05, help="每次请求的模拟延迟（秒）")
+    parser.add_argument("--weight_limit", type=int, default=6000, help="模拟的每分钟权重上限")
+    parser.add_argument("--days", type=int, default=60)
+    parser.add_argument("--interval", type=str, default="5m")
+    parser.add_argument("--workers", type=str, default="1,4,8", help="逗号分隔的并发数列表")
+    args = parser.parse_args()
+
+    interval_ms = interval_to_milliseconds(args.interval)
+    end_ms = (int(time.time() * 1000) // interval_ms) * interval_ms
+    start_ms = end_ms - args.days * 86400 * 1000
+    # 中间挖掉一段，检验缺口检测
+    missing = [(start_ms + 10 * interval_ms, start_ms + 19 * interval_ms)]
+    server, base_url, state = start_stub_server(0 if not args.serve else args.port, args.latency,
+                                                args.weight_limit, missing)
+    if args.serve:
+        print(f"模拟服务: {base_url}{KLINES_PATH}")
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            server.shutdown()
+        return
+
+    expected = (end_ms - start_ms) // interval_ms + 1 - 10
+    print(f"{'workers':>8} {'秒':>8} {'K线':>8} {'缺口':>6}  正确")
+    for workers in [int(w) for w in args.workers.split(",")]:
+        downloader = KlineDownloader(base_url, workers=workers, weight_per_minute=args.weight_limit, verbose=False)
+        started = time.perf_counter()
+        klines, gaps = downloader.download("BTCUSDT", args.interval, start_ms, end_ms, interval_ms)
+        elapsed = time.perf_counter() - started
+        times = [k[0] for k in klines]
+        ok = (len(klines) == expected and times == sorted(set(times))
+              and gaps == [(missing[0][0], missing[0][1])])
+        print(f"{workers:>8} {elapsed:>8.2f} {len(klines):>8} {len(gaps):>6}  {'✅' if ok else '❌'}")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+# 群体盈亏排行榜：回放一个代币记录下来的成交，一次性计算所有地址（买方 user1 和卖方 user2）的持仓和盈亏
+# 每笔成交拆成买卖两条腿，按 (地址, 时间) 排列后用 position_engine 的分组扫描计算，地址状态都是 numpy 数组
+# 用法: python cohort_pnl.py --symbol BTC --start 2025-07-01T00:00:00 --end 2025-07-08T00:00:00 --top 50
+#       python cohort_pnl.py --symbol BTC --start 2025-07-01 --method average --out ./trading_data_cache/cohort_BTC.csv
+# numpy/pandas 及依赖它们的模块（fill_store、fill_loader、position_engine）在用到的函数内导入
+import argparse
+import time
+
+from fill_catalog import FillCatalog
+from fill_integrity import overlapping_gaps
+from lot_engine import METHOD_AVERAGE, METHOD_FIFO
+
+COHORT_COLUMNS = ["px", "sz", "time", "user1", "user2", "tid"]
+SORT_COLUMNS = {"total": "total_pnl", "realized": "realized_pnl", "unrealized": "unrealized_pnl"}
+
+
+def address_codes(df):
+    """user1/user2 编码到同一个地址字典，返回 (买方编码, 卖方编码, 地址数组)"""
+    import numpy as np
+    buyers = df['user1'].astype('category')
+    sellers = df['user2'].astype('category')
+    addresses = buyers.cat.categories.union(sellers.cat.categories)
+    buyer_codes = addresses.get_indexer(buyers.cat.categories)[buyers.cat.codes.to_numpy()]
+    seller_codes = addresses.get_indexer(sellers.cat.categories)[sellers.cat.codes.to_numpy()]
+    return buyer_codes.astype(np.int32), seller_codes.astype(np.int32), np.asarray(addresses, dtype=object)
+
+
+def build_legs(df):
+    """每笔成交拆成 买方 +sz、卖方 -sz 两条腿，稳定排序到 (地址, 时间) 顺序
+    df 需已按 (time, tid) 排序；返回 (腿的数组字典, 地址数组)，只有自成交的地址不会出现在腿中"""
+    import numpy as np
+    buyer_codes, seller_codes, addresses = address_codes(df)
+    # 自成交不改变持仓（与 position_engine.signed_quantity 一致）；row 仍指向 df 中的原始行号
+    rows = np.flatnonzero(buyer_codes != seller_codes)
+    n = len(rows)
+    # 买卖腿交错排列，保持成交顺序，稳定排序后每个地址内仍是时间顺序
+    codes = np.column_stack([buyer_codes[rows], seller_codes[rows]]).ravel()
+    # (地址, 位置) 合成唯一的 int64 键，快速排序比 int32 的稳定排序快约一倍
+    order = np.argsort(codes.astype(np.int64) * len(codes) + np.arange(len(codes)))
+    row = np.repeat(rows, 2)[order]
+    sz = df['sz'].to_numpy(dtype=np.float64)[rows]
+    qty = np.column_stack([sz, -sz]).ravel()[order]
+    codes = codes[order]
+    legs = {
+        "code": codes,
+        "row": row,
+        "px": df['px'].to_numpy(dtype=np.float64)[row],
+        "qty": qty,
+        "group_start": np.concatenate([[True], codes[1:] != codes[:-1]]) if n else np.zeros(0, dtype=bool),
+    }
+    return legs, addresses
+
+
+def cohort_leaderboard(df, start=None, method=METHOD_FIFO, mark_price=None):
+    """计算窗口 [start, df 最后一笔] 内每个地址的盈亏
+    - 窗口之前的成交只用于建立期初持仓，已实现盈亏只统计窗口内的成交
+    - 未实现盈亏按 mark_price（默认最后成交价）计算窗口结束时的持仓浮盈
+    - 记录开始之前已有的持仓无法得知，平掉这些持仓的成交会被当作反方向开仓"""
+    import numpy as np
+    import pandas as pd
+    from position_engine import compute_group_positions
+    columns = ["address", "fills", "volume", "realized_pnl", "unrealized_pnl", "total_pnl", "position", "entry_price"]
+    if df.empty:
+        return pd.DataFrame(columns=columns)
+    legs, addresses = build_legs(df)
+    result = compute_group_positions(legs["group_start"], legs["px"], legs["qty"], method)
+
+    in_window = np.ones(len(df), dtype=bool) if start is None else (df['time'] >= start).to_numpy()
+    leg_in_window = in_window[legs["row"]]
+    codes = legs["code"]
+    count = len(addresses)
+    fills = np.bincount(codes, weights=leg_in_window, minlength=count)
+    volume = np.bincount(codes, weights=leg_in_window * np.abs(legs["qty"]) * legs["px"], minlength=count)
+    realized = np.bincount(codes, weights=np.where(leg_in_window, result["realized_pnl"], 0.0), minlength=count)
+
+    # 每个地址最后一条腿即窗口结束时的状态
+    last = np.flatnonzero(np.concatenate([legs["group_start"][1:], [True]]))
+    position = np.zeros(count)
+    entry_price = np.full(count, np.nan)
+    position[codes[last]] = result["cumulative_position"][last]
+    entry_price[codes[last]] = result["entry_price"][last]
+    mark = float(df['px'].iloc[-1]) if mark_price is None else mark_price
+    unrealized = np.where(position != 0, position * (mark - entry_price), 0.0)
+
+    board = pd.DataFrame({
+        "address": addresses,
+        "fills": fills.astype(np.int64),
+        "volume": volume,
+        "realized_pnl": realized,
+        "unrealized_pnl": unrealized,
+        "total_pnl": realized + unrealized,
+        "position": position,
+        "entry_price": entry_price,
+    })
+    return board[board["fills"] > 0].reset_index(drop=True)
+
+
+def rank(board, sort="total", top=None):
+    """按盈亏从高到低排名；top 为负数时取亏损最多的地址"""
+    import numpy as np
+    column = SORT_COLUMNS[sort]
+    board = board.sort_values(column, ascending=False, kind="stable", ignore_index=True)
+    board.insert(0, "rank", np.arange(1, len(board) + 1))
+    if top:
+        board = board.head(top) if top > 0 else board.tail(-top).iloc[::-1]
+    return board
+
+
+def load_tape(symbol, folder, end=None, fmt="csv", workers=1):
+    """读取 end 之前记录的全部成交（期初持仓需要窗口之前的成交），按 (time, tid) 排序"""
+    from fill_loader import load_fills
+    from fill_store import read_columnar_fills, to_epoch_ms
+    from position_engine import sort_fills
+    if fmt == "columnar":
+        return sort_fills(read_columnar_fills(folder, symbol, None, end, columns=COHORT_COLUMNS))
+    files = FillCatalog(folder).refresh().lookup(symbol, None, to_epoch_ms(end))
+    print(f"找到 {len(files)} 个相关的文件")
+    return sort_fills(load_fills(files, columns=COHORT_COLUMNS, end=end, workers=workers))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='群体盈亏排行榜：从记录的成交数据计算所有地址的盈亏')
+    parser.add_argument('--symbol', type=str, default="BTC", help='代币名称，例如BTC')
+    parser.add_argument('--dir', type=str, default="./trading_data_cache/fills", help='数据文件目录')
+    parser.add_argument('--start', type=str, default=None, help='窗口开始时间 YYYY-MM-DDTHH:MM:SS（本地时间），默认从第一笔成交开始')
+    parser.add_argument('--end', type=str, default=None, help='窗口结束时间，默认到最后一笔成交')
+    parser.add_argument('--method', type=str, default=METHOD_FIFO, choices=[METHOD_FIFO, METHOD_AVERAGE], help='持仓计价方式 (默认fifo)')
+    parser.add_argument('--mark_price', type=float, default=None, help='计算未实现盈亏的标记价格 (默认窗口内最后成交价)')
+    parser.add_argument('--sort', type=str, default="total", choices=list(SORT_COLUMNS), help='排序字段 (默认total)')
+    parser.add_argument('--top', type=int, default=20, help='显示前N名，负数显示亏损最多的N名 (默认20)')
+    parser.add_argument('--out', type=str, default=None, help='完整排行榜保存路径，.parquet 结尾时输出 Parquet')
+    parser.add_argument('--format', type=str, default="csv", choices=["csv", "columnar"], help='数据格式：csv 或 columnar（列式分区存储）')
+    parser.add_argument('--workers', type=int, default=1, help='并行解析文件的进程数，默认1（串行）')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    import pandas as pd
+    from fill_store import to_epoch_ms
+    start = pd.Timestamp(args.start) if args.start else None
+    end = pd.Timestamp(args.end) if args.end else None
+    if start is not None and end is not None:
+        for gap in overlapping_gaps(args.dir, args.symbol, to_epoch_ms(start), to_epoch_ms(end)):
+            print(f"⚠️ 数据不完整: {gap['start']} -> {gap['end']} ({gap['reason']})")
+
+    started = time.time()
+    df = load_tape(args.symbol, args.dir, end, args.format, args.workers)
+    loaded = time.time()
+    if df.empty:
+        print("没有找到符合条件的成交。")
+        return
+    board = cohort_leaderboard(df, start, args.method, args.mark_price)
+    print(f"📊 {args.symbol}: {len(df)} 笔成交, {len(board)} 个地址, 读取 {loaded - started:.2f}秒, "
+          f"计算 {time.time() - loaded:.2f}秒")
+
+    ranked = rank(board, args.sort)
+    with pd.option_context('display.max_rows', None, 'display.max_columns', None, 'display.width', None):
+        print(rank(board, args.sort, args.top).to_string(index=False))
+    if args.out:
+        if args.out.endswith(".parquet"):
+            ranked.to_parquet(args.out, index=False)
+        else:
+            ranked.to_csv(args.out, index=False)
+        print(f"\n✅ 排行榜已保存至: {args.out}")
+
+
+if __name__ == "__main__":
+    main()
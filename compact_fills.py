@@ -0,0 +1,175 @@
+# 合并成交记录：把每次启动产生的会话CSV合并为 每代币每天 一个排序、去重、压缩后的文件
+# 输出: {out}/{YYYY_MM_DD}_{coin}_trade_data.csv.gz  以及 {out}/manifest.json
+import argparse
+import gzip
+import io
+import json
+import os
+import shutil
+import tempfile
+import time
+from datetime import datetime
+
+# pandas 在用到的函数内导入，--help 不需要加载它
+from fill_sink import FILL_HEADERS
+from fill_catalog import FillCatalog, MANIFEST_FILENAME, SESSION_PATTERN, SessionSlice, complete_bytes, load_manifest
+
+COMPRESSION_SUFFIX = {"gzip": ".gz", "zstd": ".zst"}
+GZIP_BLOCK_ROWS = 20000  # gzip 按块独立压缩（多个 member 拼接），地址索引可以只解压需要的块
+
+
+def daily_filename(day, coin, compression):
+    return f"{day}_{coin}_trade_data.csv{COMPRESSION_SUFFIX[compression]}"
+
+
+def save_manifest(out_dir, manifest):
+    path = os.path.join(out_dir, MANIFEST_FILENAME)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def find_session_files(folder, coins=None, min_age=300):
+    """返回 {coin: [会话文件路径]}，跳过最近仍在写入的文件"""
+    now = time.time()
+    result = {}
+    for name in sorted(os.listdir(folder)):
+        match = SESSION_PATTERN.match(name)
+        if not match:
+            continue
+        coin = match.group(2)
+        if coins and coin not in coins:
+            continue
+        path = os.path.join(folder, name)
+        if now - os.path.getmtime(path) < min_age:
+            print(f"跳过正在写入的文件: {name}")
+            continue
+        result.setdefault(coin, []).append(path)
+    return result
+
+
+def stage_by_day(files, staging_dir, chunksize=500000):
+    """把会话文件按天拆分到临时文件，返回 {day: 临时文件路径}
+    files 为 {路径: (开始字节, 结束字节)}，只读取这一段（上次合并之后新增的完整行）"""
+    import pandas as pd
+    staged = {}
+    for file, (start, end) in files.items():
+        with io.BufferedReader(SessionSlice(file, start, end)) as source:
+            for chunk in pd.read_csv(source, dtype=str, keep_default_na=False, chunksize=chunksize):
+                chunk = chunk[chunk['time'] != ""]
+                days = chunk['time'].str.slice(0, 10).str.replace('-', '_')
+                for day, rows in chunk.groupby(days, sort=False):
+                    path = staged.setdefault(day, os.path.join(staging_dir, f"{day}.csv"))
+                    rows.to_csv(path, mode='a', index=False, header=not os.path.exists(path), columns=FILL_HEADERS)
+    return staged
+
+
+def compact_day(coin, day, staged_path, out_dir, compression, manifest):
+    """合并某一天的数据（包括已有的每日文件），排序去重后写出"""
+    import pandas as pd
+    name = daily_filename(day, coin, compression)
+    out_path = os.path.join(out_dir, name)
+    frames = [pd.read_csv(staged_path, dtype=str, keep_default_na=False)]
+    if os.path.exists(out_path):
+        frames.append(pd.read_csv(out_path, dtype=str, keep_default_na=False, compression=compression))
+    df = pd.concat(frames, ignore_index=True)
+
+    df['_time'] = pd.to_datetime(df['time'], format='ISO8601')
+    df['_tid'] = pd.to_numeric(df['tid'], errors='coerce')
+    df = df.drop_duplicates(subset=['_tid'], keep='first')
+    df = df.sort_values(['_time', '_tid'], kind='stable')
+
+    tmp_path = out_path + ".tmp"
+    blocks = None
+    if compression == "gzip":
+        blocks = write_blocked_gzip(df[FILL_HEADERS], tmp_path)
+    else:
+        df.to_csv(tmp_path, index=False, columns=FILL_HEADERS, compression=compression)
+    os.replace(tmp_path, out_path)
+
+    first, last = df['_time'].iloc[0], df['_time'].iloc[-1]
+    manifest["files"][name] = {
+        "coin": coin,
+        "day": day,
+        "path": out_path,
+        "first_time": first.isoformat(),
+        "last_time": last.isoformat(),
+        "first_ms": int(first.to_pydatetime().timestamp() * 1000),
+        "last_ms": int(last.to_pydatetime().timestamp() * 1000),
+        "rows": int(len(df)),
+        "size": os.path.getsize(out_path),
+    }
+    if blocks is not None:
+        manifest["files"][name]["blocks"] = blocks
+    return len(df)
+
+
+def write_blocked_gzip(df, path, block_rows=GZIP_BLOCK_ROWS):
+    """每 block_rows 行压缩为一个独立的 gzip member，返回各块的起始字节偏移（最后一个为文件大小）"""
+    offsets = [0]
+    with open(path, "wb") as f:
+        for start in range(0, max(len(df), 1), block_rows):
+            text = df.iloc[start:start + block_rows].to_csv(index=False, header=(start == 0))
+            f.write(gzip.compress(text.encode("utf-8")))
+            offsets.append(f.tell())
+    return offsets
+
+
+def compact(folder, out_dir, coins=None, compression="gzip", min_age=300, delete_sources=False):
+    os.makedirs(out_dir, exist_ok=True)
+    manifest = load_manifest(out_dir)
+    sessions = find_session_files(folder, coins, min_age)
+
+    for coin, files in sessions.items():
+        # 在读取之前确定每个文件本次合并到哪里（最后一个完整行），manifest 记录的位置与已合并的数据严格一致；
+        # 已合并过且之后没有新增完整行的会话文件不再重复处理
+        ranges = {}
+        for f in files:
+            start, end = manifest["sources"].get(os.path.basename(f), 0), complete_bytes(f)
+            if end > start:
+                ranges[f] = (start, end)
+        files = list(ranges)
+        if not files:
+            continue
+        staging_dir = tempfile.mkdtemp(prefix=f"compact_{coin}_", dir=out_dir)
+        try:
+            staged = stage_by_day(ranges, staging_dir)
+            for day in sorted(staged):
+                rows = compact_day(coin, day, staged[day], out_dir, compression, manifest)
+                print(f"✅ {coin} {day}: {rows} 行")
+        finally:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+
+        for f in files:
+            manifest["sources"][os.path.basename(f)] = ranges[f][1]
+        save_manifest(out_dir, manifest)
+
+        if delete_sources:
+            for f in files:
+                os.remove(f)
+                print(f"🗑️ 删除已合并的会话文件: {f}")
+
+    # 输出目录是数据目录下的 daily 时，同步更新目录索引
+    if os.path.abspath(os.path.dirname(out_dir.rstrip(os.sep))) == os.path.abspath(folder):
+        FillCatalog(folder).refresh()
+    return manifest
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='合并成交记录会话文件为每日分区')
+    parser.add_argument('--dir', type=str, default="./trading_data_cache/fills", help='会话CSV所在目录')
+    parser.add_argument('--out', type=str, default="./trading_data_cache/fills/daily", help='每日分区输出目录')
+    parser.add_argument('--coins', type=str, default=None, help='只合并这些代币，逗号分隔，默认全部')
+    parser.add_argument('--compression', type=str, default="gzip", choices=list(COMPRESSION_SUFFIX), help='压缩格式，zstd 需要安装 zstandard')
+    parser.add_argument('--min_age', type=int, default=300, help='跳过最近N秒内修改过的文件（正在写入的会话），默认300')
+    parser.add_argument('--delete_sources', action='store_true', help='合并完成后删除会话文件')
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    coins = [c.strip() for c in args.coins.split(",")] if args.coins else None
+    start = time.time()
+    manifest = compact(args.dir, args.out, coins, args.compression, args.min_age, args.delete_sources)
+    print(f"manifest: {os.path.join(args.out, MANIFEST_FILENAME)} ({len(manifest['files'])} 个文件) 耗时 {time.time() - start:.2f}秒 @ {datetime.now().isoformat(timespec='seconds')}")
@@ -1,49 +1,113 @@
 import websocket 
 import json 
-import csv 
 import time 
 from datetime import datetime 
 import threading 
 import argparse
 import os
+import re
+from fill_sink import BatchCsvSink, FILL_HEADERS, LOG_TRADES
+from fill_integrity import FillIntegrity
+from fill_catalog import FillCatalog
+from fill_pipeline import FramePipeline, POLICY_BLOCK, POLICY_DROP
 
 # 配置文件参数 
 def parse_args():
     parser = argparse.ArgumentParser(description="Hyperliquid WebSocket Data Logger")
     parser.add_argument("--coin", type=str, default="BTC", help="Coin to subscribe to, default: BTC")
+    parser.add_argument("--coins", type=str, default=None, help="Comma separated coins (e.g. BTC,ETH,SOL) or 'all' for every listed perp; overrides --coin")
     parser.add_argument("--folder", type=str, default="./trading_data_cache/fills", help="Directory to save data, default: ./trading_data_cache/fills")
+    parser.add_argument("--batch_size", type=int, default=500, help="Rows per disk write, default: 500")
+    parser.add_argument("--flush_interval", type=float, default=0.2, help="Max seconds before buffered rows are written, default: 0.2")
+    parser.add_argument("--verbose", type=int, default=1, choices=[0, 1, 2], help="0: errors only, 1: throughput stats, 2: every trade and frame, default: 1")
+    parser.add_argument("--format", type=str, default="csv", choices=["csv", "columnar", "both"], help="Storage format: csv, columnar (numpy, partitioned by coin/hour) or both, default: csv")
+    parser.add_argument("--dedup_capacity", type=int, default=20000, help="Recent tids kept per coin for duplicate detection, default: 20000")
+    parser.add_argument("--idle_gap", type=float, default=0, help="Also record a gap when a coin has no trades for this many seconds, default: 0 (off)")
+    parser.add_argument("--pipeline", action="store_true", help="Decode and persist frames on worker threads instead of the websocket thread")
+    parser.add_argument("--workers", type=int, default=1, help="Worker threads in pipeline mode; each coin is pinned to one worker so its rows stay in time order, default: 1")
+    parser.add_argument("--queue_size", type=int, default=10000, help="Max queued frames in pipeline mode, default: 10000")
+    parser.add_argument("--queue_policy", type=str, default=POLICY_BLOCK, choices=[POLICY_BLOCK, POLICY_DROP], help="What to do when the queue is full, default: block")
+    parser.add_argument("--leaderboard", action="store_true", help="Keep live per-address PnL (average cost, marked to the last trade) and publish a top-K leaderboard")
+    parser.add_argument("--top_k", type=int, default=20, help="Leaderboard size, default: 20")
+    parser.add_argument("--leaderboard_interval", type=float, default=60, help="Seconds between leaderboard publishes and checkpoints, default: 60")
+    parser.add_argument("--leaderboard_feishu", action="store_true", help="Also send the leaderboard to Feishu (WEBHOOK_URL)")
     return parser.parse_args()
 
 ARGS = parse_args()
 WEBSOCKET_URL = "wss://api.hyperliquid.xyz/ws"
 RECONNECT_DELAY = 5  # 断线重连等待时间(秒)
 PROGRAM_START_TIME = datetime.now().strftime("%Y_%m_%dT%H_%M_%S")
-CSV_FILENAME = f"{ARGS.folder}/{PROGRAM_START_TIME}_{ARGS.coin}_trade_data.csv"
+INFO_URL = "https://api.hyperliquid.xyz/info"
+SUBSCRIBE_ACK_TIMEOUT = 10  # 订阅确认超时时间(秒)
+COUNTER_REPORT_INTERVAL = 60  # 各代币计数打印间隔(秒)
+
+def csv_filename(coin):
+    return f"{ARGS.folder}/{PROGRAM_START_TIME}_{coin}_trade_data.csv"
+
+def fetch_all_perps():
+    """从 meta 接口获取所有未下架的永续合约"""
+    import requests  # 只有 --coins all 用到
+    response = requests.post(INFO_URL, json={"type": "meta"}, timeout=10)
+    response.raise_for_status()
+    universe = response.json()["universe"]
+    return [asset["name"] for asset in universe if not asset.get("isDelisted")]
+
+def resolve_coins(args):
+    """解析 --coins / --coin 参数"""
+    if not args.coins:
+        return [args.coin]
+    if args.coins.strip().lower() == "all":
+        return fetch_all_perps()
+    return [c.strip() for c in args.coins.split(",") if c.strip()]
+
+COIN_FIELD = re.compile(r'"coin"\s*:\s*"([^"]*)"')
+
+def frame_coin(message):
+    """流水线按代币分配工作线程：不解析整条消息，只取第一个 coin 字段（每条 trades 消息只有一个代币）
+    同一代币的消息由同一个线程按到达顺序写盘，会话CSV保持时间顺序"""
+    match = COIN_FIELD.search(message)
+    return match.group(1) if match else None
 
 class HyperliquidWebSocket:
-    def __init__(self, coin):
+    def __init__(self, coins):
         self.ws = None
         self.connected = False
         self.reconnect_flag = False
-        self.coin = coin
-        self.DATA_DIR = "./trading_data_cache/fills"
-        os.makedirs(self.DATA_DIR, exist_ok=True)
-        self.CSV_FILENAME = CSV_FILENAME
-        self.csv_file = open(self.CSV_FILENAME, 'a', newline='', encoding='utf-8')
-        self.csv_writer = None
-        self._init_csv()
-        
-    def _init_csv(self):
-        """初始化CSV文件和写入头"""
-        headers = ["coin", "px", "sz", "side", "time", "user1", "user2", "hash", "tid"]
-        # 检查文件是否为空以决定是否写表头 
-        self.csv_file.seek(0,  2)
-        if self.csv_file.tell()  == 0:
-            self.csv_writer  = csv.DictWriter(self.csv_file,  fieldnames=headers)
-            self.csv_writer.writeheader() 
-            self.csv_file.flush() 
-        else:
-            self.csv_writer  = csv.DictWriter(self.csv_file,  fieldnames=headers)
+        self.coins = coins
+        self.verbose = ARGS.verbose
+        self.lock = threading.Lock()
+        # 订阅确认状态和各代币计数
+        self.acked = set()
+        self.counters = {coin: {"frames": 0, "trades": 0, "first_time": 0, "last_time": 0} for coin in coins}
+        # 每个代币一个批量写盘的CSV（收到第一笔交易时创建）
+        self.sinks = {}
+        # tid 去重和断线缺口检测，状态保存在数据目录
+        self.integrity = FillIntegrity(ARGS.folder, capacity=ARGS.dedup_capacity, idle_threshold=ARGS.idle_gap)
+        self.open_count = 0
+        # 文件目录索引，分析工具据此按时间区间查找文件
+        self.catalog = FillCatalog(ARGS.folder)
+        # 列式存储：按代币和小时分区
+        self.columnar = None
+        if ARGS.format in ("columnar", "both"):
+            # 列式存储依赖 numpy，只在启用时导入
+            from fill_store import ColumnarSink
+            self.columnar = ColumnarSink(ARGS.folder, session=PROGRAM_START_TIME, verbose=ARGS.verbose)
+        # 实时盈亏排行榜：状态从数据目录中的检查点恢复
+        self.leaderboard = None
+        if ARGS.leaderboard:
+            from live_leaderboard import LiveLeaderboard
+            self.leaderboard = LiveLeaderboard(ARGS.folder, top_k=ARGS.top_k, verbose=ARGS.verbose)
+        # 流水线模式：接收线程只入队原始消息
+        self.pipeline = None
+        if ARGS.pipeline:
+            self.pipeline = FramePipeline(
+                self._handle_frame,
+                workers=ARGS.workers,
+                maxsize=ARGS.queue_size,
+                policy=ARGS.queue_policy,
+                verbose=ARGS.verbose,
+                key=frame_coin,
+            )
  
     def _connect(self):
         """建立WebSocket连接"""
@@ -64,32 +128,153 @@ class HyperliquidWebSocket:
         """连接建立时的回调"""
         self.connected  = True 
         print(f"✅ WebSocket连接成功 @ {datetime.now().isoformat()}") 
-        # 订阅所有交易数据 
+        self.open_count += 1
+        if self.open_count > 1:
+            # 重连后的第一批数据需要检查是否与断线前衔接
+            self.integrity.mark_reconnect()
+        # 同一个连接上订阅所有代币的交易数据
+        with self.lock:
+            self.acked.clear()
+        for coin in self.coins:
+            self._subscribe(ws, coin)
+        print(f"📡 已发送 {len(self.coins)} 个代币的订阅请求")
+        timer = threading.Timer(SUBSCRIBE_ACK_TIMEOUT, self._check_acks, args=(ws,))
+        timer.daemon = True
+        timer.start()
+
+    def _subscribe(self, ws, coin):
         subscribe_msg = {
             "method": "subscribe",
-            "subscription": {"type": "trades", "coin": self.coin}
+            "subscription": {"type": "trades", "coin": coin}
         }
-        ws.send(json.dumps(subscribe_msg)) 
-        print("📡 已订阅所有交易数据")
+        ws.send(json.dumps(subscribe_msg))
+
+    def _check_acks(self, ws):
+        """检查订阅确认，未确认的代币重新订阅一次"""
+        if ws is not self.ws or not self.connected:
+            return
+        with self.lock:
+            missing = [coin for coin in self.coins if coin not in self.acked]
+        if not missing:
+            print(f"📡 {len(self.coins)} 个代币订阅均已确认")
+            return
+        print(f"⚠️ {len(missing)} 个代币未收到订阅确认，重新订阅: {','.join(missing)}")
+        try:
+            for coin in missing:
+                self._subscribe(ws, coin)
+        except Exception as e:
+            print(f"❌ 重新订阅失败: {e}")
  
     def on_message(self, ws, message):
         """处理收到的消息"""
+        if self.pipeline:
+            self.pipeline.submit(message)
+            return
+        self._handle_frame(message)
+
+    def _handle_frame(self, message):
+        """解析消息并写入交易记录"""
         try:
             json_data = json.loads(message)
-            print("Received data:", json_data)
+            if self.verbose >= LOG_TRADES:
+                print("Received data:", json_data)
 
-            if json_data.get("channel") == "trades" and "data" in json_data:
-                trades = json_data["data"]
-                for trade in trades:
-                    self._process_trade(trade)
+            channel = json_data.get("channel")
+            if channel == "trades" and "data" in json_data:
+                self._route_trades(json_data["data"])
+            elif channel == "subscriptionResponse":
+                subscription = json_data.get("data", {}).get("subscription", {})
+                if subscription.get("type") == "trades":
+                    with self.lock:
+                        self.acked.add(subscription.get("coin"))
+            elif channel == "error":
+                print(f"❌ 服务端错误: {json_data.get('data')}")
 
         except json.JSONDecodeError as e:
             print("JSON 解析错误:", e)
         except Exception as e:
             print("消息处理错误:", e)
 
+    def _route_trades(self, trades):
+        """按代币分组，写入对应代币的存储并更新计数"""
+        by_coin = {}
+        for trade in trades:
+            by_coin.setdefault(trade.get("coin", ""), []).append(trade)
+        for coin, coin_trades in by_coin.items():
+            coin_trades = self.integrity.filter(coin, coin_trades)
+            if not coin_trades:
+                continue
+            with self.lock:
+                counter = self.counters.setdefault(coin, {"frames": 0, "trades": 0, "first_time": 0, "last_time": 0})
+                counter["frames"] += 1
+                counter["trades"] += len(coin_trades)
+                first = min(t.get("time", 0) for t in coin_trades)
+                counter["first_time"] = min(counter["first_time"], first) if counter["first_time"] else first
+                counter["last_time"] = max(counter["last_time"], max(t.get("time", 0) for t in coin_trades))
+            sink = self._get_sink(coin)
+            if sink:
+                sink.write_many([self._build_row(trade) for trade in coin_trades])
+            if self.columnar:
+                self.columnar.write_many(coin_trades)
+            if self.leaderboard:
+                self.leaderboard.update(coin, coin_trades)
+
+    def _get_sink(self, coin):
+        if ARGS.format not in ("csv", "both"):
+            return None
+        with self.lock:
+            sink = self.sinks.get(coin)
+            if sink is None:
+                # 批量写盘：按行数或时间阈值刷新，避免每笔交易一次 flush
+                sink = BatchCsvSink(
+                    csv_filename(coin),
+                    headers=FILL_HEADERS,
+                    batch_size=ARGS.batch_size,
+                    flush_interval=ARGS.flush_interval,
+                    verbose=ARGS.verbose,
+                )
+                self.sinks[coin] = sink
+            return sink
+
     def _process_trade(self, trade_data):
         """处理单个交易并保存到CSV"""
+        self._route_trades([trade_data])
+
+    def update_catalog(self):
+        """把本次会话的CSV文件登记到目录索引"""
+        with self.lock:
+            items = [(coin, sink, dict(self.counters[coin])) for coin, sink in self.sinks.items()]
+        for coin, sink, counter in items:
+            if counter["trades"] == 0 or not os.path.exists(sink.path):
+                continue
+            self.catalog.register(sink.path, coin, counter["first_time"], counter["last_time"], sink.total_rows)
+        if items:
+            self.catalog.save()
+
+    def publish_leaderboard(self):
+        """发布排行榜并写检查点"""
+        if not self.leaderboard:
+            return
+        try:
+            self.leaderboard.publish(feishu=ARGS.leaderboard_feishu)
+            self.leaderboard.checkpoint()
+        except Exception as e:
+            print(f"❌ 排行榜发布失败: {e}")
+
+    def report_counters(self):
+        """打印各代币的成交计数"""
+        with self.lock:
+            items = sorted(self.counters.items(), key=lambda kv: -kv[1]["trades"])
+            acked = len(self.acked)
+        print(f"📈 {datetime.now().strftime('%H:%M:%S')} 已确认订阅 {acked}/{len(self.coins)} | 重复丢弃 {self.integrity.duplicates}")
+        for coin, c in items:
+            if c["trades"] == 0:
+                continue
+            last = datetime.fromtimestamp(c["last_time"] / 1000).strftime('%H:%M:%S')
+            print(f"   {coin:<10} 成交 {c['trades']:>10} | 消息 {c['frames']:>8} | 最新 {last}")
+
+    def _build_row(self, trade_data):
+        """把单个交易转换为CSV行"""
         # 提取字段（注意：users 是列表）
         coin = trade_data.get("coin", "")
         side = trade_data.get("side", "")
@@ -103,8 +288,7 @@ class HyperliquidWebSocket:
         # 转换时间戳（毫秒转为 ISO 时间格式）
         timestamp = datetime.fromtimestamp(time_ms / 1000).isoformat()
 
-        # 写入CSV行
-        csv_row = {
+        return {
             "coin": coin,
             "px": px,
             "sz": sz,
@@ -115,10 +299,6 @@ class HyperliquidWebSocket:
             "hash": hash_value,
             "tid": tid,
         }
-
-        self.csv_writer.writerow(csv_row)
-        self.csv_file.flush()
-        print(f"📝 已记录交易: {coin} @ {px}")
  
     def on_error(self, ws, error):
         """错误处理"""
@@ -140,8 +320,11 @@ class HyperliquidWebSocket:
  
     def start(self):
         """启动服务"""
-        print(f"🚀 启动Hyperliquid交易记录器")
-        print(f"💾 数据将保存至: {CSV_FILENAME}")
+        print(f"🚀 启动Hyperliquid交易记录器: {','.join(self.coins)}")
+        if ARGS.format in ("csv", "both"):
+            print(f"💾 数据将保存至: {csv_filename('{coin}')}")
+        if self.columnar:
+            print(f"💾 列式数据将保存至: {self.columnar.root}")
         self._connect()
  
     def graceful_shutdown(self):
@@ -149,12 +332,20 @@ class HyperliquidWebSocket:
         self.reconnect_flag  = True 
         if self.ws: 
             self.ws.close() 
-        self.csv_file.close() 
+        if self.pipeline:
+            self.pipeline.close()
+        for sink in self.sinks.values():
+            sink.close()
+        self.update_catalog()
+        self.integrity.save()
+        if self.columnar:
+            self.columnar.close()
+        self.publish_leaderboard()
         print("🛑 服务已安全关闭")
  
 # 运行主程序 
 if __name__ == "__main__":
-    client = HyperliquidWebSocket(coin=ARGS.coin)
+    client = HyperliquidWebSocket(coins=resolve_coins(ARGS))
     
     try:
         # 在独立线程中运行 
@@ -163,8 +354,18 @@ if __name__ == "__main__":
         thread.start() 
         
         # 主线程保持运行 
+        last_report = time.time()
+        last_publish = time.time()
         while True:
             time.sleep(1) 
+            if time.time() - last_report >= COUNTER_REPORT_INTERVAL:
+                if ARGS.verbose >= 1:
+                    client.report_counters()
+                client.update_catalog()
+                last_report = time.time()
+            if client.leaderboard and time.time() - last_publish >= ARGS.leaderboard_interval:
+                client.publish_leaderboard()
+                last_publish = time.time()
         
     except KeyboardInterrupt:
         print("\n🛑 接收到中断信号，关闭服务...")
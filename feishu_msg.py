@@ -1,8 +1,8 @@
-import requests
 import os
 import json
 import time
 def send_feishu_text(title: str, content: str):
+    import requests
     headers = {"Content-Type": "application/json"}
     payload = {
         "msg_type": "text",
@@ -0,0 +1,305 @@
+# 成交文件目录索引：记录每个文件的代币、首末成交时间、行数和大小
+# 代替 listdir + strptime 的文件名猜测，按时间区间做二分查找
+import bisect
+import csv
+import gzip
+import io
+import json
+import os
+import re
+import threading
+from datetime import datetime
+
+CATALOG_FILENAME = "catalog.json"
+MANIFEST_FILENAME = "manifest.json"
+DAILY_SUBDIR = "daily"
+# 会话文件: 2025_06_16T02_07_56_ETH_trade_data.csv  每日文件: daily/2025_06_16_ETH_trade_data.csv.gz
+SESSION_PATTERN = re.compile(r'^(\d{4}_\d{1,2}_\d{1,2}T\d{1,2}_\d{1,2}_\d{1,2})_(.+)_trade_data\.csv$')
+DAILY_PATTERN = re.compile(r'^(\d{4}_\d{2}_\d{2})_(.+)_trade_data\.csv\.(gz|zst)$')
+
+
+def load_manifest(out_dir):
+    """读取 compact_fills.py 生成的 manifest"""
+    path = os.path.join(out_dir, MANIFEST_FILENAME)
+    if not os.path.exists(path):
+        return {"files": {}, "sources": {}}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def complete_bytes(path, window=1 << 16):
+    """文件中完整行的字节数（到最后一个换行符为止），记录器正在写入的半行不计"""
+    with open(path, "rb") as f:
+        end = f.seek(0, 2)
+        while end > 0:
+            start = max(0, end - window)
+            f.seek(start)
+            newline = f.read(end - start).rfind(b"\n")
+            if newline >= 0:
+                return start + newline + 1
+            end = start
+    return 0
+
+
+_SOURCES_CACHE = {}  # manifest 路径 -> (修改时间, sources)
+
+
+def compacted_bytes(path):
+    """会话CSV开头已被 compact_fills 合并进每日文件的字节数（manifest 的 sources），未合并或不是会话文件时为 0
+    合并后记录器继续追加的行在该位置之后，读取会话文件时应从这里开始，避免与每日文件重复"""
+    folder, name = os.path.split(os.path.abspath(path))
+    if not SESSION_PATTERN.match(name):
+        return 0
+    manifest_path = os.path.join(folder, DAILY_SUBDIR, MANIFEST_FILENAME)
+    try:
+        mtime = os.path.getmtime(manifest_path)
+    except OSError:
+        return 0
+    cached = _SOURCES_CACHE.get(manifest_path)
+    if cached is None or cached[0] != mtime:
+        cached = (mtime, load_manifest(os.path.dirname(manifest_path)).get("sources", {}))
+        _SOURCES_CACHE[manifest_path] = cached
+    return int(cached[1].get(name, 0))
+
+
+class SessionSlice(io.RawIOBase):
+    """会话CSV的 表头 + [start, end) 字节，按需读取不整体载入内存；start 不足表头长度时从表头之后开始"""
+
+    def __init__(self, path, start=0, end=None):
+        self.file = open(path, "rb")
+        self.pending = self.file.readline()
+        size = os.path.getsize(path) if end is None else end
+        start = max(start, len(self.pending))
+        self.file.seek(start)
+        self.remaining = max(size - start, 0)
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        if self.pending:
+            n = min(len(buffer), len(self.pending))
+            buffer[:n] = self.pending[:n]
+            self.pending = self.pending[n:]
+            return n
+        data = self.file.read(min(len(buffer), self.remaining))
+        buffer[:len(data)] = data
+        self.remaining -= len(data)
+        return len(data)
+
+    def close(self):
+        self.file.close()
+        super().close()
+
+
+def open_uncompacted(path):
+    """读取会话CSV中尚未合并的部分，返回文件对象；其他文件原样打开（由 pandas 按扩展名解压）"""
+    offset = compacted_bytes(path)
+    if not offset:
+        return path
+    return io.BufferedReader(SessionSlice(path, offset, complete_bytes(path)))
+
+
+def _time_to_ms(value):
+    return int(datetime.fromisoformat(value).timestamp() * 1000)
+
+
+def _open_text(path):
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8", newline="")
+    if path.endswith(".zst"):
+        import zstandard
+        return io.TextIOWrapper(zstandard.open(path, "rb"), encoding="utf-8", newline="")
+    return open(path, "r", encoding="utf-8", newline="")
+
+
+def scan_csv(path):
+    """读取首行和末行得到首末成交时间，统计行数"""
+    with _open_text(path) as f:
+        header = next(csv.reader([f.readline()]), None)
+        if not header or "time" not in header:
+            return None
+        time_idx = header.index("time")
+        first_line = f.readline()
+        if not first_line.strip():
+            return None
+        first = next(csv.reader([first_line]))[time_idx]
+
+    if path.endswith(".csv"):
+        # 未压缩文件：从末尾读取最后一行，按块统计换行数
+        with open(path, "rb") as f:
+            f.seek(0, 2)
+            size = f.tell()
+            f.seek(max(0, size - 8192))
+            tail = f.read().decode("utf-8", errors="ignore")
+            # 记录器正在写入的最后半行不算
+            tail = tail.splitlines() if tail.endswith("\n") else tail.splitlines()[:-1]
+            f.seek(0)
+            rows = -1
+            for block in iter(lambda: f.read(1 << 20), b""):
+                rows += block.count(b"\n")
+        last_line = next(line for line in reversed(tail) if line.strip())
+    else:
+        rows = 0
+        last_line = first_line
+        with _open_text(path) as f:
+            f.readline()
+            for line in f:
+                if line.strip():
+                    rows += 1
+                    last_line = line
+    last = next(csv.reader([last_line]))[time_idx]
+    return {
+        "first_time": first,
+        "last_time": last,
+        "first_ms": _time_to_ms(first),
+        "last_ms": _time_to_ms(last),
+        "rows": rows,
+    }
+
+
+class FillCatalog:
+    """持久化的成交文件索引，按代币维护按开始时间排序的区间列表"""
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.path = os.path.join(folder, CATALOG_FILENAME)
+        self.entries = {}  # 相对路径 -> 记录
+        self.lock = threading.Lock()
+        self._index = None
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                self.entries = json.load(f).get("files", {})
+        except (OSError, ValueError) as e:
+            print(f"⚠️ 读取目录索引失败，将重新扫描: {e}")
+            self.entries = {}
+
+    def save(self):
+        with self.lock:
+            data = {"updated_at": datetime.now().isoformat(timespec="seconds"), "files": self.entries}
+            tmp_path = self.path + f".{os.getpid()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(data, f)
+            os.replace(tmp_path, self.path)
+
+    def register(self, path, coin, first_ms, last_ms, rows):
+        """记录器写文件时直接登记（不需要重新扫描文件）"""
+        rel = os.path.relpath(path, self.folder)
+        with self.lock:
+            stat = os.stat(path)
+            self.entries[rel] = {
+                "coin": coin,
+                "path": rel,
+                "first_time": datetime.fromtimestamp(first_ms / 1000).isoformat(),
+                "last_time": datetime.fromtimestamp(last_ms / 1000).isoformat(),
+                "first_ms": int(first_ms),
+                "last_ms": int(last_ms),
+                "rows": int(rows),
+                "size": stat.st_size,
+                "mtime": stat.st_mtime,
+            }
+            self._index = None
+
+    def refresh(self):
+        """增量更新：只扫描新增或大小/修改时间变化的文件，移除已删除的文件"""
+        found = {}
+        for name in os.listdir(self.folder):
+            match = SESSION_PATTERN.match(name)
+            if match:
+                found[name] = match.group(2)
+
+        # 已被合并的会话文件由每日文件代替，避免重复数据；合并后记录器又追加了数据的会话文件仍然保留，
+        # 读取时只读合并位置之后的部分（open_uncompacted），直到下次合并
+        daily_dir = os.path.join(self.folder, DAILY_SUBDIR)
+        manifest = {"files": {}, "sources": {}}
+        if os.path.isdir(daily_dir):
+            manifest = load_manifest(daily_dir)
+            for name in os.listdir(daily_dir):
+                match = DAILY_PATTERN.match(name)
+                if match:
+                    found[os.path.join(DAILY_SUBDIR, name)] = match.group(2)
+        sources = manifest.get("sources", {})
+
+        def compacted(rel):
+            """会话文件已被合并且之后没有再追加完整的行"""
+            if os.path.dirname(rel) != "" or rel not in sources:
+                return False
+            try:
+                return complete_bytes(os.path.join(self.folder, rel)) <= sources[rel]
+            except OSError:
+                return False
+
+        changed = False
+        with self.lock:
+            for rel in list(self.entries):
+                if rel not in found or compacted(rel):
+                    del self.entries[rel]
+                    changed = True
+
+            for rel, coin in found.items():
+                if compacted(rel):
+                    continue
+                full = os.path.join(self.folder, rel)
+                stat = os.stat(full)
+                old = self.entries.get(rel)
+                if old and old["size"] == stat.st_size and old["mtime"] == stat.st_mtime:
+                    continue
+                info = manifest["files"].get(os.path.basename(rel)) if rel.startswith(DAILY_SUBDIR) else None
+                if info is None or info.get("size") != stat.st_size:
+                    info = scan_csv(full)
+                if info is None:
+                    continue
+                self.entries[rel] = {
+                    "coin": coin,
+                    "path": rel,
+                    "first_time": info["first_time"],
+                    "last_time": info["last_time"],
+                    "first_ms": info["first_ms"],
+                    "last_ms": info["last_ms"],
+                    "rows": info["rows"],
+                    "size": stat.st_size,
+                    "mtime": stat.st_mtime,
+                }
+                changed = True
+            if changed:
+                self._index = None
+        if changed:
+            self.save()
+        return self
+
+    def _build_index(self):
+        """每个代币: 按 first_ms 排序的记录、first_ms 列表、last_ms 前缀最大值"""
+        index = {}
+        for entry in self.entries.values():
+            index.setdefault(entry["coin"], []).append(entry)
+        for coin, entries in index.items():
+            entries.sort(key=lambda e: (e["first_ms"], e["path"]))
+            starts = [e["first_ms"] for e in entries]
+            running_max = []
+            current = None
+            for e in entries:
+                current = e["last_ms"] if current is None else max(current, e["last_ms"])
+                running_max.append(current)
+            index[coin] = (entries, starts, running_max)
+        self._index = index
+
+    def lookup(self, coin, start_ms=None, end_ms=None):
+        """返回与 [start_ms, end_ms] 相交的文件（绝对路径），按开始时间排序"""
+        with self.lock:
+            if self._index is None:
+                self._build_index()
+            if coin not in self._index:
+                return []
+            entries, starts, running_max = self._index[coin]
+        hi = len(entries) if end_ms is None else bisect.bisect_right(starts, end_ms)
+        lo = 0 if start_ms is None else bisect.bisect_left(running_max, start_ms)
+        return [os.path.join(self.folder, e["path"]) for e in entries[lo:hi]
+                if start_ms is None or e["last_ms"] >= start_ms]
+
+    def entry(self, path):
+        return self.entries.get(os.path.relpath(path, self.folder))
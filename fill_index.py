@@ -0,0 +1,303 @@
+# 地址倒排索引：地址 -> 该地址在每个成交文件中的行位置，查询单个钱包时只读取属于它的行
+# 索引目录: {folder}/index/{文件键}/ 下保存排好序的 addresses、starts、pos(、block)，用 mmap 二分查找
+#   会话CSV: pos 为行首字节偏移，文件追加写入时只索引新增部分
+#   每日 gzip 文件(compact_fills.py 按块压缩): block 为块号，pos 为块内行号，只解压命中的块
+import io
+import json
+import os
+import threading
+import zlib
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from fill_catalog import DAILY_SUBDIR, compacted_bytes, load_manifest
+
+INDEX_SUBDIR = "index"
+INDEX_STATE = "files.json"
+ADDRESS_DTYPE = "S42"
+
+
+def _index_key(rel):
+    return rel.replace(os.sep, "__")
+
+
+def _build_postings(addresses, pos, block):
+    """把 (地址, 位置) 对按地址分组，返回 去重排序的地址/starts/pos/block"""
+    unique, codes = np.unique(addresses, return_inverse=True)
+    order = np.argsort(codes, kind="stable")
+    codes, pos, block = codes[order], pos[order], block[order]
+    starts = np.searchsorted(codes, np.arange(len(unique) + 1)).astype(np.int64)
+    return unique, starts, pos, block
+
+
+def _rows_to_postings(user1, user2, positions, blocks):
+    """同一行中 user1 和 user2 都记录一次（两者相同则只记一次）"""
+    same = user1 == user2
+    addresses = np.concatenate([user1, user2[~same]])
+    pos = np.concatenate([positions, positions[~same]])
+    block = np.concatenate([blocks, blocks[~same]])
+    return addresses, pos, block
+
+
+def _find_newline(data, window=1 << 16):
+    """第一个换行符的位置（表头结束），没有时返回 -1"""
+    start = 0
+    while start < len(data):
+        found = np.flatnonzero(data[start:start + window] == 10)
+        if len(found):
+            return start + int(found[0])
+        start += window
+    return -1
+
+
+def _read_blocks(path, blocks):
+    """按已知的块偏移逐块解压，产出每块的文本"""
+    with open(path, "rb") as f:
+        for block_id in range(len(blocks) - 1):
+            f.seek(blocks[block_id])
+            yield zlib.decompress(f.read(blocks[block_id + 1] - blocks[block_id]), wbits=31).decode("utf-8")
+
+
+def _walk_gzip_members(path, offsets, chunk_size=1 << 20):
+    """逐个解压文件中拼接的 gzip member，产出每个 member 的文本，并把各 member 的结束偏移追加到 offsets"""
+    with open(path, "rb") as f:
+        pending = b""
+        read = 0  # 已从文件读取的字节数，减去尚未解压的部分即当前 member 的结束偏移
+        while True:
+            decompressor = zlib.decompressobj(31)
+            parts = []
+            data = pending
+            while True:
+                if not data:
+                    data = f.read(chunk_size)
+                    if not data:
+                        break
+                    read += len(data)
+                parts.append(decompressor.decompress(data))
+                data = b""
+                if decompressor.eof:
+                    break
+            if not decompressor.eof:
+                if parts and any(parts):
+                    raise ValueError(f"gzip 文件不完整: {path}")
+                return
+            pending = decompressor.unused_data
+            offsets.append(read - len(pending))
+            yield b"".join(parts).decode("utf-8")
+
+
+class AddressIndex:
+    """按文件维护的地址倒排索引，新增文件或追加写入时增量更新"""
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.root = os.path.join(folder, INDEX_SUBDIR)
+        self.state_path = os.path.join(self.root, INDEX_STATE)
+        self.lock = threading.Lock()
+        self.state = {}
+        if os.path.exists(self.state_path):
+            with open(self.state_path, "r", encoding="utf-8") as f:
+                self.state = json.load(f)
+
+    def _save_state(self):
+        os.makedirs(self.root, exist_ok=True)
+        tmp_path = self.state_path + f".{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.state, f, indent=1)
+        os.replace(tmp_path, self.state_path)
+
+    def _dir(self, rel):
+        return os.path.join(self.root, _index_key(rel))
+
+    def _write(self, rel, addresses, starts, pos, block):
+        folder = self._dir(rel)
+        os.makedirs(folder, exist_ok=True)
+        np.save(os.path.join(folder, "addresses.npy"), addresses.astype(ADDRESS_DTYPE))
+        np.save(os.path.join(folder, "starts.npy"), starts)
+        np.save(os.path.join(folder, "pos.npy"), pos)
+        np.save(os.path.join(folder, "block.npy"), block)
+
+    def _read(self, rel, mmap_mode="r"):
+        folder = self._dir(rel)
+        return tuple(np.load(os.path.join(folder, f"{name}.npy"), mmap_mode=mmap_mode)
+                     for name in ("addresses", "starts", "pos", "block"))
+
+    def indexable(self, path):
+        return path.endswith(".csv") or path.endswith(".csv.gz")
+
+    def update(self, files):
+        """为新增或变化的文件建立/追加索引，返回更新的文件数"""
+        updated = 0
+        with self.lock:
+            for path in files:
+                if not self.indexable(path) or not os.path.exists(path):
+                    continue
+                rel = os.path.relpath(path, self.folder)
+                stat = os.stat(path)
+                old = self.state.get(rel)
+                if old and old["size"] == stat.st_size and old["mtime"] == stat.st_mtime:
+                    continue
+                if path.endswith(".csv"):
+                    entry = self._index_csv(rel, path, old)
+                else:
+                    try:
+                        entry = self._index_gzip(rel, path)
+                    except (OSError, ValueError, zlib.error) as e:
+                        # 不记录索引，load_address 把该文件作为未索引文件返回，由调用方扫描
+                        print(f"⚠️ 无法为 {rel} 建立索引，将全量扫描: {e}")
+                        if self.state.pop(rel, None) is not None:
+                            updated += 1
+                        continue
+                entry.update({"size": stat.st_size, "mtime": stat.st_mtime,
+                              "indexed_at": datetime.now().isoformat(timespec="seconds")})
+                self.state[rel] = entry
+                updated += 1
+            if updated:
+                self._save_state()
+        return updated
+
+    def _index_csv(self, rel, path, old):
+        """会话CSV：记录每行的字节偏移；文件只追加时只处理新增的完整行"""
+        data = np.memmap(path, dtype=np.uint8, mode="r") if os.path.getsize(path) else np.array([], dtype=np.uint8)
+        header_end = _find_newline(data)
+        if header_end < 0:
+            self._write(rel, np.array([], dtype=ADDRESS_DTYPE), np.zeros(1, dtype=np.int64),
+                        np.array([], dtype=np.int64), np.array([], dtype=np.int32))
+            return {"kind": "csv", "indexed_bytes": 0, "rows": 0}
+        header = bytes(data[:header_end + 1]).decode("utf-8")
+        first_row = header_end + 1
+
+        indexed = old["indexed_bytes"] if old and old.get("kind") == "csv" else 0
+        appending = bool(first_row < indexed <= len(data) and data[indexed - 1] == 10)
+        append_from = indexed if appending else first_row
+        # 只在新增部分查找换行，追加写入时的开销与新增数据量成正比；只索引完整的行（正在写入的最后一行忽略）
+        newlines = np.flatnonzero(data[append_from:] == 10) + append_from
+        if len(newlines):
+            row_starts = np.concatenate([[append_from], newlines[:-1] + 1]).astype(np.int64)
+            end = int(newlines[-1]) + 1
+        else:
+            row_starts = np.array([], dtype=np.int64)
+            end = append_from
+
+        if len(row_starts):
+            text = header + bytes(data[append_from:end]).decode("utf-8")
+            users = pd.read_csv(io.StringIO(text), usecols=["user1", "user2"], dtype=str, keep_default_na=False)
+            addresses, pos, block = _rows_to_postings(
+                users["user1"].values.astype(ADDRESS_DTYPE), users["user2"].values.astype(ADDRESS_DTYPE),
+                row_starts.astype(np.int64), np.full(len(row_starts), -1, dtype=np.int32))
+        else:
+            addresses = np.array([], dtype=ADDRESS_DTYPE)
+            pos = np.array([], dtype=np.int64)
+            block = np.array([], dtype=np.int32)
+
+        rows = len(row_starts)
+        if appending:
+            # 合并旧索引：旧位置都在新位置之前，按地址稳定排序后仍保持位置有序
+            old_addr, old_starts, old_pos, old_block = self._read(rel, mmap_mode=None)
+            old_expanded = np.repeat(old_addr, np.diff(old_starts))
+            addresses = np.concatenate([old_expanded, addresses])
+            pos = np.concatenate([old_pos, pos])
+            block = np.concatenate([old_block, block])
+            rows += old["rows"]
+
+        self._write(rel, *_build_postings(addresses, pos, block))
+        return {"kind": "csv", "indexed_bytes": end, "rows": rows}
+
+    def _index_gzip(self, rel, path):
+        """每日gzip文件：逐个 member 解压，记录 (块号, 块内行号)
+        块偏移取自 manifest；manifest 缺失或大小不一致（例如 compact 替换文件后尚未保存 manifest）时从文件中逐个 member 查找"""
+        blocks = None
+        if rel.startswith(DAILY_SUBDIR + os.sep):
+            info = load_manifest(os.path.join(self.folder, DAILY_SUBDIR))["files"].get(os.path.basename(rel), {})
+            if info.get("size") == os.path.getsize(path):
+                blocks = info.get("blocks")
+        if blocks:
+            members = _read_blocks(path, blocks)
+        else:
+            blocks = [0]
+            members = _walk_gzip_members(path, blocks)
+
+        addresses_list, pos_list, block_list = [], [], []
+        header = None
+        rows = 0
+        for block_id, text in enumerate(members):
+            skip = 0
+            if header is None:
+                header = text.split("\n", 1)[0] + "\n"
+                skip = 1
+            else:
+                text = header + text
+            users = pd.read_csv(io.StringIO(text), usecols=["user1", "user2"], dtype=str, keep_default_na=False)
+            line_no = np.arange(len(users), dtype=np.int64) + skip
+            addresses, pos, block = _rows_to_postings(
+                users["user1"].values.astype(ADDRESS_DTYPE), users["user2"].values.astype(ADDRESS_DTYPE),
+                line_no, np.full(len(users), block_id, dtype=np.int32))
+            addresses_list.append(addresses)
+            pos_list.append(pos)
+            block_list.append(block)
+            rows += len(users)
+
+        if addresses_list:
+            postings = _build_postings(np.concatenate(addresses_list), np.concatenate(pos_list),
+                                       np.concatenate(block_list))
+        else:
+            postings = _build_postings(np.array([], dtype=ADDRESS_DTYPE), np.array([], dtype=np.int64),
+                                       np.array([], dtype=np.int32))
+        self._write(rel, *postings)
+        return {"kind": "gzip", "blocks": blocks, "header": header, "rows": rows}
+
+    def postings(self, path, address):
+        """返回地址在文件中的 (pos, block)；地址按原样精确匹配（调用方负责统一大小写）；未建立索引返回 None"""
+        rel = os.path.relpath(path, self.folder)
+        if rel not in self.state:
+            return None
+        addresses, starts, pos, block = self._read(rel)
+        key = np.array([address], dtype=ADDRESS_DTYPE)[0]
+        i = int(np.searchsorted(addresses, key))
+        if i >= len(addresses) or addresses[i] != key:
+            return np.array([], dtype=np.int64), np.array([], dtype=np.int32)
+        return np.asarray(pos[starts[i]:starts[i + 1]]), np.asarray(block[starts[i]:starts[i + 1]])
+
+    def read_rows(self, path, address):
+        """只读取属于该地址的行，返回CSV文本（含表头）；未建立索引返回 None"""
+        found = self.postings(path, address)
+        if found is None:
+            return None
+        pos, block = found
+        entry = self.state[os.path.relpath(path, self.folder)]
+        lines = []
+        if entry["kind"] == "csv":
+            # 合并后又追加写入的会话文件，已合并的行由每日文件提供
+            pos = pos[pos >= compacted_bytes(path)]
+            with open(path, "rb") as f:
+                header = f.readline().decode("utf-8")
+                for offset in np.sort(pos):
+                    f.seek(int(offset))
+                    lines.append(f.readline().decode("utf-8"))
+        else:
+            header = entry["header"]
+            blocks = entry["blocks"]
+            with open(path, "rb") as f:
+                for block_id in np.unique(block):
+                    f.seek(blocks[block_id])
+                    text = zlib.decompress(f.read(blocks[block_id + 1] - blocks[block_id]), wbits=31).decode("utf-8")
+                    block_lines = text.splitlines(keepends=True)
+                    lines += [block_lines[n] for n in np.sort(pos[block == block_id])]
+        return header + "".join(lines)
+
+    def load_address(self, files, address, columns=None):
+        """读取一个地址在多个文件中的全部成交；未能索引的文件返回在第二个值中，由调用方扫描"""
+        frames = []
+        unindexed = []
+        for path in files:
+            text = self.read_rows(path, address)
+            if text is None:
+                unindexed.append(path)
+                continue
+            df = pd.read_csv(io.StringIO(text), usecols=columns, dtype={"px": np.float64, "sz": np.float64})
+            if len(df):
+                frames.append(df)
+        df = pd.concat(frames, ignore_index=True) if frames else None
+        return df, unindexed
@@ -0,0 +1,169 @@
+# 成交记录完整性：基于 tid 的去重和断线缺口检测
+import csv
+import json
+import os
+import threading
+from collections import deque
+from datetime import datetime
+
+STATE_FILENAME = ".logger_state.json"
+GAPS_FILENAME = "gaps.csv"
+GAP_HEADERS = ["coin", "start", "end", "start_ms", "end_ms", "reason", "detected_at"]
+
+
+class RecentTidSet:
+    """每个代币保留最近 capacity 个 tid，用于丢弃重连时重放的重复交易"""
+
+    def __init__(self, capacity=100000):
+        self.capacity = capacity
+        self.order = {}  # coin -> deque[tid]
+        self.seen = {}   # coin -> set[tid]
+
+    def add(self, coin, tid):
+        """tid 未出现过时记录并返回 True，重复时返回 False"""
+        seen = self.seen.setdefault(coin, set())
+        if tid in seen:
+            return False
+        order = self.order.setdefault(coin, deque())
+        seen.add(tid)
+        order.append(tid)
+        if len(order) > self.capacity:
+            seen.discard(order.popleft())
+        return True
+
+    def __contains__(self, key):
+        coin, tid = key
+        return tid in self.seen.get(coin, ())
+
+    def to_dict(self):
+        return {coin: list(order) for coin, order in self.order.items()}
+
+    def load_dict(self, data):
+        for coin, tids in data.items():
+            for tid in tids[-self.capacity:]:
+                self.add(coin, tid)
+
+
+class GapTracker:
+    """记录每个代币最后一笔交易时间，重连/重启后首批数据与之前不衔接时记录缺口"""
+
+    def __init__(self, folder, idle_threshold=0):
+        self.path = os.path.join(folder, GAPS_FILENAME)
+        self.idle_threshold_ms = int(idle_threshold * 1000)
+        self.last_time = {}  # coin -> 最后一笔交易时间(毫秒)
+        self.pending = {}    # coin -> 缺口原因（等待重连后的第一批数据）
+
+    def mark_reconnect(self, reason="reconnect"):
+        """连接重建后，所有已有数据的代币等待检查"""
+        for coin in self.last_time:
+            self.pending[coin] = reason
+
+    def check(self, coin, trades, overlapped):
+        """trades 为去重后的新交易，overlapped 表示本批数据与已记录数据有重叠"""
+        if not trades:
+            return None
+        first = min(t.get("time", 0) for t in trades)
+        last = max(t.get("time", 0) for t in trades)
+        prev = self.last_time.get(coin)
+        gap = None
+        reason = self.pending.pop(coin, None)
+        if prev is not None and first > prev:
+            if reason and not overlapped:
+                gap = self._record(coin, prev, first, reason)
+            elif self.idle_threshold_ms and first - prev >= self.idle_threshold_ms:
+                gap = self._record(coin, prev, first, "idle")
+        self.last_time[coin] = max(prev or 0, last)
+        return gap
+
+    def _record(self, coin, start_ms, end_ms, reason):
+        row = {
+            "coin": coin,
+            "start": datetime.fromtimestamp(start_ms / 1000).isoformat(),
+            "end": datetime.fromtimestamp(end_ms / 1000).isoformat(),
+            "start_ms": start_ms,
+            "end_ms": end_ms,
+            "reason": reason,
+            "detected_at": datetime.now().isoformat(timespec="seconds"),
+        }
+        new_file = not os.path.exists(self.path) or os.path.getsize(self.path) == 0
+        with open(self.path, "a", newline="", encoding="utf-8") as f:
+            writer = csv.DictWriter(f, fieldnames=GAP_HEADERS)
+            if new_file:
+                writer.writeheader()
+            writer.writerow(row)
+        print(f"⚠️ {coin} 数据缺口 {row['start']} -> {row['end']} ({reason})")
+        return row
+
+
+class FillIntegrity:
+    """去重 + 缺口检测，状态在关闭时持久化，重启后继续使用"""
+
+    def __init__(self, folder, capacity=100000, idle_threshold=0):
+        self.folder = folder
+        self.state_path = os.path.join(folder, STATE_FILENAME)
+        self.tids = RecentTidSet(capacity)
+        self.gaps = GapTracker(folder, idle_threshold)
+        self.duplicates = 0
+        self.lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.state_path):
+            return
+        try:
+            with open(self.state_path, "r", encoding="utf-8") as f:
+                state = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"⚠️ 读取记录器状态失败，忽略: {e}")
+            return
+        self.tids.load_dict(state.get("tids", {}))
+        self.gaps.last_time.update({coin: int(t) for coin, t in state.get("last_time", {}).items()})
+        self.gaps.mark_reconnect("restart")
+
+    def mark_reconnect(self):
+        with self.lock:
+            self.gaps.mark_reconnect()
+
+    def filter(self, coin, trades):
+        """丢弃重复 tid，检测缺口，返回需要写入的交易"""
+        with self.lock:
+            fresh = []
+            for trade in trades:
+                if self.tids.add(coin, trade.get("tid")):
+                    fresh.append(trade)
+            overlapped = len(fresh) < len(trades)
+            self.duplicates += len(trades) - len(fresh)
+            self.gaps.check(coin, fresh, overlapped)
+            return fresh
+
+    def save(self):
+        """持久化最近 tid 和每个代币最后交易时间"""
+        with self.lock:
+            state = {
+                "saved_at": datetime.now().isoformat(timespec="seconds"),
+                "last_time": self.gaps.last_time,
+                "tids": self.tids.to_dict(),
+            }
+        os.makedirs(self.folder, exist_ok=True)
+        tmp_path = self.state_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self.state_path)
+
+
+def load_gaps(folder, coin=None):
+    """读取缺口索引，返回 [{coin, start_ms, end_ms, reason, ...}]"""
+    path = os.path.join(folder, GAPS_FILENAME)
+    if not os.path.exists(path):
+        return []
+    with open(path, "r", encoding="utf-8") as f:
+        rows = list(csv.DictReader(f))
+    for row in rows:
+        row["start_ms"] = int(row["start_ms"])
+        row["end_ms"] = int(row["end_ms"])
+    return [row for row in rows if coin is None or row["coin"] == coin]
+
+
+def overlapping_gaps(folder, coin, start_ms, end_ms):
+    """返回与 [start_ms, end_ms] 相交的缺口"""
+    return [g for g in load_gaps(folder, coin) if g["start_ms"] < end_ms and g["end_ms"] > start_ms]
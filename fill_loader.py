@@ -0,0 +1,160 @@
+# 成交CSV共享加载器：只读需要的列、固定数值类型、分块读取并在每块内做时间/方向/地址过滤
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from fill_catalog import open_uncompacted
+
+DEFAULT_COLUMNS = ["px", "sz", "side", "time", "user1", "user2"]
+COLUMN_DTYPES = {
+    "coin": "category",
+    "px": np.float64,
+    "sz": np.float64,
+    "side": "category",
+    "time": str,
+    "user1": str,
+    "user2": str,
+    "hash": str,
+    "tid": np.int64,
+}
+ADDRESS_COLUMNS = ("user1", "user2")
+DEFAULT_CHUNKSIZE = 500000
+
+
+def _time_bound(value):
+    return None if value is None else pd.Timestamp(value)
+
+
+def filter_chunk(chunk, start=None, end=None, side=None, windows=None, users=None):
+    """对一个数据块做过滤：时间区间、买卖方向、(时间区间, 方向) 窗口列表、地址"""
+    mask = np.ones(len(chunk), dtype=bool)
+    if start is not None:
+        mask = mask & (chunk['time'] >= start).values
+    if end is not None:
+        mask = mask & (chunk['time'] <= end).values
+    if side is not None:
+        mask = mask & (chunk['side'] == side).values
+    if windows:
+        any_window = np.zeros(len(chunk), dtype=bool)
+        for w_start, w_end, w_side in windows:
+            w_mask = ((chunk['time'] >= w_start) & (chunk['time'] <= w_end)).values
+            if w_side is not None:
+                w_mask = w_mask & (chunk['side'] == w_side).values
+            any_window = any_window | w_mask
+        mask = mask & any_window
+    if users is not None:
+        mask = mask & (chunk['user1'].isin(users) | chunk['user2'].isin(users)).values
+    return chunk[mask]
+
+
+def iter_fills(files, columns=None, start=None, end=None, side=None, windows=None, users=None,
+               chunksize=DEFAULT_CHUNKSIZE):
+    """逐块读取并过滤，产出已过滤的数据块"""
+    columns = list(columns or DEFAULT_COLUMNS)
+    read_cols = list(columns)
+    # 过滤需要用到的列也要读入
+    if (start is not None or end is not None or windows) and "time" not in read_cols:
+        read_cols.append("time")
+    if (side is not None or windows) and "side" not in read_cols:
+        read_cols.append("side")
+    if users is not None:
+        read_cols += [c for c in ADDRESS_COLUMNS if c not in read_cols]
+    dtypes = {c: COLUMN_DTYPES[c] for c in read_cols if c in COLUMN_DTYPES}
+
+    start, end = _time_bound(start), _time_bound(end)
+    windows = [(_time_bound(s), _time_bound(e), sd) for s, e, sd in (windows or [])]
+    users = set(users) if users is not None else None
+
+    for file in files:
+        # 合并后又追加写入的会话文件只读合并位置之后的行，已合并的部分由每日文件提供
+        source = open_uncompacted(file)
+        try:
+            for chunk in pd.read_csv(source, usecols=read_cols, dtype=dtypes, chunksize=chunksize):
+                if "time" in chunk:
+                    chunk['time'] = pd.to_datetime(chunk['time'], format='ISO8601')
+                chunk = filter_chunk(chunk, start, end, side, windows, users)
+                if len(chunk):
+                    yield chunk[columns]
+        finally:
+            if source is not file:
+                source.close()
+
+
+def load_fills(files, columns=None, start=None, end=None, side=None, windows=None, users=None,
+               chunksize=DEFAULT_CHUNKSIZE, workers=1):
+    """加载成交数据，内存峰值取决于过滤后的结果大小和单个数据块，而不是文件总大小
+    workers > 1 时每个文件在独立进程中解析和过滤，结果与串行完全一致"""
+    columns = list(columns or DEFAULT_COLUMNS)
+    files = list(files)
+    if workers > 1 and len(files) > 1:
+        chunks = []
+        with ProcessPoolExecutor(max_workers=min(workers, len(files))) as pool:
+            tasks = [(file, columns, start, end, side, windows, users, chunksize) for file in files]
+            for arrays in pool.map(_load_file_arrays, tasks):
+                if arrays is not None:
+                    chunks.append(_arrays_to_frame(arrays, columns))
+    else:
+        chunks = list(iter_fills(files, columns, start, end, side, windows, users, chunksize))
+    if not chunks:
+        return empty_fills(columns)
+    df = pd.concat(chunks, ignore_index=True)
+    return finalize_fills(df)
+
+
+def _load_file_arrays(task):
+    """子进程：读取并过滤一个文件，返回紧凑的 numpy 数组（字符串列做字典编码）"""
+    file, columns, start, end, side, windows, users, chunksize = task
+    chunks = list(iter_fills([file], columns, start, end, side, windows, users, chunksize))
+    if not chunks:
+        return None
+    df = pd.concat(chunks, ignore_index=True)
+    arrays = {}
+    for c in columns:
+        values = df[c]
+        if values.dtype.kind in "fiumM":
+            arrays[c] = values.to_numpy()
+        else:
+            codes, uniques = pd.factorize(values.astype(str))
+            arrays[c] = (codes.astype(np.int32), np.asarray(uniques, dtype=object))
+    return arrays
+
+
+def _arrays_to_frame(arrays, columns):
+    data = {}
+    for c in columns:
+        values = arrays[c]
+        if isinstance(values, tuple):
+            codes, uniques = values
+            data[c] = pd.Categorical.from_codes(codes, categories=uniques)
+        else:
+            data[c] = values
+    return pd.DataFrame(data)
+
+
+def empty_fills(columns):
+    data = {}
+    for c in columns:
+        if c == "time":
+            data[c] = pd.Series([], dtype="datetime64[ns]")
+        elif c in ("px", "sz"):
+            data[c] = pd.Series([], dtype=np.float64)
+        elif c == "tid":
+            data[c] = pd.Series([], dtype=np.int64)
+        else:
+            data[c] = pd.Series([], dtype="category")
+    return pd.DataFrame(data)
+
+
+def finalize_fills(df):
+    """地址和方向列统一转为 category"""
+    for c in ADDRESS_COLUMNS + ("side", "coin"):
+        if c not in df:
+            continue
+        if isinstance(df[c].dtype, pd.CategoricalDtype):
+            # 类别统一排序，保证串行和多进程读取的结果一致
+            values = df[c].cat.remove_unused_categories()
+            df[c] = values.cat.reorder_categories(sorted(values.cat.categories))
+        else:
+            df[c] = df[c].astype("category")
+    return df
@@ -0,0 +1,136 @@
+# 接收/落盘解耦：websocket 线程只负责入队，工作线程负责解析和写盘
+# 多个工作线程时按 key(消息)（例如代币）分配到固定线程，同一个 key 的消息按到达顺序处理
+import queue
+import threading
+import time
+from datetime import datetime
+
+POLICY_BLOCK = "block"  # 队列满时阻塞接收线程（不丢数据）
+POLICY_DROP = "drop"    # 队列满时丢弃新消息（不阻塞接收线程）
+
+_STOP = object()
+
+
+class FramePipeline:
+    """有界队列 + 工作线程，记录队列深度、丢弃和阻塞次数
+    key 为 None 时所有线程共用一个队列（多线程时不保证顺序）；
+    否则每个线程一个队列，key 相同的消息总是进入同一个队列，maxsize 为每个队列的上限"""
+
+    def __init__(self, handler, workers=1, maxsize=10000, policy=POLICY_BLOCK,
+                 stats_interval=10, verbose=1, key=None):
+        if policy not in (POLICY_BLOCK, POLICY_DROP):
+            raise ValueError(f"未知的队列策略: {policy}")
+        self.handler = handler
+        self.policy = policy
+        self.stats_interval = stats_interval
+        self.verbose = verbose
+        self.key = key
+        workers = max(1, workers)
+        self.queues = [queue.Queue(maxsize=maxsize) for _ in range(workers if key else 1)]
+        self.maxsize = maxsize
+        self.closed = False
+
+        self.lock = threading.Lock()
+        self.enqueued = 0
+        self.processed = 0
+        self.dropped = 0
+        self.blocked = 0
+        self.errors = 0
+        self.max_depth = 0
+
+        self.threads = []
+        for i in range(workers):
+            t = threading.Thread(target=self._worker, args=(self.queues[i % len(self.queues)],),
+                                 name=f"fill-worker-{i}")
+            t.daemon = True
+            t.start()
+            self.threads.append(t)
+
+        self._stop = threading.Event()
+        self._reporter = threading.Thread(target=self._report_periodically)
+        self._reporter.daemon = True
+        self._reporter.start()
+
+    def submit(self, frame):
+        """接收线程调用：原始消息入队，返回是否成功入队"""
+        if self.closed:
+            return False
+        target = self._route(frame)
+        try:
+            target.put_nowait(frame)
+        except queue.Full:
+            with self.lock:
+                if self.policy == POLICY_DROP:
+                    self.dropped += 1
+                    return False
+                self.blocked += 1
+            target.put(frame)
+        with self.lock:
+            self.enqueued += 1
+            depth = self.depth()
+            if depth > self.max_depth:
+                self.max_depth = depth
+        return True
+
+    def _route(self, frame):
+        if len(self.queues) == 1:
+            return self.queues[0]
+        return self.queues[hash(self.key(frame)) % len(self.queues)]
+
+    def depth(self):
+        return sum(q.qsize() for q in self.queues)
+
+    def _worker(self, frames):
+        while True:
+            frame = frames.get()
+            try:
+                if frame is _STOP:
+                    return
+                self.handler(frame)
+                with self.lock:
+                    self.processed += 1
+            except Exception as e:
+                with self.lock:
+                    self.errors += 1
+                print(f"消息处理错误: {e}")
+            finally:
+                frames.task_done()
+
+    def stats(self):
+        with self.lock:
+            return {
+                "depth": self.depth(),
+                "max_depth": self.max_depth,
+                "enqueued": self.enqueued,
+                "processed": self.processed,
+                "dropped": self.dropped,
+                "blocked": self.blocked,
+                "errors": self.errors,
+            }
+
+    def _report_periodically(self):
+        while not self._stop.wait(self.stats_interval):
+            if self.verbose >= 1:
+                s = self.stats()
+                print(f"📦 {datetime.now().strftime('%H:%M:%S')} 队列深度 {s['depth']}/{self.maxsize * len(self.queues)} "
+                      f"(峰值 {s['max_depth']}) | 入队 {s['enqueued']} | 已处理 {s['processed']} | "
+                      f"丢弃 {s['dropped']} | 阻塞 {s['blocked']} | 错误 {s['errors']}")
+            with self.lock:
+                self.max_depth = self.depth()
+
+    def close(self, timeout=30):
+        """停止接收新消息，处理完队列中剩余消息后退出工作线程"""
+        if self.closed:
+            return
+        self.closed = True
+        self._stop.set()
+        deadline = time.time() + timeout
+        for i in range(len(self.threads)):
+            self.queues[i % len(self.queues)].put(_STOP)
+        for t in self.threads:
+            t.join(max(0.0, deadline - time.time()))
+        s = self.stats()
+        if any(t.is_alive() for t in self.threads):
+            print(f"⚠️ 队列未在 {timeout} 秒内排空，剩余 {s['depth']} 条消息")
+        elif self.verbose >= 1:
+            print(f"✅ 队列已排空: 处理 {s['processed']} 条, 丢弃 {s['dropped']} 条, 阻塞 {s['blocked']} 次")
@@ -0,0 +1,150 @@
+# 成交记录写入端：批量缓冲写盘，供 download_trade_data.py 使用
+import csv
+import os
+import threading
+import time
+from datetime import datetime
+
+FILL_HEADERS = ["coin", "px", "sz", "side", "time", "user1", "user2", "hash", "tid"]
+
+# 日志级别: 0 只打印错误, 1 打印吞吐统计, 2 打印每一笔交易
+LOG_QUIET = 0
+LOG_STATS = 1
+LOG_TRADES = 2
+
+
+class BatchCsvSink:
+    """批量写入CSV：行先进缓冲区，达到行数或时间阈值时一次性写盘"""
+
+    def __init__(self, path, headers=FILL_HEADERS, batch_size=500, flush_interval=0.2,
+                 stats_interval=10, verbose=LOG_STATS):
+        self.path = path
+        self.headers = headers
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.stats_interval = stats_interval
+        self.verbose = verbose
+
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        self.file = open(path, 'a', newline='', encoding='utf-8')
+        self.writer = csv.DictWriter(self.file, fieldnames=headers)
+        # 文件为空时写表头
+        self.file.seek(0, 2)
+        if self.file.tell() == 0:
+            self.writer.writeheader()
+            self.file.flush()
+
+        self.buffer = []
+        self.lock = threading.Lock()
+        self.closed = False
+        self.last_flush = time.time()
+
+        # 统计信息
+        self.total_rows = 0
+        self.total_batches = 0
+        self._window_rows = 0
+        self._window_batches = 0
+        self._window_latency = 0.0
+        self._window_max_latency = 0.0
+        self._window_start = time.time()
+
+        # 定时刷盘线程，保证低频交易也能在 flush_interval 内落盘
+        self._stop = threading.Event()
+        self._flusher = threading.Thread(target=self._flush_periodically)
+        self._flusher.daemon = True
+        self._flusher.start()
+
+    def write(self, row):
+        """写入一行，满 batch_size 时立即刷盘"""
+        with self.lock:
+            if self.closed:
+                return
+            self.buffer.append(row)
+            if self.verbose >= LOG_TRADES:
+                print(f"📝 已记录交易: {row.get('coin')} @ {row.get('px')}")
+            if len(self.buffer) >= self.batch_size:
+                self._flush_locked()
+
+    def write_many(self, rows):
+        """批量写入多行"""
+        with self.lock:
+            if self.closed:
+                return
+            self.buffer.extend(rows)
+            if self.verbose >= LOG_TRADES:
+                for row in rows:
+                    print(f"📝 已记录交易: {row.get('coin')} @ {row.get('px')}")
+            if len(self.buffer) >= self.batch_size:
+                self._flush_locked()
+
+    def flush(self):
+        with self.lock:
+            self._flush_locked()
+
+    def _flush_locked(self):
+        self.last_flush = time.time()
+        if not self.buffer:
+            return
+        start = time.perf_counter()
+        rows = self.buffer
+        self.buffer = []
+        self.writer.writerows(rows)
+        self.file.flush()
+        latency = time.perf_counter() - start
+
+        self.total_rows += len(rows)
+        self.total_batches += 1
+        self._window_rows += len(rows)
+        self._window_batches += 1
+        self._window_latency += latency
+        self._window_max_latency = max(self._window_max_latency, latency)
+
+    def _flush_periodically(self):
+        while not self._stop.wait(self.flush_interval):
+            with self.lock:
+                if self.closed:
+                    return
+                if time.time() - self.last_flush >= self.flush_interval:
+                    self._flush_locked()
+                if time.time() - self._window_start >= self.stats_interval:
+                    self._report_locked()
+
+    def stats(self):
+        """返回当前统计窗口的吞吐和批次延迟"""
+        elapsed = max(time.time() - self._window_start, 1e-9)
+        batches = self._window_batches
+        return {
+            "rows_per_sec": self._window_rows / elapsed,
+            "batches": batches,
+            "avg_batch_ms": self._window_latency / batches * 1000 if batches else 0.0,
+            "max_batch_ms": self._window_max_latency * 1000,
+            "pending": len(self.buffer),
+            "total_rows": self.total_rows,
+        }
+
+    def _report_locked(self):
+        s = self.stats()
+        if self.verbose >= LOG_STATS:
+            print(f"📊 {datetime.now().strftime('%H:%M:%S')} {os.path.basename(self.path)} "
+                  f"{s['rows_per_sec']:.1f} 行/秒 | 批次 {s['batches']} | "
+                  f"平均写盘 {s['avg_batch_ms']:.2f}ms | 最大 {s['max_batch_ms']:.2f}ms | "
+                  f"待写 {s['pending']} | 累计 {s['total_rows']}")
+        self._window_rows = 0
+        self._window_batches = 0
+        self._window_latency = 0.0
+        self._window_max_latency = 0.0
+        self._window_start = time.time()
+
+    def close(self):
+        """刷出剩余数据并关闭文件"""
+        self._stop.set()
+        with self.lock:
+            if self.closed:
+                return
+            self._flush_locked()
+            self.closed = True
+            self.file.close()
+        if self.verbose >= LOG_STATS:
+            print(f"💾 {self.path} 共写入 {self.total_rows} 行, {self.total_batches} 批")
@@ -0,0 +1,235 @@
+# 列式成交存储：按 代币/小时 分区的 numpy npz 文件
+# 目录结构: {folder}/columnar/{coin}/{YYYY_MM_DDTHH}/part_{session}_{seq}.npz  (小时为UTC)
+# 列: time(int64 毫秒) px/sz(float64) side(int8, 1买 -1卖) tid(int64)
+#     user1/user2(int32 字典编码, 对应 addresses 列) hash(S66)
+import os
+import threading
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+
+COLUMNAR_SUBDIR = "columnar"
+HOUR_MS = 3600 * 1000
+PARTITION_FORMAT = "%Y_%m_%dT%H"
+FILL_COLUMNS = ["time", "px", "sz", "side", "user1", "user2", "tid", "hash"]
+
+
+def columnar_root(folder):
+    return os.path.join(folder, COLUMNAR_SUBDIR)
+
+
+def partition_name(hour):
+    """小时序号(毫秒时间戳 // HOUR_MS) 转分区目录名"""
+    return datetime.fromtimestamp(hour * HOUR_MS / 1000, tz=timezone.utc).strftime(PARTITION_FORMAT)
+
+
+def partition_hour(name):
+    """分区目录名转小时序号"""
+    dt = datetime.strptime(name, PARTITION_FORMAT).replace(tzinfo=timezone.utc)
+    return int(dt.timestamp()) * 1000 // HOUR_MS
+
+
+def to_epoch_ms(value):
+    """本地时间字符串/datetime/毫秒数 统一转为毫秒时间戳（与CSV中的本地时间一致）"""
+    if value is None:
+        return None
+    if isinstance(value, (int, np.integer)):
+        return int(value)
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    if hasattr(value, "to_pydatetime"):
+        value = value.to_pydatetime()
+    return int(value.timestamp() * 1000)
+
+
+class ColumnarSink:
+    """按小时分区写入列式文件；小时切换或缓冲超过阈值时写出一个 part 文件"""
+
+    def __init__(self, folder, session=None, max_rows=200000, flush_interval=60, verbose=1):
+        self.root = columnar_root(folder)
+        self.session = session or datetime.now().strftime("%Y_%m_%dT%H_%M_%S")
+        self.max_rows = max_rows
+        self.flush_interval = flush_interval
+        self.verbose = verbose
+        self.buffers = {}  # (coin, hour) -> list[tuple]
+        self.seq = 0
+        self.lock = threading.Lock()
+        self.closed = False
+        self.total_rows = 0
+
+        self._stop = threading.Event()
+        self._flusher = threading.Thread(target=self._flush_periodically)
+        self._flusher.daemon = True
+        self._flusher.start()
+
+    def write(self, trade):
+        self.write_many([trade])
+
+    def write_many(self, trades):
+        """写入 websocket 原始交易数据（trades 频道的 data 元素）"""
+        with self.lock:
+            if self.closed:
+                return
+            for trade in trades:
+                time_ms = int(trade.get("time", 0))
+                users = trade.get("users", [])
+                key = (trade.get("coin", ""), time_ms // HOUR_MS)
+                self.buffers.setdefault(key, []).append((
+                    time_ms,
+                    float(trade.get("px", 0.0)),
+                    float(trade.get("sz", 0.0)),
+                    1 if trade.get("side") == "B" else -1,
+                    users[0] if len(users) > 0 else "",
+                    users[1] if len(users) > 1 else "",
+                    int(trade.get("tid", 0)),
+                    trade.get("hash", ""),
+                ))
+            # 已结束的小时立即落盘，当前小时超过阈值也落盘
+            for key in list(self.buffers):
+                coin, hour = key
+                newest = max(h for c, h in self.buffers if c == coin)
+                if hour < newest or len(self.buffers[key]) >= self.max_rows:
+                    self._write_part(key)
+
+    def flush(self):
+        with self.lock:
+            for key in list(self.buffers):
+                self._write_part(key)
+
+    def _write_part(self, key):
+        rows = self.buffers.pop(key, None)
+        if not rows:
+            return
+        coin, hour = key
+        cols = list(zip(*rows))
+        addresses, codes = np.unique(np.array(cols[4] + cols[5], dtype=str), return_inverse=True)
+        codes = codes.astype(np.int32)
+        n = len(rows)
+
+        folder = os.path.join(self.root, coin, partition_name(hour))
+        os.makedirs(folder, exist_ok=True)
+        self.seq += 1
+        path = os.path.join(folder, f"part_{self.session}_{self.seq:05d}.npz")
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(
+                f,
+                time=np.array(cols[0], dtype=np.int64),
+                px=np.array(cols[1], dtype=np.float64),
+                sz=np.array(cols[2], dtype=np.float64),
+                side=np.array(cols[3], dtype=np.int8),
+                user1=codes[:n],
+                user2=codes[n:],
+                addresses=addresses,
+                tid=np.array(cols[6], dtype=np.int64),
+                hash=np.array(cols[7], dtype="S66"),
+            )
+        os.replace(tmp_path, path)
+        self.total_rows += n
+        if self.verbose >= 2:
+            print(f"🧱 写入列式分区 {path} ({n} 行)")
+
+    def _flush_periodically(self):
+        while not self._stop.wait(self.flush_interval):
+            with self.lock:
+                if self.closed:
+                    return
+                for key in list(self.buffers):
+                    self._write_part(key)
+
+    def close(self):
+        self._stop.set()
+        with self.lock:
+            if self.closed:
+                return
+            for key in list(self.buffers):
+                self._write_part(key)
+            self.closed = True
+        if self.verbose >= 1:
+            print(f"💾 列式存储 {self.root} 共写入 {self.total_rows} 行")
+
+
+def list_partitions(folder, coin, start_ms=None, end_ms=None):
+    """返回与时间区间相交的 part 文件，按小时排序"""
+    coin_dir = os.path.join(columnar_root(folder), coin)
+    if not os.path.isdir(coin_dir):
+        return []
+    start_hour = None if start_ms is None else start_ms // HOUR_MS
+    end_hour = None if end_ms is None else end_ms // HOUR_MS
+    parts = []
+    for name in sorted(os.listdir(coin_dir)):
+        try:
+            hour = partition_hour(name)
+        except ValueError:
+            continue
+        if (start_hour is not None and hour < start_hour) or (end_hour is not None and hour > end_hour):
+            continue
+        hour_dir = os.path.join(coin_dir, name)
+        parts += [os.path.join(hour_dir, f) for f in sorted(os.listdir(hour_dir)) if f.endswith(".npz")]
+    return parts
+
+
+def read_columnar_arrays(folder, coin, start=None, end=None, columns=None):
+    """读取列式数据为 numpy 数组字典，地址列统一为全局字典编码（addresses）"""
+    columns = columns or ["time", "px", "sz", "side", "user1", "user2", "tid"]
+    start_ms, end_ms = to_epoch_ms(start), to_epoch_ms(end)
+    load_cols = list(dict.fromkeys(["time"] + columns))
+    user_cols = [c for c in load_cols if c in ("user1", "user2")]
+
+    chunks = {c: [] for c in load_cols}
+    dictionaries = []
+    for path in list_partitions(folder, coin, start_ms, end_ms):
+        with np.load(path) as part:
+            t = part["time"]
+            mask = np.ones(len(t), dtype=bool)
+            if start_ms is not None:
+                mask &= t >= start_ms
+            if end_ms is not None:
+                mask &= t <= end_ms
+            if not mask.any():
+                continue
+            for c in load_cols:
+                chunks[c].append(part[c][mask])
+            if user_cols:
+                dictionaries.append(part["addresses"])
+
+    result = {}
+    for c in load_cols:
+        if chunks[c]:
+            result[c] = np.concatenate(chunks[c])
+        else:
+            result[c] = np.array([], dtype=np.int32 if c in user_cols else np.int64)
+
+    # 合并各 part 的地址字典并重映射编码
+    addresses = np.array([], dtype=str)
+    if user_cols and dictionaries:
+        addresses = np.unique(np.concatenate(dictionaries))
+        for c in user_cols:
+            remapped = [np.searchsorted(addresses, d[codes]).astype(np.int32)
+                        for d, codes in zip(dictionaries, chunks[c])]
+            result[c] = np.concatenate(remapped)
+    result["addresses"] = addresses
+    return result
+
+
+def read_columnar_fills(folder, coin, start=None, end=None, columns=None):
+    """读取列式数据为与CSV相同列名的 DataFrame（time 为本地时间，地址为 category）"""
+    import pandas as pd
+    from dateutil.tz import tzlocal
+
+    arrays = read_columnar_arrays(folder, coin, start, end, columns)
+    cols = [c for c in (columns or ["time", "px", "sz", "side", "user1", "user2", "tid"])]
+    data = {"coin": pd.Categorical([coin] * len(arrays["time"]))}
+    for c in cols:
+        values = arrays[c]
+        if c == "time":
+            values = pd.to_datetime(values, unit="ms", utc=True).tz_convert(tzlocal()).tz_localize(None)
+        elif c == "side":
+            values = pd.Categorical.from_codes((values > 0).astype(np.int8), categories=["Sell", "Buy"])
+        elif c in ("user1", "user2"):
+            values = pd.Categorical.from_codes(values, categories=arrays["addresses"])
+        elif c == "hash":
+            values = values.astype(str)
+        data[c] = values
+    return pd.DataFrame(data)
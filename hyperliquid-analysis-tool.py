@@ -4,109 +4,288 @@ Hyperliquid交易分析工具 v1.0
 依赖库：hyperliquid, binance, mplfinance, pandas 
 """
  
-from hyperliquid.info  import Info
-from hyperliquid.utils  import constants 
 import json
-import pandas as pd 
-from binance.client  import Client
-import mplfinance as mpf
+import sys
 import datetime 
 import os
 import argparse 
 import time 
-import matplotlib.pyplot as plt 
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dateutil.relativedelta  import relativedelta
+from lot_engine import LotBook, LONG, SHORT, METHODS, METHOD_FIFO
+from rate_limit import TokenBucket
+# pandas/numpy/mplfinance/matplotlib/hyperliquid SDK 只在用到的函数内导入：--help 和命中缓存的运行不需要加载绘图和网络库
  
-# 缓存目录配置 
+# 缓存目录配置（在写入时才创建）
 CACHE_DIR = "trading_data_cache"
-os.makedirs(CACHE_DIR,  exist_ok=True)
+
+# 用户成交缓存：每个地址一个追加写入的 jsonl（包含所有代币），旁边的 meta 记录覆盖的时间范围和最后成交时间
+FILLS_CACHE_DIR = os.path.join(CACHE_DIR, "user_fills")
+FILLS_PAGE_LIMIT = 2000      # userFillsByTime 单次最多返回的条数
+FILLS_REFRESH_SECONDS = 60   # 同一进程内该时间内不重复请求同一地址
+_fills_memory = {}           # address -> (拉取时间, 成交列表, 起始时间)，多个代币共用一次拉取
+HL_WEIGHT_PER_MINUTE = 1200  # Hyperliquid /info 每个IP每分钟的权重上限
+USER_FILLS_WEIGHT = 20       # userFillsByTime 单次请求权重
+
+
+def parse_time_range(time_range, now=None):
+    """把 7d / 2w / 3m 这样的时间范围转换为起始时间"""
+    now = now or datetime.datetime.now()
+    if time_range.endswith('d'):
+        return now - datetime.timedelta(days=int(time_range[:-1]))
+    elif time_range.endswith('w'):
+        return now - datetime.timedelta(weeks=int(time_range[:-1]))
+    elif time_range.endswith('m'):
+        return now - relativedelta(months=int(time_range[:-1]))
+    raise ValueError("时间范围格式错误 (示例: 30d, 3m, 1y)")
+
+
+def fetch_fills_by_time(info, address, start_ms, end_ms=None, bucket=None):
+    """按时间分页拉取成交：每页最多 FILLS_PAGE_LIMIT 条，下一页从本页最后成交时间开始（按 tid 去重）"""
+    fills = []
+    cursor = start_ms
+    while True:
+        if bucket is not None:
+            bucket.acquire(USER_FILLS_WEIGHT)
+        page = info.user_fills_by_time(address, cursor, end_ms)
+        if not page:
+            break
+        fills.extend(page)
+        if len(page) < FILLS_PAGE_LIMIT:
+            break
+        last = max(int(fill['time']) for fill in page)
+        if last <= cursor:
+            # 同一毫秒内的成交超过一页，无法继续翻页
+            print(f"⚠️ {address} 在 {cursor} 的成交超过 {FILLS_PAGE_LIMIT} 条，可能不完整")
+            break
+        cursor = last
+    return fills
+
+
+def _fills_paths(address):
+    base = os.path.join(FILLS_CACHE_DIR, address.lower())
+    return base + ".jsonl", base + ".meta.json"
+
+
+def load_fill_store(address):
+    """读取本地成交缓存，返回 (按时间排序并按 tid 去重的成交列表, meta)"""
+    data_path, meta_path = _fills_paths(address)
+    meta = {}
+    if os.path.exists(meta_path):
+        with open(meta_path, 'r') as f:
+            meta = json.load(f)
+    fills = {}
+    if os.path.exists(data_path):
+        with open(data_path, 'r') as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    fill = json.loads(line)
+                    fills[fill['tid']] = fill
+    return sorted(fills.values(), key=lambda fill: (int(fill['time']), fill['tid'])), meta
+
+
+def update_fill_store(address, start_ms, info=None, bucket=None):
+    """增量更新成交缓存：只拉取最后成交之后的新成交，以及早于已覆盖范围的部分"""
+    os.makedirs(FILLS_CACHE_DIR, exist_ok=True)
+    data_path, meta_path = _fills_paths(address)
+    fills, meta = load_fill_store(address)
+    known = {fill['tid'] for fill in fills}
+    now_ms = int(time.time() * 1000)
+    if info is None:
+        # hyperliquid SDK 导入较慢，只在需要请求时导入
+        from hyperliquid.info import Info
+        from hyperliquid.utils import constants
+        info = Info(constants.MAINNET_API_URL, skip_ws=True)
+
+    fetched = []
+    covered_from = meta.get('covered_from_ms')
+    if covered_from is None or start_ms < covered_from:
+        # 请求的起点早于已缓存的范围：补齐前面的缺口（首次运行即整个范围）
+        print(f"从Hyperliquid API获取数据: {address} {datetime.datetime.fromtimestamp(start_ms / 1000)} 起")
+        fetched += fetch_fills_by_time(info, address, start_ms, covered_from, bucket)
+        covered_from = start_ms
+    if meta.get('last_fill_ms') is not None or meta.get('covered_to_ms') is not None:
+        since = meta.get('last_fill_ms') or meta['covered_to_ms']
+        print(f"从Hyperliquid API获取新成交: {address} {datetime.datetime.fromtimestamp(since / 1000)} 之后")
+        fetched += fetch_fills_by_time(info, address, since, bucket=bucket)
+
+    new_fills = []
+    for fill in fetched:
+        if fill['tid'] not in known:
+            known.add(fill['tid'])
+            new_fills.append(fill)
+    if new_fills:
+        with open(data_path, 'a') as f:
+            for fill in sorted(new_fills, key=lambda fill: (int(fill['time']), fill['tid'])):
+                f.write(json.dumps(fill) + "\n")
+        fills = sorted(fills + new_fills, key=lambda fill: (int(fill['time']), fill['tid']))
+
+    meta = {
+        'address': address.lower(),
+        'covered_from_ms': covered_from,
+        'covered_to_ms': now_ms,
+        'last_fill_ms': int(fills[-1]['time']) if fills else None,
+        'count': len(fills),
+    }
+    tmp_path = meta_path + ".tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(meta, f, indent=2)
+    os.replace(tmp_path, meta_path)
+    print(f"成交缓存: {address} 新增 {len(new_fills)} 条，共 {len(fills)} 条")
+    return fills
+
 
 def get_hyperliquid_trades(address, symbol, time_range):
-    """获取并缓存Hyperliquid交易记录"""
-    cache_file = os.path.join(CACHE_DIR,  f"{address}_{symbol.upper()}_trades.json") 
-    
-    # 检查缓存 
-    if os.path.exists(cache_file): 
-        print(f"从缓存加载交易数据: {cache_file}")
-        with open(cache_file, 'r') as f:
-            return json.load(f) 
-    
-    print(f"从Hyperliquid API获取数据: {address} - {symbol}")
-    info = Info(constants.MAINNET_API_URL, skip_ws=True)
-    all_trades = info.user_fills(address)
-    
-    # 过滤指定代币
-    trades = [trade for trade in all_trades if trade['coin'].upper() == symbol.upper()] 
-    
-    # 缓存数据 
-    with open(cache_file, 'w') as f:
-        json.dump(trades,  f, indent=2)
-    
-    return trades
- 
-def get_binance_klines(symbol, interval, time_range):
-    """获取并缓存币安K线数据"""
-    cache_file = os.path.join(CACHE_DIR,  f"{symbol.upper()}_{interval}_{time_range}_klines.csv") 
-    
-    # 检查缓存 
-    if os.path.exists(cache_file): 
-        print(f"从缓存加载K线数据: {cache_file}")
-        return pd.read_csv(cache_file,  index_col=0, parse_dates=True)
-    
-    print(f"从币安API获取数据: {symbol} {interval} {time_range}")
-    client = Client()
-    
-    # 解析时间范围 
-    now = datetime.datetime.now() 
-    if time_range.endswith('d'): 
-        days = int(time_range[:-1])
-        start_date = now - datetime.timedelta(days=days) 
-    elif time_range.endswith('w'): 
-        weeks = int(time_range[:-1])
-        start_date = now - datetime.timedelta(weeks=weeks) 
-    elif time_range.endswith('m'): 
-        months = int(time_range[:-1])
-        start_date = now - relativedelta(months=months)
+    """获取Hyperliquid交易记录：地址的全部代币成交共用一个增量缓存，按代币和时间范围过滤"""
+    start_ms = int(parse_time_range(time_range).timestamp() * 1000)
+    key = address.lower()
+    cached = _fills_memory.get(key)
+    if cached and time.time() - cached[0] < FILLS_REFRESH_SECONDS and cached[2] <= start_ms:
+        fills = cached[1]
     else:
-        raise ValueError("时间范围格式错误 (示例: 30d, 3m, 1y)")
-    
-    # 获取K线数据 
-    klines = client.get_historical_klines( 
-        symbol=symbol + "USDT",
-        interval=interval,
-        start_str=start_date.strftime("%d  %b, %Y"),
-        end_str=now.strftime("%d  %b, %Y")
-    )
-    
-    # 转换为DataFrame 
-    df = pd.DataFrame(klines, columns=[
-        'timestamp', 'open', 'high', 'low', 'close', 'volume',
-        'close_time', 'quote_asset_volume', 'trades',
-        'taker_buy_base', 'taker_buy_quote', 'ignore'
-    ])
-    
-    # 数据处理 
-    df['timestamp'] = pd.to_datetime(df['timestamp'], unit='ms')  # 保留 datetime 类型
-    df.set_index('timestamp', inplace=True)
-    numeric_cols = ['open', 'high', 'low', 'close', 'volume']
-    df[numeric_cols] = df[numeric_cols].apply(pd.to_numeric, axis=1)
-    df = df[['open', 'high', 'low', 'close', 'volume']]
-    
-    # 缓存数据 
-    df.to_csv(cache_file) 
-    
+        fills = update_fill_store(address, start_ms)
+        _fills_memory[key] = (time.time(), fills, start_ms)
+    return [trade for trade in fills
+            if trade['coin'].upper() == symbol.upper() and int(trade['time']) >= start_ms]
+ 
+# K线缓存：每个 (代币, 周期) 一个 npz，保存已收盘的K线和已覆盖的绝对时间区间，请求时只下载缺失的部分
+KLINES_CACHE_DIR = os.path.join(CACHE_DIR, "klines")
+KLINE_COLUMNS = ['open', 'high', 'low', 'close', 'volume']
+
+
+def _klines_path(symbol, interval):
+    return os.path.join(KLINES_CACHE_DIR, f"{symbol.upper()}_{interval}.npz")
+
+
+def load_kline_store(symbol, interval):
+    """返回 (open_time 毫秒数组, 价格/成交量矩阵, 已覆盖区间 [[start_ms, end_ms], ...])"""
+    import numpy as np
+    path = _klines_path(symbol, interval)
+    if not os.path.exists(path):
+        return np.array([], dtype=np.int64), np.empty((0, len(KLINE_COLUMNS))), []
+    with np.load(path) as data:
+        return data['open_time'], data['values'], data['segments'].tolist()
+
+
+def save_kline_store(symbol, interval, open_time, values, segments):
+    import numpy as np
+    os.makedirs(KLINES_CACHE_DIR, exist_ok=True)
+    path = _klines_path(symbol, interval)
+    tmp_path = path + ".tmp.npz"
+    np.savez(tmp_path, open_time=open_time, values=values,
+             segments=np.array(segments, dtype=np.int64).reshape(-1, 2))
+    os.replace(tmp_path, path)
+
+
+def merge_segments(segments, gap=0):
+    """合并重叠或相邻（间隔不超过 gap）的区间"""
+    merged = []
+    for start, end in sorted(segments):
+        if merged and start <= merged[-1][1] + gap:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+
+def missing_ranges(segments, start_ms, end_ms):
+    """[start_ms, end_ms] 中未被已覆盖区间包含的部分"""
+    missing = []
+    cursor = start_ms
+    for seg_start, seg_end in merge_segments(segments):
+        if seg_end < cursor:
+            continue
+        if seg_start > end_ms:
+            break
+        if seg_start > cursor:
+            missing.append((cursor, seg_start - 1))
+        cursor = max(cursor, seg_end + 1)
+    if cursor <= end_ms:
+        missing.append((cursor, end_ms))
+    return missing
+
+
+def fetch_klines(downloader, symbol, interval, start_ms, end_ms, interval_ms):
+    """下载 [start_ms, end_ms] 的K线（分段并发），返回原始K线列表"""
+    klines, _ = downloader.download(symbol + "USDT", interval, start_ms, end_ms, interval_ms)
+    return klines
+
+
+def klines_to_frame(open_time, values):
+    import pandas as pd
+    df = pd.DataFrame(values, columns=KLINE_COLUMNS, index=pd.to_datetime(open_time, unit='ms'))
+    df.index.name = 'timestamp'
+    return df
+
+
+def get_binance_klines(symbol, interval, time_range, workers=4):
+    """获取币安K线：本地已有的部分直接读取，只下载前后缺失的区间，合并后写回缓存"""
+    import numpy as np
+    import pandas as pd
+    from kline_downloader import KlineDownloader, interval_to_milliseconds
+    now = datetime.datetime.now()
+    start_ms = int(parse_time_range(time_range, now).timestamp() * 1000)
+    now_ms = int(now.timestamp() * 1000)
+    interval_ms = interval_to_milliseconds(interval)
+    if interval_ms is None:
+        raise ValueError(f"不支持的K线周期: {interval}")
+    # 对齐到K线开盘时间
+    start_ms -= start_ms % interval_ms
+
+    open_time, values, segments = load_kline_store(symbol, interval)
+    gaps = missing_ranges(segments, start_ms, now_ms)
+    if not gaps:
+        print(f"从缓存加载K线数据: {symbol} {interval} {time_range}")
+
+    downloader = None
+    live = None  # 尚未收盘的最后一根K线只返回，不写入缓存
+    new_times, new_values = [open_time], [values]
+    for gap_start, gap_end in gaps:
+        print(f"从币安API获取数据: {symbol} {interval} {datetime.datetime.fromtimestamp(gap_start / 1000)} -> {datetime.datetime.fromtimestamp(gap_end / 1000)}")
+        downloader = downloader or KlineDownloader(workers=workers)
+        klines = fetch_klines(downloader, symbol, interval, gap_start, gap_end, interval_ms)
+        if not klines:
+            # 空响应可能是临时错误或区间超出最后一根已收盘K线，不记录为已覆盖，下次重新下载
+            continue
+        raw = np.array([k[:7] for k in klines], dtype=np.float64)
+        closed = raw[:, 6] < now_ms
+        if not closed[-1]:
+            live = raw[-1]
+        raw = raw[closed]
+        new_times.append(raw[:, 0].astype(np.int64))
+        new_values.append(raw[:, 1:6])
+        # 已覆盖到最后一根已收盘K线的收盘时间
+        covered_end = int(raw[-1, 6]) if len(raw) else gap_start - 1
+        if covered_end >= gap_start:
+            segments.append([gap_start, min(gap_end, covered_end)])
+
+    if gaps:
+        open_time = np.concatenate(new_times)
+        values = np.concatenate(new_values)
+        open_time, first = np.unique(open_time, return_index=True)
+        values = values[first]
+        segments = merge_segments(segments, gap=1)
+        save_kline_store(symbol, interval, open_time, values, segments)
+
+    lo = np.searchsorted(open_time, start_ms)
+    df = klines_to_frame(open_time[lo:], values[lo:])
+    if live is not None:
+        df = pd.concat([df, klines_to_frame(live[:1].astype(np.int64), live[None, 1:6])])
     return df
  
-def process_trades(trades, symbol):
-    """处理交易数据并计算盈亏"""
+def process_trades(trades, symbol, mark_price=None, method=METHOD_FIFO):
+    """处理交易数据并计算盈亏
+    mark_price: 计算未实现盈亏的标记价格（默认最后一笔成交价）；method: fifo / lifo / average"""
+    import pandas as pd
     open_long_events = []
     close_short_events = []
     close_long_events = []
     open_short_events = []
-    positions = []
-    realized_pnl = 0
+    book = LotBook(method)
     total_buy_qty = 0 
     total_sell_qty = 0 
+    price = None
 
     for trade in trades:
         if trade['coin'].upper() != symbol.upper(): 
@@ -115,65 +294,54 @@ def process_trades(trades, symbol):
         timestamp = datetime.datetime.fromtimestamp(int(trade['time']) / 1000.)
         price = float(trade['px'])
         qty = float(trade['sz'])
+        direction = trade['dir']
 
         # Open Long
-        if trade['dir'] == 'Open Long':
+        if direction == 'Open Long':
             open_long_events.append((timestamp, price, qty))
-            positions.append({'timestamp': timestamp, 'price': price, 'qty': qty})
+            book.open(LONG, qty, price, timestamp)
             total_buy_qty += qty
 
         # Close Short
-        elif trade['dir'] == 'Close Short':
+        elif direction == 'Close Short':
             close_short_events.append((timestamp, price, qty))
             total_buy_qty += qty
-            
-            remaining_qty = qty
-            while remaining_qty > 0 and positions:
-                position = positions[0]
-                if position['qty'] > remaining_qty:
-                    realized_pnl += remaining_qty * (position['price'] - price)
-                    position['qty'] -= remaining_qty
-                    remaining_qty = 0
-                else:
-                    realized_pnl += position['qty'] * (position['price'] - price)
-                    remaining_qty -= position['qty']
-                    positions.pop(0)
+            book.close(SHORT, qty, price)
 
         # Close Long
-        elif trade['dir'] == 'Close Long':
+        elif direction == 'Close Long':
             close_long_events.append((timestamp, price, qty))
             total_sell_qty += qty
-            
-            remaining_qty = qty
-            while remaining_qty > 0 and positions:
-                position = positions[0]
-                if position['qty'] > remaining_qty:
-                    realized_pnl += remaining_qty * (price - position['price'])
-                    position['qty'] -= remaining_qty
-                    remaining_qty = 0
-                else:
-                    realized_pnl += position['qty'] * (price - position['price'])
-                    remaining_qty -= position['qty']
-                    positions.pop(0)
+            book.close(LONG, qty, price)
 
         # Open Short
-        elif trade['dir'] == 'Open Short':
+        elif direction == 'Open Short':
             open_short_events.append((timestamp, price, qty))
             total_sell_qty += qty
-            positions.append({
-                'timestamp': timestamp,
-                'price': price,
-                'qty': qty,
-                'position_type': 'short'
-            })
+            book.open(SHORT, qty, price, timestamp)
+
+        # 反手：一笔成交先平掉原方向的全部持仓，剩余部分开反方向
+        elif direction in ('Long > Short', 'Short > Long'):
+            closed_side = LONG if direction == 'Long > Short' else SHORT
+            closed_qty = min(qty, book.qty[closed_side])
+            book.trade(-qty if closed_side == LONG else qty, price, timestamp)
+            if closed_side == LONG:
+                close_long_events.append((timestamp, price, closed_qty))
+                if qty > closed_qty:
+                    open_short_events.append((timestamp, price, qty - closed_qty))
+                total_sell_qty += qty
+            else:
+                close_short_events.append((timestamp, price, closed_qty))
+                if qty > closed_qty:
+                    open_long_events.append((timestamp, price, qty - closed_qty))
+                total_buy_qty += qty
 
     # 计算未实现盈亏
-    unrealized_pnl = 0 
-    for position in positions:
-        if position.get('position_type') == 'short':
-            unrealized_pnl += position['qty'] * (position['price'] - df['close'].iloc[-1])
-        else:
-            unrealized_pnl += position['qty'] * (df['close'].iloc[-1] - position['price'])
+    if mark_price is None:
+        mark_price = price
+    realized_pnl = book.realized_pnl
+    unrealized_pnl = book.unrealized_pnl(mark_price) if mark_price is not None else 0
+    positions = book.open_lots()
 
     total_pnl = realized_pnl + unrealized_pnl
 
@@ -196,28 +364,27 @@ def process_trades(trades, symbol):
         'total_sell_qty': total_sell_qty 
     }
  
-def plot_trading_markers(ax, df, events, marker, color, label):
-    """绘制交易标记的通用函数"""
+def plot_trading_markers(ax, df, events, marker, color, label, verbose=False, method="nearest", end=None):
+    """绘制交易标记的通用函数：一次性把所有事件对齐到最近的K线
+    end 为最后一根K线的收盘时间（不含），默认只保留最后一根K线开盘时间之前的事件"""
+    import numpy as np
+    import pandas as pd
     if events.empty:
         return
 
-  
-    event_indices = []
-    event_prices = []
-    
-    for timestamp, price in zip(events.index, events['price']):
-        timestamp = pd.to_datetime(timestamp).tz_localize("UTC")
-        
-        if timestamp < df.index.min() or timestamp > df.index.max():
-            pass
-        else:
-            position = df.index.get_indexer([timestamp], method="nearest")[0]
-            event_indices.append(position)
-            event_prices.append(price)
-            # 打印信息
-            print(f"{timestamp} | {price:.2f} | {label}")
+    timestamps = pd.DatetimeIndex(events.index)
+    timestamps = timestamps.tz_localize("UTC") if timestamps.tz is None else timestamps.tz_convert("UTC")
+    upper = timestamps < end if end is not None else timestamps <= df.index.max()
+    in_range = np.asarray((timestamps >= df.index.min()) & upper)
+    timestamps = timestamps[in_range]
+    event_prices = events['price'].to_numpy()[in_range]
+    event_indices = df.index.get_indexer(timestamps, method=method)
+
+    if verbose and len(timestamps):
+        # 打印信息
+        print("\n".join(f"{ts} | {price:.2f} | {label}" for ts, price in zip(timestamps, event_prices)))
     
-    if event_indices:
+    if len(event_indices):
         ax.scatter(
             event_indices,
             event_prices,
@@ -228,22 +395,82 @@ def plot_trading_markers(ax, df, events, marker, color, label):
             zorder=10,
             label=label
         )
-def plot_trading_data(df, trade_data, args):
+LOD_MAX_CANDLES = 500  # 图宽约 1300 像素，每根K线至少约 2.5 像素；超过 599 根时 mplfinance 会提示数据过多
+
+
+def parse_zoom(zoom):
+    """'2025-06-01,2025-06-07 12:00' -> (开始, 结束)，不带时区时按 UTC"""
+    import pandas as pd
+    bounds = []
+    for value in zoom.split(','):
+        ts = pd.Timestamp(value.strip())
+        bounds.append(ts.tz_localize('UTC') if ts.tz is None else ts.tz_convert('UTC'))
+    if len(bounds) != 2:
+        raise ValueError(f"缩放窗口格式错误 (示例: 2025-06-01,2025-06-07): {zoom}")
+    return bounds[0], bounds[1]
+
+
+def downsample_ohlcv(df, max_candles=LOD_MAX_CANDLES):
+    """把K线聚合到不超过 max_candles 根：按 周期×倍数 对齐时间分组，向量化计算 开/高/低/收/量
+    返回 (聚合后的K线, 倍数)，不需要聚合时原样返回"""
+    import numpy as np
+    import pandas as pd
+    n = len(df)
+    if not max_candles or n <= max_candles:
+        return df, 1
+    times = df.index.asi8
+    step = int(np.median(np.diff(times)))
+    factor = -(-n // max_candles)
+    # 按对齐的时间桶分组（例如 1m x60 聚合成整点小时），缺失的K线不影响分组
+    bucket = times // (step * factor)
+    while True:
+        starts = np.flatnonzero(np.r_[True, bucket[1:] != bucket[:-1]])
+        if len(starts) <= max_candles:
+            break
+        factor += 1
+        bucket = times // (step * factor)
+    ends = np.r_[starts[1:], n] - 1
+    result = pd.DataFrame({
+        'open': df['open'].to_numpy()[starts],
+        'high': np.maximum.reduceat(df['high'].to_numpy(), starts),
+        'low': np.minimum.reduceat(df['low'].to_numpy(), starts),
+        'close': df['close'].to_numpy()[ends],
+        'volume': np.add.reduceat(df['volume'].to_numpy(), starts),
+    }, index=df.index[starts])
+    return result, factor
+
+
+def plot_trading_data(df, trade_data, args, show=True, output_file=None):
     """绘制K线图并标记交易点位"""
+    import pandas as pd
+    import mplfinance as mpf
+    import matplotlib.pyplot as plt
     plt.style.use('dark_background') 
     
-    # Ensure both dataframes have the same timezone
-    df = df.copy()
-    
-    # Make sure all timestamps are in UTC and properly localized
-    df.index = pd.to_datetime(df.index, utc=True)
-    print(df.index)
+    # Make sure all timestamps are in UTC and properly localized（只替换索引，不复制数据）
+    df = df.set_axis(pd.to_datetime(df.index, utc=True), axis=0)
+    if args.zoom:
+        zoom_start, zoom_end = parse_zoom(args.zoom)
+        df = df.loc[zoom_start:zoom_end]
+        if df.empty:
+            raise ValueError(f"缩放窗口内没有K线: {args.zoom}")
+    # 标记的时间范围到最后一根K线收盘为止；聚合后最后一根K线的开盘时间是最后一个桶的开始，不能作为上界
+    from kline_downloader import interval_to_milliseconds
+    candle_ms = interval_to_milliseconds(args.interval)
+    chart_end = df.index[-1] + pd.Timedelta(milliseconds=candle_ms) if candle_ms else None
+    # K线数量超过图宽能显示的数量时按相邻K线聚合，交易标记仍使用原始成交价
+    df, factor = downsample_ohlcv(df, args.max_candles)
+    # 聚合后一根K线覆盖多个周期，标记放在包含该成交的K线上
+    align = "pad" if factor > 1 else "nearest"
+    if args.verbose:
+        print(df.index)
+    lod = f" (LOD x{factor})" if factor > 1 else ""
     
     fig, axes = mpf.plot( 
         df,
         type='candle',
         volume=True,
-        title=f"\n{args.symbol} analysis | time range: {args.time_range}  | interval: {args.interval}", 
+        title=f"\n{args.symbol} analysis | time range: {args.time_range}  | interval: {args.interval}{lod}", 
         style='charles',
         ylabel='price (USDT)',
         figratio=(14, 7),
@@ -260,7 +487,10 @@ def plot_trading_data(df, trade_data, args):
         trade_data['open_long_events'], 
         marker='^', 
         color='#00FF7F', 
-        label='Buy (Open Long)'
+        label='Buy (Open Long)',
+        verbose=args.verbose,
+        method=align,
+        end=chart_end
     )
 
     plot_trading_markers(
@@ -269,7 +499,10 @@ def plot_trading_data(df, trade_data, args):
         trade_data['close_short_events'], 
         marker='^', 
         color='#FFA500', 
-        label='Buy to Close Short'
+        label='Buy to Close Short',
+        verbose=args.verbose,
+        method=align,
+        end=chart_end
     )
 
     plot_trading_markers(
@@ -278,7 +511,10 @@ def plot_trading_data(df, trade_data, args):
         trade_data['close_long_events'], 
         marker='v', 
         color='#FF6347', 
-        label='Sell to Close Long'
+        label='Sell to Close Long',
+        verbose=args.verbose,
+        method=align,
+        end=chart_end
     )
 
     plot_trading_markers(
@@ -287,11 +523,15 @@ def plot_trading_data(df, trade_data, args):
         trade_data['open_short_events'], 
         marker='v', 
         color='#1E90FF', 
-        label='Sell (Open Short)'
+        label='Sell (Open Short)',
+        verbose=args.verbose,
+        method=align,
+        end=chart_end
     )
     
     # 添加图例
-    ax1.legend(loc='best') 
+    # 标记点很多时 loc='best' 需要逐点计算遮挡，固定在右上角（左上角是盈亏信息）
+    ax1.legend(loc='upper right')
     
     # 添加盈亏信息
     pnl_text = (
@@ -320,19 +560,167 @@ def plot_trading_data(df, trade_data, args):
     ax1.grid(True,  linestyle='--', alpha=0.3)
     
     # 保存图表 
-    output_file = f"./{CACHE_DIR}/{args.address[:6]}_{args.symbol}_{args.interval}_{args.time_range}_analysis.png" 
+    if output_file is None:
+        output_file = f"./{CACHE_DIR}/{args.address[:6]}_{args.symbol}_{args.interval}_{args.time_range}_analysis.png" 
+    os.makedirs(os.path.dirname(output_file), exist_ok=True)
     plt.savefig(output_file,  dpi=150, bbox_inches='tight')
     print(f"\n图表已保存至: {output_file}")
     
-    plt.show()
+    if show:
+        plt.show()
+    plt.close(fig)
+    return output_file
  
+def opened_notional(trade_data):
+    """开仓成交额（开多 + 开空），作为 ROI 的分母"""
+    total = 0.0
+    for key in ('open_long_events', 'open_short_events'):
+        events = trade_data[key]
+        if not events.empty:
+            total += float((events['price'] * events['qty']).sum())
+    return total
+
+
+def summarize_pair(address, symbol, trades, df, method):
+    trade_data = process_trades(trades, symbol, mark_price=df['close'].iloc[-1], method=method)
+    notional = opened_notional(trade_data)
+    book_position = sum(p['qty'] if p['position_type'] == LONG else -p['qty'] for p in trade_data['positions'])
+    return trade_data, {
+        'address': address,
+        'symbol': symbol,
+        'fills': len(trades),
+        'buy_qty': trade_data['total_buy_qty'],
+        'sell_qty': trade_data['total_sell_qty'],
+        'position': book_position,
+        'mark_price': float(df['close'].iloc[-1]),
+        'realized_pnl': trade_data['realized_pnl'],
+        'unrealized_pnl': trade_data['unrealized_pnl'],
+        'total_pnl': trade_data['total_pnl'],
+        'opened_notional': notional,
+        'roi': trade_data['total_pnl'] / notional if notional else None,
+        'error': None,
+    }
+
+
+def analyze_address(address, symbols, klines, time_range, method, bucket, info, kline_errors=None):
+    """一个地址只拉取一次成交（覆盖所有代币），再按代币分别计算；K线下载失败的代币只记录错误"""
+    start_ms = int(parse_time_range(time_range).timestamp() * 1000)
+    try:
+        fills = update_fill_store(address, start_ms, info=info, bucket=bucket)
+    except Exception as e:
+        return [dict(address=address, symbol=symbol, error=str(e)) for symbol in symbols], {}
+    rows, details = [], {}
+    for symbol in symbols:
+        trades = [t for t in fills if t['coin'].upper() == symbol.upper() and int(t['time']) >= start_ms]
+        if kline_errors and symbol in kline_errors:
+            rows.append(dict(address=address, symbol=symbol, fills=len(trades), error=kline_errors[symbol]))
+            continue
+        if not trades:
+            continue
+        try:
+            trade_data, row = summarize_pair(address, symbol, trades, klines[symbol], method)
+        except Exception as e:
+            rows.append(dict(address=address, symbol=symbol, fills=len(trades), error=str(e)))
+            continue
+        rows.append(row)
+        details[symbol] = trade_data
+    return rows, details
+
+
+def run_batch(argv):
+    """批量模式：多个地址 × 多个代币，共享K线缓存，线程池并行计算，输出一张汇总表"""
+    import pandas as pd
+    from hyperliquid.info import Info
+    from hyperliquid.utils import constants
+    parser = argparse.ArgumentParser(description='Hyperliquid交易分析工具 - 批量模式',
+                                     prog='hyperliquid-analysis-tool.py batch')
+    parser.add_argument('--addresses', type=str, default=os.path.join(CACHE_DIR, 'result.txt'), help='地址文件，每行一个地址')
+    parser.add_argument('--symbols', type=str, default='BTC,ETH,SOL', help='逗号分隔的代币列表')
+    parser.add_argument('--interval', type=str, default='1h', help='K线时间间隔 (默认1h)')
+    parser.add_argument('--time_range', type=str, default='30d', help='时间范围 (默认30d)')
+    parser.add_argument('--workers', type=int, default=8, help='并行处理的地址数 (默认8)')
+    parser.add_argument('--lot_method', type=str, default=METHOD_FIFO, choices=METHODS, help='持仓计价方式 (默认fifo)')
+    parser.add_argument('--out', type=str, default=os.path.join(CACHE_DIR, 'batch_summary.csv'), help='汇总表路径，.parquet 结尾时输出 Parquet')
+    parser.add_argument('--charts', action='store_true', help='为每个有成交的 地址×代币 保存图表 (Agg 后端，不弹窗)')
+    parser.add_argument('--max_candles', type=int, default=LOD_MAX_CANDLES, help=f'图中最多显示的K线数 (默认{LOD_MAX_CANDLES})')
+    parser.add_argument('--verbose', action='store_true', help='打印每个交易标记')
+    args = parser.parse_args(argv)
+
+    with open(args.addresses, 'r') as f:
+        addresses = list(dict.fromkeys(line.strip() for line in f if line.strip()))
+    symbols = [s.strip().upper() for s in args.symbols.split(',') if s.strip()]
+    start_time = time.time()
+    print(f"批量分析: {len(addresses)} 个地址 × {len(symbols)} 个代币, 时间范围 {args.time_range}, K线 {args.interval}")
+
+    # 每个代币只加载一次K线，所有地址共用；某个代币下载失败时记录到该代币的 error 列，其余代币继续
+    klines, kline_errors = {}, {}
+    for symbol in symbols:
+        try:
+            klines[symbol] = get_binance_klines(symbol, args.interval, args.time_range)
+        except Exception as e:
+            print(f"❌ {symbol} K线下载失败: {e}")
+            kline_errors[symbol] = f"K线下载失败: {e}"
+
+    bucket = TokenBucket(HL_WEIGHT_PER_MINUTE)
+    # Info 初始化时会请求元数据，所有线程共用一个实例
+    info = Info(constants.MAINNET_API_URL, skip_ws=True)
+    rows, details = [], {}
+    with ThreadPoolExecutor(max_workers=args.workers) as pool:
+        futures = {pool.submit(analyze_address, address, symbols, klines, args.time_range, args.lot_method, bucket, info,
+                               kline_errors): address
+                   for address in addresses}
+        for done, future in enumerate(as_completed(futures), 1):
+            address = futures[future]
+            address_rows, address_details = future.result()
+            rows.extend(address_rows)
+            for symbol, trade_data in address_details.items():
+                details[(address, symbol)] = trade_data
+            print(f"[{done}/{len(addresses)}] {address}: {len(address_details)} 个代币有成交")
+
+    columns = ['address', 'symbol', 'fills', 'buy_qty', 'sell_qty', 'position', 'mark_price', 'realized_pnl',
+               'unrealized_pnl', 'total_pnl', 'opened_notional', 'roi', 'error']
+    summary = pd.DataFrame(rows, columns=columns).sort_values('total_pnl', ascending=False, na_position='last')
+    os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+    if args.out.endswith('.parquet'):
+        summary.to_parquet(args.out, index=False)
+    else:
+        summary.to_csv(args.out, index=False)
+    print(summary.head(20).to_string(index=False))
+    print(f"\n汇总表已保存至: {args.out}")
+
+    if args.charts:
+        # 图表在主线程中依次渲染（matplotlib 不是线程安全的）
+        import matplotlib
+        matplotlib.use('Agg')
+        chart_dir = os.path.join(os.path.dirname(os.path.abspath(args.out)), 'charts')
+        os.makedirs(chart_dir, exist_ok=True)
+        for (address, symbol), trade_data in details.items():
+            chart_args = argparse.Namespace(address=address, symbol=symbol, interval=args.interval,
+                                            time_range=args.time_range, verbose=args.verbose,
+                                            max_candles=args.max_candles, zoom=None)
+            output_file = os.path.join(chart_dir, f"{address}_{symbol}_{args.interval}_{args.time_range}_analysis.png")
+            plot_trading_data(klines[symbol], trade_data, chart_args, show=False, output_file=output_file)
+
+    print(f"\n✅ 批量分析完成! 耗时: {time.time() - start_time:.2f}秒")
+    return summary
+
+
 if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == 'batch':
+        run_batch(sys.argv[2:])
+        sys.exit()
+
     # 解析命令行参数 
     parser = argparse.ArgumentParser(description='Hyperliquid交易分析工具')
     parser.add_argument('address',  type=str, help='Hyperliquid用户地址')
     parser.add_argument('symbol',  type=str, help='代币符号 (如BTC)')
     parser.add_argument('interval',  type=str, help='K线时间间隔 (如1h, 4h, 1d)')
     parser.add_argument('time_range',  type=str, help='时间范围 (如7d, 30d, 3m)')
+    parser.add_argument('--workers', type=int, default=4, help='K线并发下载线程数 (默认4)')
+    parser.add_argument('--verbose', action='store_true', help='打印每个交易标记')
+    parser.add_argument('--max_candles', type=int, default=LOD_MAX_CANDLES, help=f'图中最多显示的K线数，超过时自动聚合 (默认{LOD_MAX_CANDLES}，0 不聚合)')
+    parser.add_argument('--zoom', type=str, default=None, help='只绘制该时间窗口 (UTC)，如 2025-06-01,2025-06-07')
+    parser.add_argument('--lot_method', type=str, default=METHOD_FIFO, choices=METHODS, help='持仓计价方式 (默认fifo)')
     
     args = parser.parse_args() 
     
@@ -351,14 +739,14 @@ if __name__ == "__main__":
     
     # 获取数据
     trades = get_hyperliquid_trades(args.address,  args.symbol, args.time_range) 
-    df = get_binance_klines(args.symbol,  args.interval,  args.time_range) 
+    df = get_binance_klines(args.symbol,  args.interval,  args.time_range, args.workers) 
     
     if not trades:
         print(f"\n⚠️ 警告: 未找到 {args.symbol}  的交易记录")
         exit()
     
     # 处理交易数据 
-    trade_data = process_trades(trades, args.symbol) 
+    trade_data = process_trades(trades, args.symbol, mark_price=df['close'].iloc[-1], method=args.lot_method) 
     
     # 打印摘要 
     print("\n交易摘要:")
@@ -0,0 +1,138 @@
+# 币安K线并发下载：把长时间区间切成每段 1000 根的请求，多线程共享一个 keep-alive 会话，
+# 按请求权重限流，按顺序拼接并检查缺口
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+
+import requests
+
+from rate_limit import TokenBucket
+
+BINANCE_API = "https://api.binance.com"
+KLINES_PATH = "/api/v3/klines"
+KLINES_LIMIT = 1000
+KLINES_WEIGHT = 2             # /api/v3/klines 单次请求权重
+WEIGHT_PER_MINUTE = 6000      # 币安 REQUEST_WEIGHT 每分钟上限
+WEIGHT_BUDGET = 0.5           # 只使用上限的一半，给同一IP上的其他程序留余量
+MAX_RETRIES = 5
+INTERVAL_UNITS = {"s": 1000, "m": 60 * 1000, "h": 3600 * 1000, "d": 86400 * 1000, "w": 7 * 86400 * 1000}
+
+
+def interval_to_milliseconds(interval):
+    """K线周期转换为毫秒，如 5m -> 300000；月线 (1M) 等不定长周期返回 None"""
+    try:
+        return int(interval[:-1]) * INTERVAL_UNITS[interval[-1]]
+    except (ValueError, KeyError):
+        return None
+
+
+class KlineDownloader:
+    """下载 [start_ms, end_ms] 内的K线，返回与 python-binance get_historical_klines 相同格式的列表"""
+
+    def __init__(self, base_url=BINANCE_API, workers=4, weight_per_minute=WEIGHT_PER_MINUTE * WEIGHT_BUDGET,
+                 timeout=10, verbose=True):
+        self.base_url = base_url.rstrip("/")
+        self.workers = workers
+        self.timeout = timeout
+        self.verbose = verbose
+        self.bucket = TokenBucket(weight_per_minute, capacity=max(KLINES_WEIGHT * workers, weight_per_minute / 10))
+        self.weight_limit = weight_per_minute / WEIGHT_BUDGET
+        # 所有线程共享一个会话，连接池大小与并发数一致，连接在多次请求间复用 (keep-alive)
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=max(workers, 1))
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.retries = 0
+
+    def _get(self, params):
+        for attempt in range(MAX_RETRIES):
+            self.bucket.acquire(KLINES_WEIGHT)
+            try:
+                resp = self.session.get(self.base_url + KLINES_PATH, params=params, timeout=self.timeout)
+            except requests.RequestException as e:
+                with self.lock:
+                    self.retries += 1
+                if self.verbose:
+                    print(f"⚠️ K线请求失败，重试 {attempt + 1}/{MAX_RETRIES}: {e}")
+                time.sleep(min(2 ** attempt, 30))
+                continue
+            with self.lock:
+                self.requests += 1
+            used = resp.headers.get("X-MBX-USED-WEIGHT-1M")
+            if used is not None:
+                self.bucket.sync(int(used), self.weight_limit)
+            if resp.status_code in (418, 429):
+                retry_after = int(resp.headers.get("Retry-After", 2 ** attempt))
+                with self.lock:
+                    self.retries += 1
+                if self.verbose:
+                    print(f"⚠️ 触发币安限流 ({resp.status_code})，暂停 {retry_after} 秒")
+                self.bucket.pause(retry_after)
+                continue
+            if resp.status_code >= 500:
+                with self.lock:
+                    self.retries += 1
+                time.sleep(min(2 ** attempt, 30))
+                continue
+            resp.raise_for_status()
+            return resp.json()
+        raise RuntimeError(f"K线请求多次失败: {params}")
+
+    def _fetch_chunk(self, task):
+        symbol, interval, interval_ms, start_ms, end_ms = task
+        klines = []
+        cursor = start_ms
+        # 通常一次请求即可取完一段；服务端返回条数不足时（例如上限更小）继续向后取
+        while cursor <= end_ms:
+            page = self._get({"symbol": symbol, "interval": interval, "startTime": cursor,
+                              "endTime": end_ms, "limit": KLINES_LIMIT})
+            if not page:
+                break
+            klines.extend(page)
+            cursor = int(page[-1][0]) + interval_ms
+            if len(page) < KLINES_LIMIT:
+                break
+        return klines
+
+    def download(self, symbol, interval, start_ms, end_ms, interval_ms):
+        """并发下载并按开盘时间顺序拼接，返回 (K线列表, 缺口列表 [(缺口开始, 缺口结束)])"""
+        chunk_ms = KLINES_LIMIT * interval_ms
+        tasks = [(symbol, interval, interval_ms, t, min(t + chunk_ms - 1, end_ms)) for t in range(start_ms, end_ms + 1, chunk_ms)]
+        started = time.time()
+        with ThreadPoolExecutor(max_workers=max(1, min(self.workers, len(tasks)))) as pool:
+            # map 按提交顺序返回，直接拼接即为时间顺序
+            chunks = list(pool.map(self._fetch_chunk, tasks))
+
+        klines = []
+        last_open = None
+        for chunk in chunks:
+            for kline in chunk:
+                open_time = int(kline[0])
+                if last_open is not None and open_time <= last_open:
+                    continue  # 段边界上的重复K线
+                klines.append(kline)
+                last_open = open_time
+        gaps = find_gaps([int(k[0]) for k in klines], interval_ms, start_ms)
+        if self.verbose:
+            print(f"📥 {symbol} {interval}: {len(tasks)} 段, {len(klines)} 根K线, {self.requests} 次请求, "
+                  f"限流等待 {self.bucket.waited:.1f}秒, 耗时 {time.time() - started:.2f}秒")
+            for gap_start, gap_end in gaps:
+                print(f"⚠️ K线缺口: {gap_start} -> {gap_end}")
+        return klines, gaps
+
+
+def find_gaps(open_times, interval_ms, start_ms=None):
+    """相邻K线开盘时间间隔大于一个周期的位置（交易所停机或新上市前的数据缺失）"""
+    gaps = []
+    previous = None
+    if start_ms is not None and open_times:
+        first_expected = start_ms + (-start_ms) % interval_ms
+        if open_times[0] > first_expected:
+            gaps.append((first_expected, open_times[0] - interval_ms))
+    for open_time in open_times:
+        if previous is not None and open_time - previous > interval_ms:
+            gaps.append((previous + interval_ms, open_time - interval_ms))
+        previous = open_time
+    return gaps
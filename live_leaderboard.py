@@ -0,0 +1,247 @@
+# 实时盈亏排行榜：记录器每收到一笔成交就更新买卖双方的持仓（平均成本法，与 cohort_pnl --method average 相同），
+# 未实现盈亏按各代币最新成交价计算。排名用按地址索引的最大堆，每笔成交更新两个地址，O(log n)；
+# 定期发布到文件或飞书，并把全部状态写入检查点，重启后从检查点继续，不需要重放当天的成交
+# 检查点保存每个代币最近处理的 tid，重启后重新订阅时推送的最近成交按 tid 丢弃；不按时间过滤，流水线多线程乱序到达的成交不会丢失
+import heapq
+import json
+import os
+import threading
+from datetime import datetime
+
+from fill_integrity import RecentTidSet
+from lot_engine import apply_average_cost
+
+CHECKPOINT_FILENAME = "leaderboard_state.json"
+LEADERBOARD_FILENAME = "leaderboard.json"
+RECENT_TIDS = 5000  # 每个代币保存到检查点的最近 tid 数，需覆盖重新订阅时推送的最近成交
+
+
+class IndexedHeap:
+    """按键索引的最大堆：update/remove O(log n)，top(k) O(k log k)，不弹出元素"""
+
+    def __init__(self):
+        self.keys = []    # 堆数组
+        self.scores = {}  # 键 -> 分数
+        self.index = {}   # 键 -> 在堆数组中的位置
+
+    def __len__(self):
+        return len(self.keys)
+
+    def update(self, key, score):
+        i = self.index.get(key)
+        if i is None:
+            self.keys.append(key)
+            self.scores[key] = score
+            self.index[key] = len(self.keys) - 1
+            self._sift_up(len(self.keys) - 1)
+            return
+        old = self.scores[key]
+        self.scores[key] = score
+        if score > old:
+            self._sift_up(i)
+        elif score < old:
+            self._sift_down(i)
+
+    def remove(self, key):
+        i = self.index.pop(key, None)
+        if i is None:
+            return
+        del self.scores[key]
+        last = self.keys.pop()
+        if i < len(self.keys):
+            self.keys[i] = last
+            self.index[last] = i
+            self._sift_up(i)
+            self._sift_down(self.index[last])
+
+    def rebuild(self, scores):
+        """从 {键: 分数} 一次性建堆，O(n)"""
+        self.scores = dict(scores)
+        self.keys = list(self.scores)
+        self.index = {key: i for i, key in enumerate(self.keys)}
+        for i in range(len(self.keys) // 2 - 1, -1, -1):
+            self._sift_down(i)
+
+    def top(self, k):
+        """分数最高的 k 个 [(键, 分数)]：从堆顶按分数展开候选节点"""
+        result = []
+        if not self.keys:
+            return result
+        candidates = [(-self.scores[self.keys[0]], 0)]
+        while candidates and len(result) < k:
+            neg_score, i = heapq.heappop(candidates)
+            result.append((self.keys[i], -neg_score))
+            for child in (2 * i + 1, 2 * i + 2):
+                if child < len(self.keys):
+                    heapq.heappush(candidates, (-self.scores[self.keys[child]], child))
+        return result
+
+    def _swap(self, i, j):
+        keys = self.keys
+        keys[i], keys[j] = keys[j], keys[i]
+        self.index[keys[i]] = i
+        self.index[keys[j]] = j
+
+    def _sift_up(self, i):
+        scores, keys = self.scores, self.keys
+        while i > 0:
+            parent = (i - 1) // 2
+            if scores[keys[parent]] >= scores[keys[i]]:
+                break
+            self._swap(i, parent)
+            i = parent
+
+    def _sift_down(self, i):
+        scores, keys = self.scores, self.keys
+        n = len(keys)
+        while True:
+            largest = i
+            for child in (2 * i + 1, 2 * i + 2):
+                if child < n and scores[keys[child]] > scores[keys[largest]]:
+                    largest = child
+            if largest == i:
+                return
+            self._swap(i, largest)
+            i = largest
+
+
+class LiveLeaderboard:
+    """所有代币、所有地址的实时持仓和盈亏；update 可以被多个线程调用"""
+
+    def __init__(self, folder, top_k=20, verbose=1):
+        self.folder = folder
+        self.top_k = top_k
+        self.verbose = verbose
+        self.checkpoint_path = os.path.join(folder, CHECKPOINT_FILENAME)
+        self.output_path = os.path.join(folder, LEADERBOARD_FILENAME)
+        # 地址 -> {"realized": 已实现盈亏, "fills": 成交笔数, "positions": {代币: [持仓, 均价]}}
+        self.accounts = {}
+        self.marks = {}       # 代币 -> 最新成交价
+        self.mark_times = {}  # 代币 -> 最新成交价对应的成交时间(毫秒)，乱序到达的旧成交不覆盖
+        self.recent = RecentTidSet(capacity=RECENT_TIDS)  # 代币 -> 最近处理的 tid
+        self.heap = IndexedHeap()
+        self.trades = 0
+        self.lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.checkpoint_path):
+            return
+        try:
+            with open(self.checkpoint_path, "r", encoding="utf-8") as f:
+                state = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"⚠️ 读取排行榜检查点失败，从空状态开始: {e}")
+            return
+        self.accounts = state.get("accounts", {})
+        self.marks = {coin: float(px) for coin, px in state.get("marks", {}).items()}
+        self.mark_times = {coin: int(t) for coin, t in state.get("mark_times", {}).items()}
+        self.recent.load_dict(state.get("recent_tids", {}))
+        self.trades = int(state.get("trades", 0))
+        self.heap.rebuild({address: self._score(account) for address, account in self.accounts.items()})
+        print(f"🏆 已从检查点恢复 {len(self.accounts)} 个地址 ({state.get('saved_at')})")
+
+    def _unrealized(self, account):
+        return sum(position * (self.marks[coin] - entry) for coin, (position, entry) in account["positions"].items())
+
+    def _score(self, account):
+        return account["realized"] + self._unrealized(account)
+
+    def _apply(self, address, coin, qty, px):
+        account = self.accounts.get(address)
+        if account is None:
+            account = self.accounts[address] = {"realized": 0.0, "fills": 0, "positions": {}}
+        position, entry = account["positions"].get(coin, (0.0, None))
+        position, entry, realized = apply_average_cost(position, entry, qty, px)
+        if position:
+            account["positions"][coin] = [position, entry]
+        else:
+            account["positions"].pop(coin, None)
+        account["realized"] += realized
+        account["fills"] += 1
+        self.heap.update(address, self._score(account))
+
+    def update(self, coin, trades):
+        """处理一批成交（websocket trades 消息格式，users = [买方, 卖方]）"""
+        with self.lock:
+            for trade in trades:
+                # 已经处理过的成交（检查点恢复后重新订阅推送的最近成交）
+                if not self.recent.add(coin, trade.get("tid")):
+                    continue
+                px = float(trade["px"])
+                sz = float(trade["sz"])
+                time_ms = int(trade.get("time", 0))
+                if time_ms >= self.mark_times.get(coin, 0):
+                    self.marks[coin] = px
+                    self.mark_times[coin] = time_ms
+                self.trades += 1
+                users = trade.get("users", [])
+                # 自成交不改变持仓
+                if len(users) < 2 or users[0] == users[1]:
+                    continue
+                self._apply(users[0], coin, sz, px)
+                self._apply(users[1], coin, -sz, px)
+
+    def snapshot(self, k=None):
+        """按最新成交价重新计算持仓地址的盈亏，返回前 k 名"""
+        with self.lock:
+            for address, account in self.accounts.items():
+                if account["positions"]:
+                    self.heap.update(address, self._score(account))
+            rows = []
+            for rank, (address, total) in enumerate(self.heap.top(k or self.top_k), 1):
+                account = self.accounts[address]
+                unrealized = self._unrealized(account)
+                rows.append({
+                    "rank": rank,
+                    "address": address,
+                    "total_pnl": total,
+                    "realized_pnl": account["realized"],
+                    "unrealized_pnl": unrealized,
+                    "fills": account["fills"],
+                    "positions": {coin: position for coin, (position, _) in account["positions"].items()},
+                })
+            return rows
+
+    def publish(self, feishu=False):
+        """把排行榜写入 leaderboard.json，可选同时发送到飞书"""
+        rows = self.snapshot()
+        with self.lock:
+            data = {
+                "updated_at": datetime.now().isoformat(timespec="seconds"),
+                "addresses": len(self.accounts),
+                "trades": self.trades,
+                "marks": dict(self.marks),
+                "leaderboard": rows,
+            }
+        os.makedirs(self.folder, exist_ok=True)
+        tmp_path = self.output_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=1)
+        os.replace(tmp_path, self.output_path)
+        if self.verbose >= 1:
+            print(f"🏆 排行榜已更新: {len(rows)} 名 / {data['addresses']} 个地址 -> {self.output_path}")
+        if feishu and rows:
+            from feishu_msg import send_feishu_text
+            lines = [f"{row['rank']:>2}. {row['address']} 总盈亏 ${row['total_pnl']:,.0f} "
+                     f"(已实现 ${row['realized_pnl']:,.0f}) {' '.join(f'{c}:{p:g}' for c, p in row['positions'].items())}"
+                     for row in rows]
+            send_feishu_text(f"实时盈亏排行榜 Top {len(rows)}", f"时间: {data['updated_at']}\n" + "\n".join(lines))
+        return rows
+
+    def checkpoint(self):
+        """持久化全部地址状态、最新价格和每个代币的处理位置"""
+        with self.lock:
+            payload = json.dumps({
+                "saved_at": datetime.now().isoformat(timespec="seconds"),
+                "trades": self.trades,
+                "marks": self.marks,
+                "mark_times": self.mark_times,
+                "recent_tids": self.recent.to_dict(),
+                "accounts": self.accounts,
+            })
+        os.makedirs(self.folder, exist_ok=True)
+        tmp_path = self.checkpoint_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(payload)
+        os.replace(tmp_path, self.checkpoint_path)
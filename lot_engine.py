@@ -0,0 +1,114 @@
+# 持仓批次(lot)撮合引擎：多头和空头各自一个双端队列，支持 FIFO / LIFO / 平均成本 三种计价方式
+# 开仓 O(1)，平仓按消耗的批次数摊销 O(1)；未实现盈亏使用显式传入的标记价格
+from collections import deque
+
+METHOD_FIFO = "fifo"
+METHOD_LIFO = "lifo"
+METHOD_AVERAGE = "average"
+METHODS = (METHOD_FIFO, METHOD_LIFO, METHOD_AVERAGE)
+
+LONG = "long"
+SHORT = "short"
+
+QTY_EPSILON = 1e-12  # 剩余数量小于该值的批次视为已平完
+ZERO_TOLERANCE = 1e-9  # 累加浮点误差，绝对值小于该值的持仓视为平仓
+
+
+class LotBook:
+    """单个代币的持仓批次簿"""
+
+    def __init__(self, method=METHOD_FIFO):
+        if method not in METHODS:
+            raise ValueError(f"不支持的计价方式: {method}，可选 {', '.join(METHODS)}")
+        self.method = method
+        # 每个批次: [数量, 价格, 时间]；平均成本法下每边只有一个合并批次
+        self.lots = {LONG: deque(), SHORT: deque()}
+        self.qty = {LONG: 0.0, SHORT: 0.0}
+        self.cost = {LONG: 0.0, SHORT: 0.0}  # 未平仓批次的 数量*价格 之和
+        self.realized_pnl = 0.0
+
+    def open(self, side, qty, price, timestamp=None):
+        """开仓（加仓）"""
+        lots = self.lots[side]
+        if self.method == METHOD_AVERAGE and lots:
+            lot = lots[0]
+            lot[1] = (lot[0] * lot[1] + qty * price) / (lot[0] + qty)
+            lot[0] += qty
+        else:
+            lots.append([qty, price, timestamp])
+        self.qty[side] += qty
+        self.cost[side] += qty * price
+
+    def close(self, side, qty, price):
+        """平仓，返回本次已实现盈亏；超出持仓的数量被忽略并作为第二个值返回"""
+        lots = self.lots[side]
+        sign = 1.0 if side == LONG else -1.0
+        realized = 0.0
+        remaining = qty
+        while remaining > QTY_EPSILON and lots:
+            # FIFO 从最早的批次平，LIFO 从最新的批次平；平均成本只有一个批次
+            lot = lots[-1] if self.method == METHOD_LIFO else lots[0]
+            matched = min(lot[0], remaining)
+            realized += sign * matched * (price - lot[1])
+            self.cost[side] -= matched * lot[1]
+            lot[0] -= matched
+            remaining -= matched
+            if lot[0] <= QTY_EPSILON:
+                if self.method == METHOD_LIFO:
+                    lots.pop()
+                else:
+                    lots.popleft()
+        matched_qty = qty - max(remaining, 0.0)
+        self.qty[side] -= matched_qty
+        if not lots:
+            self.qty[side] = 0.0
+            self.cost[side] = 0.0
+        self.realized_pnl += realized
+        return realized, max(remaining, 0.0)
+
+    def trade(self, signed_qty, price, timestamp=None):
+        """按带符号数量成交：先平反方向持仓，剩余部分开新仓（反手）"""
+        if signed_qty > 0:
+            close_side, open_side, qty = SHORT, LONG, signed_qty
+        else:
+            close_side, open_side, qty = LONG, SHORT, -signed_qty
+        realized, remaining = self.close(close_side, qty, price)
+        if remaining > QTY_EPSILON:
+            self.open(open_side, remaining, price, timestamp)
+        return realized
+
+    @property
+    def position(self):
+        """净持仓，多为正空为负"""
+        return self.qty[LONG] - self.qty[SHORT]
+
+    def average_price(self, side):
+        return self.cost[side] / self.qty[side] if self.qty[side] > QTY_EPSILON else None
+
+    def unrealized_pnl(self, mark_price):
+        return ((mark_price * self.qty[LONG] - self.cost[LONG])
+                + (self.cost[SHORT] - mark_price * self.qty[SHORT]))
+
+    def open_lots(self):
+        """未平仓批次列表"""
+        return ([{"timestamp": t, "price": p, "qty": q, "position_type": LONG} for q, p, t in self.lots[LONG]]
+                + [{"timestamp": t, "price": p, "qty": q, "position_type": SHORT} for q, p, t in self.lots[SHORT]])
+
+
+def apply_average_cost(position, entry_price, qty, px):
+    """平均成本法处理一笔带符号成交（单个净持仓，不保留批次），返回 (新持仓, 新均价, 已实现盈亏)
+    加仓更新 VWAP，减仓按 VWAP 结算且均价不变，反手时新方向的均价为成交价"""
+    new_position = position + qty
+    if abs(new_position) < ZERO_TOLERANCE:
+        new_position = 0.0
+    if not position:
+        return new_position, (px if new_position else None), 0.0
+    if (qty > 0) == (position > 0):
+        return new_position, (abs(position) * entry_price + abs(qty) * px) / abs(new_position), 0.0
+    closed = min(abs(qty), abs(position))
+    realized = closed * (px - entry_price) * (1.0 if position > 0 else -1.0)
+    if not new_position:
+        return 0.0, None, realized
+    if abs(qty) - closed < ZERO_TOLERANCE:
+        return new_position, entry_price, realized
+    return new_position, px, realized
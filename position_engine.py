@@ -0,0 +1,235 @@
+# 持仓计算引擎：按时间顺序的成交 -> 累计持仓、平均开仓价(VWAP)、已实现盈亏、按市价计算的持仓价值
+# 全部用 numpy 累积运算完成，没有逐笔的 Python 循环；可以按块流式计算，块之间传递 PositionState
+# compute_group_positions 对按地址分组排列的成交一次性计算所有地址（平均成本法或 FIFO）
+from dataclasses import dataclass
+
+import numpy as np
+
+from lot_engine import METHOD_AVERAGE, METHOD_FIFO, ZERO_TOLERANCE
+
+
+@dataclass
+class PositionState:
+    """一个数据块结束时的状态，作为下一块的起点"""
+    position: float = 0.0
+    entry_price: float = np.nan
+    realized_pnl: float = 0.0
+    last_price: float = np.nan
+    fills: int = 0
+
+
+def signed_quantity(df, user_address):
+    """从用户角度的带符号成交量：成交记录中 user1 为买方、user2 为卖方（自成交为 0）"""
+    address = user_address.lower()
+    sz = df['sz'].to_numpy(dtype=np.float64)
+    is_buyer = (df['user1'].astype(str).str.lower() == address).to_numpy()
+    is_seller = (df['user2'].astype(str).str.lower() == address).to_numpy()
+    return sz * is_buyer - sz * is_seller
+
+
+def affine_scan(a, b):
+    """x_i = a_i * x_{i-1} + b_i 的前缀扫描（x_{-1} = 0），log2(n) 轮向量运算
+    a 在 [0, 1] 内时结果有界，a = 0 即从该位置重新开始"""
+    a = np.array(a, dtype=np.float64)
+    b = np.array(b, dtype=np.float64)
+    shift = 1
+    while shift < len(a):
+        b[shift:] = a[shift:] * b[:-shift] + b[shift:]
+        a[shift:] = a[shift:] * a[:-shift]
+        shift *= 2
+        # a 全为 0 后后续轮次不再改变 b（分组/反手频繁时远少于 log2(n) 轮）
+        if not a[shift:].any():
+            break
+    return a, b
+
+
+def split_open_close(qty, prev_position):
+    """每笔成交拆成 平仓量（与成交前持仓方向相反、不超过原持仓的部分）和 开仓量（其余部分，反手时为新方向的持仓量）
+    按成交前持仓判断，累加误差留下的极小持仓不会产生极小的平仓量"""
+    closing = (prev_position != 0) & (np.sign(qty) == -np.sign(prev_position))
+    close_qty = np.where(closing, np.minimum(np.abs(qty), np.abs(prev_position)), 0.0)
+    open_qty = np.abs(qty) - close_qty
+    open_qty[open_qty < ZERO_TOLERANCE] = 0.0
+    return open_qty, close_qty
+
+
+def vwap_weight(open_qty, close_qty, prev_position):
+    """VWAP 递推 entry_i = w_i * entry_{i-1} + (1 - w_i) * px_i 的系数
+    减仓/无变化 w = 1，加仓 w = 原持仓/新持仓，从空仓开仓或反手 w = 0"""
+    adding = (open_qty > 0) & (close_qty == 0) & (prev_position != 0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        weight = np.where(adding, np.abs(prev_position) / (np.abs(prev_position) + open_qty), 1.0)
+    return np.where((open_qty > 0) & ~adding, 0.0, weight)
+
+
+def compute_positions(px, qty, state=None):
+    """平均成本法计算持仓，返回 (列字典, 新状态)
+    - 开仓/加仓时 VWAP = (原持仓 * 原VWAP + 开仓量 * 成交价) / 新持仓
+    - 减仓部分按 VWAP 结算已实现盈亏，VWAP 不变
+    - 反手的成交拆成 平仓 + 新方向开仓"""
+    state = state or PositionState()
+    px = np.asarray(px, dtype=np.float64)
+    qty = np.asarray(qty, dtype=np.float64)
+    n = len(qty)
+
+    position = state.position + np.cumsum(qty)
+    position[np.abs(position) < ZERO_TOLERANCE] = 0.0
+    prev_position = np.concatenate([[state.position], position[:-1]]) if n else position
+
+    open_qty, close_qty = split_open_close(qty, prev_position)
+    weight = vwap_weight(open_qty, close_qty, prev_position)
+    prod, entry = affine_scan(weight, (1.0 - weight) * px)
+    if state.position != 0 and n:
+        entry = entry + prod * state.entry_price
+    entry_price = np.where(position != 0, entry, np.nan)
+
+    # 减仓按成交前的 VWAP 结算
+    prev_entry = np.concatenate([[state.entry_price], entry_price[:-1]]) if n else entry_price
+    realized = np.where(close_qty > 0, close_qty * (px - prev_entry) * np.sign(prev_position), 0.0)
+    realized_cum = state.realized_pnl + np.cumsum(realized)
+
+    columns = {
+        "signed_qty": qty,
+        "cumulative_position": position,
+        "entry_price": entry_price,
+        "realized_pnl": realized_cum,
+        "unrealized_pnl": np.where(position != 0, position * (px - entry_price), 0.0),
+        "position_value": position * px,
+    }
+
+    if n:
+        state = PositionState(
+            position=float(position[-1]),
+            entry_price=float(entry_price[-1]),
+            realized_pnl=float(realized_cum[-1]),
+            last_price=float(px[-1]),
+            fills=state.fills + n,
+        )
+    return columns, state
+
+
+def segment_cumsum(values, group_start):
+    """分组累加：group_start 标记每组的第一个位置（第一个元素必须为 True），组之间互不影响
+    每组起点减去上一组的合计，累加值始终在单个组的量级，不会像 全局cumsum - 组起点 那样随地址数丢失精度"""
+    values = np.asarray(values, dtype=np.float64)
+    if not len(values):
+        return values.copy()
+    starts = np.flatnonzero(group_start)
+    adjusted = values.copy()
+    adjusted[starts[1:]] -= np.add.reduceat(values, starts)[:-1]
+    return np.cumsum(adjusted)
+
+
+def _shift(values, group_start, fill):
+    """每组内的上一个值，组的第一个位置为 fill"""
+    previous = np.concatenate([[fill], values[:-1]]) if len(values) else values.copy()
+    previous[group_start] = fill
+    return previous
+
+
+def _fifo_cost(x, open_index, open_prev_qty, open_prev_cost, open_px, group_lo, group_hi, base):
+    """组内累计开仓量为 x 时，按 FIFO 已消耗批次的累计成本（开仓批次按顺序排成分段线性函数）"""
+    j = np.searchsorted(open_index[1], x + base, side="left")
+    j = np.clip(j, group_lo, group_hi)
+    return open_prev_cost[j] + (x - open_prev_qty[j]) * open_px[j]
+
+
+def compute_group_positions(group_start, px, qty, method=METHOD_AVERAGE):
+    """对按 (地址, 时间) 排列的成交同时计算所有地址的持仓，返回列字典
+    - group_start: 每个地址第一笔成交的位置为 True，各地址从空仓开始
+    - method: average 与 compute_positions 相同；fifo 按开仓批次顺序结算
+    - realized_pnl 为每笔成交的已实现盈亏（不累加），便于按任意时间窗口求和
+    - entry_price: 平均成本法为 VWAP，FIFO 为剩余批次的平均成本"""
+    if method not in (METHOD_AVERAGE, METHOD_FIFO):
+        raise ValueError(f"分组计算只支持 {METHOD_AVERAGE} / {METHOD_FIFO}: {method}")
+    group_start = np.asarray(group_start, dtype=bool)
+    px = np.asarray(px, dtype=np.float64)
+    qty = np.asarray(qty, dtype=np.float64)
+    if not len(qty):
+        empty = np.zeros(0)
+        return {"signed_qty": qty, "cumulative_position": empty, "entry_price": empty, "realized_pnl": empty}
+
+    position = segment_cumsum(qty, group_start)
+    position[np.abs(position) < ZERO_TOLERANCE] = 0.0
+    prev_position = _shift(position, group_start, 0.0)
+    open_qty, close_qty = split_open_close(qty, prev_position)
+
+    if method == METHOD_AVERAGE:
+        weight = vwap_weight(open_qty, close_qty, prev_position)
+        _, entry = affine_scan(weight, (1.0 - weight) * px)
+        entry_price = np.where(position != 0, entry, np.nan)
+        prev_entry = _shift(entry_price, group_start, np.nan)
+        realized = np.where(close_qty > 0, close_qty * (px - prev_entry) * np.sign(prev_position), 0.0)
+    else:
+        # 组内累计开仓量 O 和累计开仓成本 K；开仓批次按顺序首尾相接，
+        # 平仓消耗 [O - |持仓| - 平仓量, O - |持仓|] 这一段，成本为分段线性函数在两端的差
+        opened = segment_cumsum(open_qty, group_start)
+        opened_cost = segment_cumsum(open_qty * px, group_start)
+        global_opened = np.cumsum(open_qty)
+        base = global_opened - opened  # 各组起点的全局累计开仓量，只用于定位批次
+        lots = np.flatnonzero(open_qty > 0)
+        open_index = (lots, global_opened[lots])
+        open_prev_qty = opened[lots] - open_qty[lots]
+        open_prev_cost = opened_cost[lots] - open_qty[lots] * px[lots]
+        # 每笔成交只能在本组的批次范围内查找，防止浮点误差落到相邻地址的批次上
+        group = np.cumsum(group_start) - 1
+        starts = np.flatnonzero(group_start)
+        ends = np.concatenate([starts[1:], [len(qty)]])
+        last = max(len(lots) - 1, 0)
+        group_lo = np.minimum(np.searchsorted(lots, starts), last)[group]
+        group_hi = np.clip(np.searchsorted(lots, ends) - 1, 0, last)[group]
+        args = (open_index, open_prev_qty, open_prev_cost, px[lots], group_lo, group_hi, base)
+        consumed = opened - np.abs(position)
+        consumed_cost = _fifo_cost(consumed, *args)
+        closed_cost = consumed_cost - _fifo_cost(consumed - close_qty, *args)
+        realized = np.where(close_qty > 0, np.sign(prev_position) * (close_qty * px - closed_cost), 0.0)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            entry_price = np.where(position != 0, (opened_cost - consumed_cost) / np.abs(position), np.nan)
+
+    return {
+        "signed_qty": qty,
+        "cumulative_position": position,
+        "entry_price": entry_price,
+        "realized_pnl": realized,
+    }
+
+
+def sort_fills(df):
+    """多个文件的成交按 (时间, tid) 合并排序"""
+    keys = [c for c in ("time", "tid") if c in df]
+    return df.sort_values(keys, kind="stable", ignore_index=True)
+
+
+def user_positions(df, user_address, state=None, sort=True):
+    """对一个用户的全部成交计算持仓，返回 (带持仓列的 DataFrame, 结束状态)"""
+    if sort:
+        df = sort_fills(df)
+    columns, state = compute_positions(df['px'].to_numpy(dtype=np.float64), signed_quantity(df, user_address), state)
+    result = df.assign(**columns)
+    return result, state
+
+
+def iter_user_positions(chunks, user_address):
+    """流式模式：逐块计算，每块产出 (部分结果, 当前状态)；要求各块已按时间顺序排列"""
+    state = PositionState()
+    for chunk in chunks:
+        if not len(chunk):
+            continue
+        result, state = user_positions(chunk, user_address, state)
+        yield result, state
+
+
+def summarize(state, mark_price=None):
+    """按标记价格（默认最后成交价）汇总持仓"""
+    mark = state.last_price if mark_price is None else mark_price
+    unrealized = state.position * (mark - state.entry_price) if state.position else 0.0
+    return {
+        "position": state.position,
+        "entry_price": state.entry_price,
+        "mark_price": mark,
+        "position_value": state.position * mark,
+        "realized_pnl": state.realized_pnl,
+        "unrealized_pnl": unrealized,
+        "total_pnl": state.realized_pnl + unrealized,
+        "fills": state.fills,
+    }
@@ -0,0 +1,44 @@
+# 请求权重限流：令牌桶，多个线程共享，按接口权重扣减
+import threading
+import time
+
+
+class TokenBucket:
+    """容量 capacity，每分钟补充 per_minute 个令牌；acquire 在令牌不足时阻塞等待"""
+
+    def __init__(self, per_minute, capacity=None):
+        self.rate = per_minute / 60.0
+        self.capacity = capacity if capacity is not None else per_minute
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+        self.waited = 0.0  # 累计等待秒数
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, weight=1):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self._refill(now)
+                if now >= self.paused_until and self.tokens >= weight:
+                    self.tokens -= weight
+                    return
+                wait = max(self.paused_until - now, (weight - self.tokens) / self.rate)
+                self.waited += wait
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        """服务端返回限流（429/Retry-After）时暂停所有请求，并清空令牌"""
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self.tokens = 0.0
+
+    def sync(self, used, limit):
+        """按服务端报告的已用权重校正本地令牌数"""
+        with self.lock:
+            self._refill(time.monotonic())
+            self.tokens = min(self.tokens, max(0.0, (limit - used) * self.capacity / limit))
@@ -0,0 +1,62 @@
+# 合并后会话文件继续追加写入：目录索引、加载器和地址索引只读取未合并的部分，不重复计数
+import os
+
+import pandas as pd
+
+from compact_fills import compact
+from fill_catalog import DAILY_SUBDIR, FillCatalog, load_manifest
+from fill_index import AddressIndex
+from fill_loader import load_fills
+from fill_sink import FILL_HEADERS
+
+SESSION = "2025_07_01T00_00_00_BTC_trade_data.csv"
+USERS = ["0xaaaa", "0xbbbb", "0xcccc"]
+
+
+def rows(first_tid, count):
+    lines = []
+    for tid in range(first_tid, first_tid + count):
+        values = {"coin": "BTC", "px": "100.0", "sz": "1.0", "side": "Buy", "time": f"2025-07-01T00:{tid // 60:02d}:{tid % 60:02d}",
+                  "user1": USERS[tid % 3], "user2": USERS[(tid + 1) % 3], "hash": "0x0", "tid": str(tid)}
+        lines.append(",".join(values[c] for c in FILL_HEADERS) + "\n")
+    return "".join(lines)
+
+
+def load_all(folder, columns=("tid", "time", "user1", "user2")):
+    files = FillCatalog(folder).refresh().lookup("BTC")
+    return files, load_fills(files, columns=list(columns))
+
+
+def test_session_grown_after_compaction_is_not_double_counted(tmp_path):
+    folder = str(tmp_path)
+    session = os.path.join(folder, SESSION)
+    with open(session, "w", encoding="utf-8") as f:
+        f.write(",".join(FILL_HEADERS) + "\n" + rows(0, 15))
+    compact(folder, os.path.join(folder, DAILY_SUBDIR), min_age=0)
+    files, df = load_all(folder)
+    assert [os.path.basename(f) for f in files] == ["2025_07_01_BTC_trade_data.csv.gz"]
+    assert len(df) == 15
+
+    # 记录器继续写入同一个会话文件（最后一行还没写完）
+    with open(session, "a", encoding="utf-8") as f:
+        f.write(rows(15, 10) + "BTC,100.0,1.0,Buy,2025-07-01T00:")
+    files, df = load_all(folder)
+    assert len(files) == 2
+    assert len(df) == 25 and df["tid"].nunique() == 25
+    assert len(load_fills(files, columns=["tid"], workers=2)) == 25
+
+    index = AddressIndex(folder)
+    index.update(files)
+    indexed, unindexed = index.load_address(files, USERS[0], columns=["tid", "user1", "user2"])
+    expected = df[(df["user1"] == USERS[0]) | (df["user2"] == USERS[0])]
+    assert not unindexed
+    assert sorted(indexed["tid"]) == sorted(expected["tid"])
+
+    # 再次合并：只处理新增的完整行，会话文件重新被每日文件代替
+    compact(folder, os.path.join(folder, DAILY_SUBDIR), min_age=0)
+    files, df = load_all(folder)
+    assert [os.path.basename(f) for f in files] == ["2025_07_01_BTC_trade_data.csv.gz"]
+    assert len(df) == 25 and df["tid"].nunique() == 25
+    daily = pd.read_csv(os.path.join(folder, DAILY_SUBDIR, "2025_07_01_BTC_trade_data.csv.gz"))
+    assert list(daily["tid"]) == list(range(25))
+    assert load_manifest(os.path.join(folder, DAILY_SUBDIR))["sources"][SESSION] < os.path.getsize(session)
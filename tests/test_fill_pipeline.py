@@ -0,0 +1,81 @@
+# 流水线多线程写盘：同一代币的消息由同一个线程处理，会话CSV保持时间顺序
+import csv
+import importlib
+import json
+import os
+import random
+import sys
+import threading
+import time
+
+from fill_pipeline import FramePipeline
+
+
+def jittered(handler, seed=0):
+    """处理前随机等待，放大线程间的竞争"""
+    rng = random.Random(seed)
+    lock = threading.Lock()
+
+    def wrapper(frame):
+        with lock:
+            delay = rng.random() * 0.002
+        time.sleep(delay)
+        handler(frame)
+    return wrapper
+
+
+def trade_frames(coins, frames_per_coin, trades_per_frame=3):
+    frames = []
+    tid = 0
+    base = 1751328000000
+    for i in range(frames_per_coin):
+        for coin in coins:
+            trades = []
+            for _ in range(trades_per_frame):
+                tid += 1
+                trades.append({"coin": coin, "side": "B", "px": "100.0", "sz": "1.0", "time": base + tid,
+                               "hash": "0x0", "tid": tid, "users": ["0xa", "0xb"]})
+            frames.append(json.dumps({"channel": "trades", "data": trades}))
+    return frames
+
+
+def test_same_key_keeps_arrival_order():
+    seen = {}
+    lock = threading.Lock()
+
+    def handler(frame):
+        key, seq = frame
+        with lock:
+            seen.setdefault(key, []).append(seq)
+
+    pipeline = FramePipeline(jittered(handler), workers=2, key=lambda frame: frame[0], verbose=0)
+    for seq in range(300):
+        for key in ("BTC", "ETH", "SOL"):
+            pipeline.submit((key, seq))
+    pipeline.close()
+    assert seen == {key: list(range(300)) for key in ("BTC", "ETH", "SOL")}
+    assert pipeline.stats()["processed"] == 900
+
+
+def test_logger_with_two_workers_writes_time_ordered_files(tmp_path, monkeypatch):
+    monkeypatch.setattr(sys, "argv", ["download_trade_data.py", "--folder", str(tmp_path), "--coins", "BTC,ETH",
+                                      "--pipeline", "--workers", "2", "--batch_size", "5", "--verbose", "0"])
+    sys.modules.pop("download_trade_data", None)
+    logger = importlib.import_module("download_trade_data")
+    client = logger.HyperliquidWebSocket(coins=["BTC", "ETH"])
+    client.pipeline.handler = jittered(client.pipeline.handler)
+
+    for frame in trade_frames(["BTC", "ETH"], 200):
+        client.on_message(None, frame)
+    client.pipeline.close()
+    for sink in client.sinks.values():
+        sink.close()
+
+    for coin in ("BTC", "ETH"):
+        with open(logger.csv_filename(coin), newline="", encoding="utf-8") as f:
+            rows = list(csv.DictReader(f))
+        assert len(rows) == 600
+        times = [row["time"] for row in rows]
+        assert times == sorted(times)
+        tids = [int(row["tid"]) for row in rows]
+        assert tids == sorted(tids)
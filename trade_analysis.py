@@ -1,47 +1,65 @@
-import pandas as pd
+# pandas/numpy 及依赖它们的模块在用到的函数内导入，--help 和参数错误时不加载
 import argparse
+import itertools
 import os
+import time
 from datetime import datetime
+from fill_integrity import overlapping_gaps
+from fill_catalog import FillCatalog
 
 def find_csv_files(symbol, search_path, buy_start_time, buy_end_time, sell_start_time, sell_end_time):
-    """根据代币名称和时间区间查找对应的CSV文件"""
-    # 获取目录下所有CSV文件
-    csv_files = [f for f in os.listdir(search_path) if f.endswith('.csv') and symbol in f]
-    # csv_files 按照时间排序
-    csv_files.sort(key=lambda x: datetime.strptime(x[0:19], '%Y_%m_%dT%H_%M_%S'))
-    
-    matched_files = []
-    
-    # 文件名格式: 2025_06_16T02_07_56_ETH_trade_data.csv
-    for file in csv_files:
-        # 提取文件名中的时间信息
-        file_time_str = file[0:19]  # 时间信息在文件名的前三个部分
-        file_time = datetime.strptime(file_time_str, '%Y_%m_%dT%H_%M_%S')
-        
-        # 计算文件的结束时间（下一个文件的开始时间或当前时间）
-        file_end_time = None
-        if csv_files.index(file) + 1 < len(csv_files):
-            next_file = csv_files[csv_files.index(file) + 1]
-            next_file_time_str = next_file[0:19]
-            file_end_time = datetime.strptime(next_file_time_str, '%Y_%m_%dT%H_%M_%S')
-        else:
-            file_end_time = datetime.now()
-        buy_start = datetime.strptime(buy_start_time, '%Y-%m-%dT%H:%M:%S')
-        buy_end = datetime.strptime(buy_end_time, '%Y-%m-%dT%H:%M:%S')
-        sell_start = datetime.strptime(sell_start_time, '%Y-%m-%dT%H:%M:%S')
-        sell_end = datetime.strptime(sell_end_time, '%Y-%m-%dT%H:%M:%S')
-        if (buy_start <= file_time <= buy_end) or (sell_start <= file_time <= sell_end) or \
-           (file_time <= buy_start < file_end_time) or (file_time <= sell_start < file_end_time):
-            matched_files.append(os.path.join(search_path, file))
-    
-    return matched_files
+    """根据代币名称和时间区间查找对应的CSV文件（通过目录索引做区间查找）"""
+    from fill_store import to_epoch_ms
+    catalog = FillCatalog(search_path).refresh()
+    matched_files = set()
+    for start, end in ((buy_start_time, buy_end_time), (sell_start_time, sell_end_time)):
+        matched_files.update(catalog.lookup(symbol, to_epoch_ms(start), to_epoch_ms(end)))
+    # 按文件开始时间排序
+    return sorted(matched_files, key=lambda f: catalog.entry(f)["first_ms"])
+
+def load_columnar_trades(symbol, search_path, buy_start_time, buy_end_time, sell_start_time, sell_end_time):
+    """从列式存储读取覆盖买入和卖出区间的交易"""
+    from fill_store import read_columnar_fills
+    start = min(buy_start_time, sell_start_time)
+    end = max(buy_end_time, sell_end_time)
+    return read_columnar_fills(search_path, symbol, start, end)
 
-def find_buy_sell_addresses(csv_files, buy_start_time, buy_end_time, sell_start_time, sell_end_time, min_trade_value=0.0):
-    # 加载数据
-    df = pd.concat([pd.read_csv(file) for file in csv_files])
+TRADE_COLUMNS = ['px', 'sz', 'side', 'time', 'user1']
+
+def load_trades(csv_files, start=None, end=None, windows=None, workers=1):
+    """加载交易数据，时间、价格和数量只解析一次；时间和方向过滤在分块读取时完成"""
+    import pandas as pd
+    from fill_loader import load_fills
+    # csv_files 也可以直接传入已加载的 DataFrame
+    if isinstance(csv_files, pd.DataFrame):
+        df = csv_files.copy()
+    else:
+        return load_fills(csv_files, columns=TRADE_COLUMNS, start=start, end=end, windows=windows, workers=workers)
 
     # 转换时间列
-    df['time'] = pd.to_datetime(df['time'], format='ISO8601')
+    if not pd.api.types.is_datetime64_any_dtype(df['time']):
+        df['time'] = pd.to_datetime(df['time'], format='ISO8601')
+    df['px'] = df['px'].astype(float)
+    df['sz'] = df['sz'].astype(float)
+    return df
+
+def aggregate_by_address(trades):
+    """按地址(user1)一次性分组计算成交均价和数量"""
+    import pandas as pd
+    grouped = pd.DataFrame({
+        'address': trades['user1'],
+        'notional': trades['px'] * trades['sz'],
+        'quantity': trades['sz'],
+    }).groupby('address', observed=True, sort=False).sum()
+    return pd.DataFrame({
+        'avg_price': grouped['notional'] / grouped['quantity'],
+        'quantity': grouped['quantity'],
+    })
+
+def find_buy_sell_addresses(csv_files, buy_start_time, buy_end_time, sell_start_time, sell_end_time, min_trade_value=0.0, workers=1):
+    import pandas as pd
+    # 加载数据，只保留买入窗口的 Buy 和卖出窗口的 Sell
+    df = load_trades(csv_files, windows=[(buy_start_time, buy_end_time, 'Buy'), (sell_start_time, sell_end_time, 'Sell')], workers=workers)
 
     # 筛选买入和卖出的交易
     buy_trades = df[(df['time'] >= buy_start_time) & (df['time'] <= buy_end_time) & (df['side'] == 'Buy')]
@@ -49,46 +67,151 @@ def find_buy_sell_addresses(csv_files, buy_start_time, buy_end_time, sell_start_
 
     # 过滤掉交易价值过小的订单
     if min_trade_value > 0:
-        buy_trades = buy_trades[(buy_trades['px'].astype(float) * buy_trades['sz'].astype(float)) >= min_trade_value]
-        sell_trades = sell_trades[(sell_trades['px'].astype(float) * sell_trades['sz'].astype(float)) >= min_trade_value]
+        buy_trades = buy_trades[(buy_trades['px'] * buy_trades['sz']) >= min_trade_value]
+        sell_trades = sell_trades[(sell_trades['px'] * sell_trades['sz']) >= min_trade_value]
 
-    # 获取所有买入和卖出地址
     # 买入地址：在买入时间段内作为买方 (Buy交易中的user1)
-    buy_addresses = set(buy_trades['user1'].unique())
-    
     # 卖出地址：在卖出时间段内作为卖方 (Sell交易中的user1)
-    sell_addresses = set(sell_trades['user1'].unique())
-
-    # 找出在两个时间段内有交易的地址
-    common_addresses = list(buy_addresses.intersection(sell_addresses))
-
-    # 初始化结果列表
-    results = []
-
-    for address in common_addresses:
-        # 买入信息 - 该地址作为买方 (Buy交易)
-        buy_info = buy_trades[buy_trades['user1'] == address]
-        buy_avg_price = (buy_info['px'].astype(float) * buy_info['sz'].astype(float)).sum() / buy_info['sz'].astype(float).sum()
-        buy_quantity = buy_info['sz'].astype(float).sum()
-        
-        # 卖出信息 - 该地址作为卖方 (Sell交易)
-        sell_info = sell_trades[sell_trades['user1'] == address]
-        sell_avg_price = (sell_info['px'].astype(float) * sell_info['sz'].astype(float)).sum() / sell_info['sz'].astype(float).sum()
-        sell_quantity = sell_info['sz'].astype(float).sum()
-        
-        # 盈亏计算
-        profit = (sell_avg_price - buy_avg_price) * min(buy_quantity, sell_quantity)
-        
-        results.append({
-            'address': address,
-            'buy_avg_price': buy_avg_price,
-            'sell_avg_price': sell_avg_price,
-            'buy_quantity': buy_quantity,
-            'sell_quantity': sell_quantity,
-            'profit': profit
+    buy_info = aggregate_by_address(buy_trades)
+    sell_info = aggregate_by_address(sell_trades)
+
+    # 只保留在两个时间段内都有交易的地址
+    merged = buy_info.join(sell_info, how='inner', lsuffix='_buy', rsuffix='_sell')
+
+    # 盈亏计算
+    result = pd.DataFrame({
+        'address': merged.index.astype(str),
+        'buy_avg_price': merged['avg_price_buy'].values,
+        'sell_avg_price': merged['avg_price_sell'].values,
+        'buy_quantity': merged['quantity_buy'].values,
+        'sell_quantity': merged['quantity_sell'].values,
+    })
+    result['profit'] = (result['sell_avg_price'] - result['buy_avg_price']) * \
+        result[['buy_quantity', 'sell_quantity']].min(axis=1)
+    return result
+
+class WindowSweep:
+    """一次加载成交，按 (地址, 时间) 排序后建立累计成交额/数量前缀和，
+    之后任意买入/卖出时间窗口的查询只需要对所有地址做二分查找"""
+
+    TIME_BITS = 41  # 相对毫秒时间占用的位数（约69年），高位存地址编号
+
+    def __init__(self, df, min_trade_value=0.0):
+        import numpy as np
+        import pandas as pd
+        df = load_trades(df)
+        if min_trade_value > 0:
+            df = df[(df['px'] * df['sz']) >= min_trade_value]
+        codes, self.addresses = pd.factorize(df['user1'], sort=False)
+        if len(self.addresses) >= 1 << (63 - self.TIME_BITS):
+            raise ValueError(f"地址数量过多: {len(self.addresses)}")
+        times = df['time'].values.astype('datetime64[ms]').astype(np.int64)
+        self.t0 = int(times.min()) if len(times) else 0
+        self.max_rel = (1 << self.TIME_BITS) - 1
+        self.codes = np.arange(len(self.addresses), dtype=np.int64)
+
+        self.sides = {}
+        side_values = df['side'].astype(str).values
+        for side in ('Buy', 'Sell'):
+            mask = side_values == side
+            keys = (codes[mask].astype(np.int64) << self.TIME_BITS) | (times[mask] - self.t0)
+            order = np.argsort(keys, kind='stable')
+            px = df['px'].values[mask][order]
+            sz = df['sz'].values[mask][order]
+            self.sides[side] = (
+                keys[order],
+                np.concatenate(([0.0], np.cumsum(px * sz))),
+                np.concatenate(([0.0], np.cumsum(sz))),
+            )
+
+    def _rel(self, value, ceil=False):
+        import pandas as pd
+        ns = pd.Timestamp(value).value
+        ms = -((-ns) // 1_000_000) if ceil else ns // 1_000_000
+        return ms - self.t0
+
+    def _window(self, side, start, end):
+        """返回每个地址在 [start, end] 内的成交额和数量"""
+        import numpy as np
+        keys, cum_notional, cum_qty = self.sides[side]
+        lo_rel, hi_rel = self._rel(start, ceil=True), self._rel(end)
+        if hi_rel < 0 or lo_rel > self.max_rel or lo_rel > hi_rel:
+            zeros = np.zeros(len(self.codes))
+            return zeros, zeros
+        lo_rel, hi_rel = max(lo_rel, 0), min(hi_rel, self.max_rel)
+        high = self.codes << self.TIME_BITS
+        lo = np.searchsorted(keys, high | lo_rel, side='left')
+        hi = np.searchsorted(keys, high | hi_rel, side='right')
+        return cum_notional[hi] - cum_notional[lo], cum_qty[hi] - cum_qty[lo]
+
+    def query(self, buy_start_time, buy_end_time, sell_start_time, sell_end_time):
+        """与 find_buy_sell_addresses 相同的结果，按 profit 从大到小排序"""
+        import numpy as np
+        import pandas as pd
+        buy_notional, buy_qty = self._window('Buy', buy_start_time, buy_end_time)
+        sell_notional, sell_qty = self._window('Sell', sell_start_time, sell_end_time)
+        mask = (buy_qty > 0) & (sell_qty > 0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            buy_avg = buy_notional[mask] / buy_qty[mask]
+            sell_avg = sell_notional[mask] / sell_qty[mask]
+        result = pd.DataFrame({
+            'address': np.asarray(self.addresses)[mask].astype(str),
+            'buy_avg_price': buy_avg,
+            'sell_avg_price': sell_avg,
+            'buy_quantity': buy_qty[mask],
+            'sell_quantity': sell_qty[mask],
         })
+        result['profit'] = (result['sell_avg_price'] - result['buy_avg_price']) * \
+            np.minimum(result['buy_quantity'], result['sell_quantity'])
+        return result.sort_values(by='profit', ascending=False, ignore_index=True)
+
+def build_windows(args):
+    """窗口列表：来自 --windows_file，或四个时间参数（逗号分隔）的笛卡尔积"""
+    if args.windows_file:
+        import pandas as pd
+        windows = pd.read_csv(args.windows_file, dtype=str)
+        return [tuple(row) for row in windows[['buy_start_time', 'buy_end_time', 'sell_start_time', 'sell_end_time']].itertuples(index=False)]
+    values = [args.buy_start_time, args.buy_end_time, args.sell_start_time, args.sell_end_time]
+    if any(v is None for v in values):
+        return []
+    lists = [[x.strip() for x in v.split(',') if x.strip()] for v in values]
+    return [w for w in itertools.product(*lists) if w[0] <= w[1] and w[2] <= w[3]]
+
+def run_sweep(args, windows):
+    """一次加载，批量查询多个窗口"""
+    import numpy as np
+    import pandas as pd
+    start = min(min(w[0], w[2]) for w in windows)
+    end = max(max(w[1], w[3]) for w in windows)
+
+    load_start = time.time()
+    if args.format == "columnar":
+        df = load_columnar_trades(args.symbol, args.dir, start, end, start, end)
+    else:
+        csv_files = find_csv_files(args.symbol, args.dir, start, end, start, end)
+        if not csv_files:
+            print("没有找到符合条件的CSV文件。")
+            return
+        df = load_trades(csv_files, start=start, end=end, workers=args.workers)
+    sweep = WindowSweep(df, args.min_trade_value)
+    print(f"加载并建立前缀和: {len(sweep.addresses)} 个地址, 耗时 {time.time() - load_start:.2f}秒")
+
+    tables = []
+    for buy_start, buy_end, sell_start, sell_end in windows:
+        query_start = time.perf_counter()
+        result = sweep.query(buy_start, buy_end, sell_start, sell_end)
+        elapsed = (time.perf_counter() - query_start) * 1000
+        print(f"\n买入 {buy_start} ~ {buy_end} | 卖出 {sell_start} ~ {sell_end} | "
+              f"{len(result)} 个地址 | 总盈亏 {result['profit'].sum():.2f} | 查询 {elapsed:.1f}ms")
+        with pd.option_context('display.max_rows', None, 'display.max_columns', None, 'display.width', None):
+            print(result.head(args.top))
+        tables.append(result.head(args.top).assign(
+            buy_start_time=buy_start, buy_end_time=buy_end, sell_start_time=sell_start, sell_end_time=sell_end,
+            rank=np.arange(1, min(args.top, len(result)) + 1)))
 
-    return pd.DataFrame(results)
+    if args.sweep_out and tables:
+        pd.concat(tables, ignore_index=True).to_csv(args.sweep_out, index=False)
+        print(f"\n排名结果已保存至: {args.sweep_out}")
 
 def parse_args():
     parser = argparse.ArgumentParser(description='交易数据分析工具')
@@ -96,16 +219,50 @@ def parse_args():
     # 原来的csv_file参数替换为以下两个参数
     parser.add_argument('--symbol', type=str, default="BTC", help='代币名称，例如BTC')
     parser.add_argument('--dir', type=str, default="./trading_data_cache/fills", help='数据文件目录')
-    parser.add_argument('--buy_start_time', type=str, required=True, help='买入开始时间，格式为YYYY-MM-DDTHH:MM:SS。')
-    parser.add_argument('--buy_end_time', type=str, required=True, help='买入结束时间，格式为YYYY-MM-DDTHH:MM:SS。')
-    parser.add_argument('--sell_start_time', type=str, required=True, help='卖出开始时间，格式为YYYY-MM-DDTHH:MM:SS。')
-    parser.add_argument('--sell_end_time', type=str, required=True, help='卖出结束时间，格式为YYYY-MM-DDTHH:MM:SS。')
+    parser.add_argument('--buy_start_time', type=str, help='买入开始时间，格式为YYYY-MM-DDTHH:MM:SS。逗号分隔多个值时对所有组合做窗口扫描')
+    parser.add_argument('--buy_end_time', type=str, help='买入结束时间，格式为YYYY-MM-DDTHH:MM:SS。')
+    parser.add_argument('--sell_start_time', type=str, help='卖出开始时间，格式为YYYY-MM-DDTHH:MM:SS。')
+    parser.add_argument('--sell_end_time', type=str, help='卖出结束时间，格式为YYYY-MM-DDTHH:MM:SS。')
+    parser.add_argument('--windows_file', type=str, default=None, help='窗口扫描：CSV文件，列为 buy_start_time,buy_end_time,sell_start_time,sell_end_time')
+    parser.add_argument('--sweep', action='store_true', help='强制使用窗口扫描模式（一次加载，多次查询）')
+    parser.add_argument('--top', type=int, default=20, help='窗口扫描时每个窗口显示的地址数，默认20')
+    parser.add_argument('--sweep_out', type=str, default=None, help='窗口扫描结果保存的CSV文件')
+    parser.add_argument('--format', type=str, default="csv", choices=["csv", "columnar"], help='数据格式：csv 或 columnar（列式分区存储）')
+    parser.add_argument('--workers', type=int, default=1, help='并行解析文件的进程数，默认1（串行）')
     parser.add_argument('--min_trade_value', type=float, default=0.0, help='过滤掉交易价值（价格 * 数量）小于该值的订单，默认为 0，不进行过滤。')
     
     return parser.parse_args()
 
+def warn_gaps(symbol, search_path, start_time, end_time):
+    """提示查询区间内记录器断线造成的数据缺口"""
+    from fill_store import to_epoch_ms
+    for gap in overlapping_gaps(search_path, symbol, to_epoch_ms(start_time), to_epoch_ms(end_time)):
+        print(f"⚠️ 数据不完整: {gap['start']} -> {gap['end']} ({gap['reason']})")
+
 def main():
     args = parse_args()
+    import pandas as pd
+    windows = build_windows(args)
+    if not windows:
+        print("请指定买入/卖出时间区间，或使用 --windows_file。")
+        return
+    warn_gaps(args.symbol, args.dir, min(min(w[0], w[2]) for w in windows), max(max(w[1], w[3]) for w in windows))
+
+    if args.sweep or len(windows) > 1:
+        run_sweep(args, windows)
+        return
+
+    if args.format == "columnar":
+        df = load_columnar_trades(args.symbol, args.dir, args.buy_start_time, args.buy_end_time, args.sell_start_time, args.sell_end_time)
+        if df.empty:
+            print("列式存储中没有找到符合条件的交易。")
+            return
+        print(f'处理列式数据: {len(df)} 条交易')
+        result_df = find_buy_sell_addresses(df, args.buy_start_time, args.buy_end_time, args.sell_start_time, args.sell_end_time, args.min_trade_value)
+        result_df = result_df.sort_values(by='profit', ascending=False)
+        with pd.option_context('display.max_rows', None, 'display.max_columns', None, 'display.width', None):
+            print(result_df)
+        return
     
     # 根据代币名称和时间区间查找CSV文件
     csv_files = find_csv_files(args.symbol, args.dir, args.buy_start_time, args.buy_end_time, args.sell_start_time, args.sell_end_time)
@@ -116,7 +273,7 @@ def main():
     
     # 处理找到的CSV文件
     print(f'处理文件: \n{"\n".join(csv_files)}')
-    result_df = find_buy_sell_addresses(csv_files, args.buy_start_time, args.buy_end_time, args.sell_start_time, args.sell_end_time, args.min_trade_value)
+    result_df = find_buy_sell_addresses(csv_files, args.buy_start_time, args.buy_end_time, args.sell_start_time, args.sell_end_time, args.min_trade_value, args.workers)
     # result_df 按照 profit 从大到小进行排序
     result_df = result_df.sort_values(by='profit', ascending=False)
     
@@ -1,63 +1,90 @@
 # 使用 argparse 参数为代币和 用户地址。
 # 读取交易数据，并生该用户买入卖出记录。图形化展示出来
-import pandas as pd
-import matplotlib.pyplot as plt
+# pandas/numpy 及依赖它们的模块（fill_store、fill_loader、fill_index、position_engine）在用到的函数内导入
 import argparse
 import os
-import glob
-import re
 from datetime import datetime, timedelta
+from fill_integrity import overlapping_gaps
+from fill_catalog import FillCatalog
 
-def find_csv_files(symbol, search_path, days):
-    # 使用glob匹配所有可能符合条件的文件
-    pattern = os.path.join(search_path,  f'*{symbol}_trade_data.csv') 
-    files = glob.glob(pattern) 
+USER_COLUMNS = ["coin", "px", "sz", "side", "time", "user1", "user2", "tid"]
 
-    if not files:
-        return []
+def normalize_address(user_address):
+    """记录的成交中地址为小写；查询前统一一次，索引、扫描、列式和流式几种读取方式匹配到相同的行"""
+    return user_address.strip().lower()
 
+def find_csv_files(symbol, search_path, days):
+    """通过目录索引查找最近 days 天内有成交的文件"""
+    from fill_store import to_epoch_ms
     current_time = datetime.now() 
     start_time = current_time - timedelta(days=days)
+    catalog = FillCatalog(search_path).refresh()
+    return catalog.lookup(symbol, to_epoch_ms(start_time), to_epoch_ms(current_time))
 
-    matched_files = []
-    # 构建正则表达式模式：整个文件名必须符合：时间戳_代币符号_trade_data.csv 
-    # 时间戳格式：2025_06_21T19_08_42
-    regex_pattern = re.compile(r'^(\d{4}_\d{1,2}_\d{1,2}T\d{1,2}_\d{1,2}_\d{1,2})_'  + re.escape(symbol)  + r'_trade_data\.csv$')
-
-    for file_path in files:
-        file_name = os.path.basename(file_path) 
-        match = regex_pattern.match(file_name) 
-        if match:
-            timestamp_str = match.group(1) 
-            try:
-                # 转换时间字符串为datetime对象
-                file_time = datetime.strptime(timestamp_str,  '%Y_%m_%dT%H_%M_%S')
-                # 检查时间是否在指定区间内
-                if start_time <= file_time <= current_time:
-                    matched_files.append(file_path) 
-            except ValueError:
-                # 如果时间格式不对，跳过
-                continue
+def load_indexed_fills(path, files, user_address, start_time, workers=1):
+    """通过地址倒排索引只读取该地址的行，无法索引的文件（如 zstd）回退到全量扫描"""
+    import pandas as pd
+    from fill_index import AddressIndex
+    from fill_loader import load_fills, finalize_fills
+    index = AddressIndex(path)
+    updated = index.update(files)
+    if updated:
+        print(f"🗂️ 地址索引更新了 {updated} 个文件")
+    df, unindexed = index.load_address(files, user_address, columns=USER_COLUMNS)
+    frames = []
+    if df is not None:
+        df['time'] = pd.to_datetime(df['time'], format='ISO8601')
+        frames.append(df[df['time'] >= start_time])
+    if unindexed:
+        frames.append(load_fills(unindexed, columns=USER_COLUMNS, start=start_time, users=[user_address], workers=workers))
+    if not frames:
+        return load_fills([], columns=USER_COLUMNS)
+    df = pd.concat(frames, ignore_index=True).sort_values(['time', 'tid'], kind='stable', ignore_index=True)
+    return finalize_fills(df)
 
-    return matched_files
-def analyze_user_trades(token, path, user_address, days=7):
+def analyze_user_trades(token, path, user_address, days=7, fmt="csv", workers=1, use_index=True):
+    from fill_loader import load_fills
+    from fill_store import read_columnar_fills, to_epoch_ms
+    from position_engine import sort_fills
+    user_address = normalize_address(user_address)
+    # 提示时间范围内记录器断线造成的数据缺口
+    for gap in overlapping_gaps(path, token, to_epoch_ms(datetime.now() - timedelta(days=days)), to_epoch_ms(datetime.now())):
+        print(f"⚠️ 数据不完整: {gap['start']} -> {gap['end']} ({gap['reason']})")
+    if fmt == "columnar":
+        # 列式存储按小时分区，直接按时间区间读取
+        start_time = datetime.now() - timedelta(days=days)
+        df = read_columnar_fills(path, token, start_time)
+        df = df[(df['user1'] == user_address) | (df['user2'] == user_address)]
+        return sort_fills(df)
 
     relevant_files = find_csv_files(token, path, days)
    
     print(f"找到 {len(relevant_files)} 个相关的文件 \n{relevant_files}")
     # 读取CSV文件，按照 user 和时间范围过滤
     start_time  = datetime.now() - timedelta(days=days)
-    dfs = []
-    for file in relevant_files:
-        df = pd.read_csv(file)
-        # 转换时间列
-        df['time'] = pd.to_datetime(df['time'], format='ISO8601')
-        # 筛选在时间范围内的交易
-        df = df[(df['time'] >= start_time) & ((df['user1'] == user_address) | (df['user2'] == user_address))]
-        dfs.append(df)
-    
-  
-    return dfs
+    if use_index:
+        return load_indexed_fills(path, relevant_files, user_address, start_time, workers)
+    # 分块读取，时间和地址过滤在每个数据块内完成
+    df = load_fills(relevant_files, columns=USER_COLUMNS, start=start_time, users=[user_address], workers=workers)
+    return sort_fills(df)
+
+def stream_user_positions(token, path, user_address, days=7, use_index=True):
+    """流式模式：按文件顺序逐个读取该地址的成交并增量计算持仓，每个文件产出一次部分结果
+    文件按开始时间排序，相互重叠的会话文件应先用 compact_fills.py 合并"""
+    from fill_loader import load_fills
+    from position_engine import iter_user_positions, sort_fills
+    user_address = normalize_address(user_address)
+    start_time = datetime.now() - timedelta(days=days)
+    files = find_csv_files(token, path, days)
+
+    def chunks():
+        for file in files:
+            if use_index:
+                yield load_indexed_fills(path, [file], user_address, start_time)
+            else:
+                yield sort_fills(load_fills([file], columns=USER_COLUMNS, start=start_time, users=[user_address]))
+
+    yield from iter_user_positions(chunks(), user_address)
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Analyze user trading data')
@@ -65,10 +92,30 @@ if __name__ == "__main__":
     parser.add_argument('--user', '-u', type=str, required=True, help='User address')
     parser.add_argument('--days', '-d', type=int, default=7, help='Number of days to analyze (default: 7)')
     parser.add_argument('--csv_path', '-c', type=str, default="./trading_data_cache/fills/", help='CSV path')
+    parser.add_argument('--workers', '-w', type=int, default=1, help='Processes used to parse files in parallel (default: 1)')
+    parser.add_argument('--format', '-f', type=str, default="csv", choices=["csv", "columnar"], help='Data format: csv or columnar (default: csv)')
+    parser.add_argument('--no_index', action='store_true', help='Scan all rows instead of using the address index')
+    parser.add_argument('--stream', action='store_true', help='Compute positions file by file and print partial results')
+    parser.add_argument('--mark_price', type=float, default=None, help='Mark price for position value (default: last fill price)')
     args = parser.parse_args()
+    from position_engine import user_positions, summarize
     
-    result_df = analyze_user_trades(args.symbal, args.csv_path, args.user, args.days)
-    
-    if result_df is not None:
-        print(f"Latest position for user {args.user}: {result_df.iloc[-1]['cumulative_position']:.4f} {args.token}")
-        print(f"Position value: ${result_df.iloc[-1]['position_value']:.2f}")
+    if args.stream:
+        state = None
+        for partial, state in stream_user_positions(args.symbal, args.csv_path, args.user, args.days, not args.no_index):
+            print(f"{partial['time'].iloc[-1]} 成交 {state.fills} 笔, 持仓 {state.position:.4f} {args.symbal}, 已实现盈亏 ${state.realized_pnl:.2f}")
+    else:
+        trades = analyze_user_trades(args.symbal, args.csv_path, args.user, args.days, args.format, args.workers, not args.no_index)
+        result_df, state = user_positions(trades, args.user, sort=False)
+        if len(result_df):
+            print(result_df[['time', 'side', 'px', 'sz', 'cumulative_position', 'entry_price', 'realized_pnl', 'position_value']].tail(20).to_string(index=False))
+        state = state if len(result_df) else None
+
+    if state is not None:
+        summary = summarize(state, args.mark_price)
+        print(f"Latest position for user {args.user}: {summary['position']:.4f} {args.symbal}")
+        print(f"Entry price (VWAP): {summary['entry_price']:.4f}, mark price: {summary['mark_price']:.4f}")
+        print(f"Position value: ${summary['position_value']:.2f}")
+        print(f"Realized PnL: ${summary['realized_pnl']:.2f}, unrealized PnL: ${summary['unrealized_pnl']:.2f}")
+    else:
+        print(f"No trades found for user {args.user}")
@@ -1,15 +1,124 @@
 import argparse
+import json
+import queue
 import time
-import pandas as pd
-from hyperliquid.info import Info
-from hyperliquid.utils import constants
 import threading
-SYMBOLS = ['BTC', 'ETH', 'SOL']
+from concurrent.futures import ThreadPoolExecutor
 
+# pandas 和 requests 在用到的函数内导入，--help 不需要加载它们
 from feishu_msg import send_feishu_text
+from fill_integrity import RecentTidSet
+from lot_engine import apply_average_cost
+from rate_limit import TokenBucket
 
 SYMBOLS = ['BTC', 'ETH', 'SOL']
 
+MAINNET_API_URL = "https://api.hyperliquid.xyz"
+INFO_PATH = "/info"
+HL_WEIGHT_PER_MINUTE = 1200   # Hyperliquid 每个IP每分钟的 REST 权重上限
+USER_STATE_WEIGHT = 2         # clearinghouseState 单次请求权重
+WEIGHT_BUDGET = 0.8           # 只使用上限的 80%，给同一IP上的其他程序留余量
+MIN_SLEEP = 1.0               # 全部地址失败时至少等待的秒数，连续失败时指数退避
+MAX_BACKOFF = 60.0
+FAILURE_WARN_THRESHOLD = 5    # 同一地址连续失败达到该次数时提示
+
+WS_URL = "wss://api.hyperliquid.xyz/ws"
+MAX_WS_USERS = 10             # Hyperliquid 每个IP的用户类订阅最多覆盖 10 个不同地址，其余地址仍用 REST 轮询
+WS_USERS_PER_CONNECTION = 5   # 每个连接订阅的地址数，一个连接断开只影响这部分地址
+WS_PING_INTERVAL = 50         # 应用层心跳秒数，服务端 60 秒无消息会断开连接
+RECONNECT_DELAY = 5           # 断线重连等待时间(秒)
+EVENT_BATCH_WINDOW = 0.2      # 收到成交后继续收集的秒数，同时发生的多笔成交合并为一次表格刷新和报警检查
+
+
+class StatePoller:
+    """并发获取多个地址的 clearinghouseState：线程池共享一个 keep-alive 会话，按请求权重限流
+    单个地址失败只影响该地址，沿用它上一次成功的状态"""
+
+    def __init__(self, base_url=MAINNET_API_URL, workers=8, weight_per_minute=HL_WEIGHT_PER_MINUTE * WEIGHT_BUDGET,
+                 timeout=10):
+        import requests
+        self.url = base_url.rstrip("/") + INFO_PATH
+        self.timeout = timeout
+        self.bucket = TokenBucket(weight_per_minute, capacity=max(USER_STATE_WEIGHT * workers, weight_per_minute / 10))
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=max(workers, 1))
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.pool = ThreadPoolExecutor(max_workers=max(workers, 1))
+        self.states = {}    # 地址 -> 最近一次成功的 user_state
+        self.failures = {}  # 地址 -> 连续失败次数
+
+    def user_state(self, address):
+        """单个地址的 clearinghouseState，返回 (结果, 请求耗时秒)"""
+        self.bucket.acquire(USER_STATE_WEIGHT)
+        started = time.perf_counter()
+        resp = self.session.post(self.url, json={"type": "clearinghouseState", "user": address}, timeout=self.timeout)
+        elapsed = time.perf_counter() - started
+        if resp.status_code == 429:
+            # 触发服务端限流：暂停所有线程的请求
+            self.bucket.pause(float(resp.headers.get("Retry-After", 10)))
+        resp.raise_for_status()
+        return resp.json(), elapsed
+
+    def poll(self, addresses):
+        """获取一轮所有地址的状态，返回本轮统计；结果合并到 self.states"""
+        started = time.perf_counter()
+        waited = self.bucket.waited
+        futures = {address: self.pool.submit(self.user_state, address) for address in addresses}
+        latencies = []
+        errors = {}
+        for address, future in futures.items():
+            try:
+                state, elapsed = future.result()
+            except Exception as e:
+                errors[address] = e
+                self.failures[address] = self.failures.get(address, 0) + 1
+                continue
+            self.states[address] = state
+            self.failures.pop(address, None)
+            latencies.append(elapsed)
+        return {
+            "cycle": time.perf_counter() - started,
+            "latencies": latencies,
+            "errors": errors,
+            "waited": self.bucket.waited - waited,
+        }
+
+    def close(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
+        self.session.close()
+
+
+def report_cycle(stats, addresses):
+    """打印一轮轮询的耗时统计和失败的地址"""
+    latencies = sorted(stats["latencies"])
+    if latencies:
+        p50 = latencies[len(latencies) // 2] * 1000
+        p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000
+        latency = f"请求 p50 {p50:.0f}ms p95 {p95:.0f}ms max {latencies[-1] * 1000:.0f}ms"
+    else:
+        latency = "无成功请求"
+    print(f"⏱️ 本轮 {len(addresses)} 个地址 {stats['cycle']:.2f}秒 | {latency} | "
+          f"失败 {len(stats['errors'])} | 限流等待 {stats['waited']:.1f}秒(各线程累计)")
+    for address, error in stats["errors"].items():
+        print(f"⛔ {address}: {type(error).__name__}: {error}")
+
+
+def classify_change(previous_size, current_size):
+    """根据前后两次持仓大小判断操作类型；没有变化时返回空字符串"""
+    diff = round(abs(current_size - previous_size), 4)
+    if current_size == previous_size:
+        return ""
+    if previous_size != 0 and current_size == 0.0:
+        return "平仓🔴"
+    if previous_size == 0.0 and current_size != 0.0:
+        return "开仓🟢"
+    if (previous_size > 0 and current_size < 0) or (previous_size < 0 and current_size > 0):
+        return "反手🟡"
+    if abs(current_size) > abs(previous_size):
+        return f"⏫{diff}"
+    return f"⏬{diff}"
+
 def difference(last, now):
     if last is None:
         return
@@ -38,22 +147,7 @@ def difference(last, now):
             previous_size, previous_entry, _ = previous_pos
             
             # 检测操作类型
-            diff = round(abs(current_size - previous_size), 4)
-            if current_size == previous_size:
-                operation = ""
-            elif previous_size != 0 and current_size == 0.0:
-                operation = "平仓🔴"
-            elif previous_size == 0.0 and current_size != 0.0:
-                operation = "开仓🟢"
-            elif (previous_size > 0 and current_size < 0) or (previous_size < 0 and current_size > 0):
-                operation = "反手🟡"
-            else:
-                if abs(current_size) > abs(previous_size):
-                    operation = f"⏫{diff}"
-                else:
-                    operation = f"⏬{diff}"
-
-            
+            operation = classify_change(previous_size, current_size)
             now.iat[i, j] = (current_size, current_entry, operation)
 
 
@@ -70,110 +164,365 @@ def alert_filter(symbol, dir, msg):
     _prev_states[symbol] = dir
 
 
-def monitor_positions(symbols, addresses):
-    """Monitor positions for specified token and detect changes"""
+def process_snapshot(symbols, addresses, users_positions, last):
+    """用各地址的 user_state 生成持仓表，与上一次比较并检查报警，返回本次的表
+    还没有成功获取过状态的地址不出现在表中，避免首次成功时误报开仓"""
+    import pandas as pd
+    addresses = [address for address in addresses if address in users_positions]
+    results = []
+    row = []
+    row.append("Address")
+    row += symbols
+    results.append(row)
 
-    last = None
-    info = Info(constants.MAINNET_API_URL, skip_ws=True)
-    while True:
-        # Check for each address
-        # users_positions
-        users_positions = {}
-        
-        try:
-            for address in addresses:
-                # Get user's fills and positions
-                positions = info.user_state(address)
-                users_positions[address] = positions
-        except Exception as e:
-            print(f"Error: {e}")
-            # 网络错误的图标
-            print("network error! ⛔")
-            continue
-    
-        results = []
+    # 每一行对应一个地址
+    for address in addresses:
         row = []
-        row.append("Address")
-        row += symbols
+        row.append(address)
+        for symbol in symbols:
+            # 获取该地址的仓位信息
+            positions = users_positions[address]
+            # 查找当前 token 的仓位
+            position_found = next((pos for pos in positions['assetPositions'] if pos['position']['coin'] == symbol), None)
+            if position_found:
+                szi = float(position_found['position']['szi'])  # 假设 size 表示持仓比例
+                entryPx = float(position_found['position']['entryPx'])
+                position_ratio = (szi, entryPx, "unknown")
+            else:
+                position_ratio = (0, 0, "空仓")
+            row.append(position_ratio)
         results.append(row)
 
-        # 每一行对应一个地址
-        for address in addresses:
-            row = []
-            row.append(address)
-            for symbol in symbols:
-                # 获取该地址的仓位信息
-                positions = users_positions[address]
-                # 查找当前 token 的仓位
-                position_found = next((pos for pos in positions['assetPositions'] if pos['position']['coin'] == symbol), None)
-                if position_found:
-                    szi = float(position_found['position']['szi'])  # 假设 size 表示持仓比例
-                    entryPx = float(position_found['position']['entryPx'])
-                    position_ratio = (szi, entryPx, "unknown")
-                else:
-                    position_ratio = (0, 0, "空仓")
-                row.append(position_ratio)
-            results.append(row)
-
-        # 打印表格
-        print("===============================================================================")
-        date_time_str = time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime())
-        print(f"position: {date_time_str}")
+    # 打印表格
+    print("===============================================================================")
+    date_time_str = time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime())
+    print(f"position: {date_time_str}")
+    
+    df_result = pd.DataFrame(results)
+    difference(last, df_result)
+    with pd.option_context('display.max_rows', None, 'display.max_columns', None, 'display.width', None):
+        print(df_result)
+
+    # 检测持仓方向一致性
+    for col_idx in range(1, len(df_result.columns)):
+        coin_positions = df_result.iloc[1:, col_idx]  # 跳过标题行
+        non_zero_positions = [pos for pos in coin_positions if pos[0] != 0.0]  # 过滤空仓
+        coin = df_result.iloc[0, col_idx]
+        if len(non_zero_positions) < 2:
+            continue  # 至少需要两个非空仓仓位才能判断一致性
+        
+        # 检查所有非空仓仓位是否方向一致
+        direction = ""
+        if all(pos[0] > 0 for pos in non_zero_positions):
+            direction = 'LONG'
+        elif all(pos[0] < 0 for pos in non_zero_positions):
+            direction = 'SHORT'
+        else:
+            direction = "opposite"
         
-        df_result = pd.DataFrame(results)
-        difference(last, df_result)
-        with pd.option_context('display.max_rows', None, 'display.max_columns', None, 'display.width', None):
-            print(df_result)
-
-        # 检测持仓方向一致性
-        for col_idx in range(1, len(df_result.columns)):
-            coin_positions = df_result.iloc[1:, col_idx]  # 跳过标题行
-            non_zero_positions = [pos for pos in coin_positions if pos[0] != 0.0]  # 过滤空仓
-            coin = df_result.iloc[0, col_idx]
-            if len(non_zero_positions) < 2:
-                continue  # 至少需要两个非空仓仓位才能判断一致性
+        alert_filter(coin, direction, f"日期: {date_time_str}\n警报: {coin} {direction}\n {df_result.iloc[0:, col_idx]}")
+
+    # 检测反手开仓
+    for col_idx in range(1, len(df_result.columns)):
+        current_coin_positions = df_result.iloc[1:, col_idx]
+        coin = df_result.iloc[0, col_idx]
+        count = 0
+        
+        for i in range(len(current_coin_positions)):
+            current_pos = current_coin_positions.iloc[i]
             
-            # 检查所有非空仓仓位是否方向一致
-            direction = ""
-            if all(pos[0] > 0 for pos in non_zero_positions):
-                direction = 'LONG'
-            elif all(pos[0] < 0 for pos in non_zero_positions):
-                direction = 'SHORT'
+            # 检查是否有反手操作标记
+            if isinstance(current_pos, tuple) and len(current_pos) >= 3 and current_pos[2] in ["反手🟡"]:
+                count += 1
+        
+        if count > 2:
+            send_feishu_text("多人反手报警", f"日期: {date_time_str}\n{coin}-{count}多人反手操作\n{df_result.iloc[0:, col_idx]}")
+
+    return df_result
+
+
+def monitor_positions(symbols, addresses, workers=8, interval=1.0, weight_per_minute=HL_WEIGHT_PER_MINUTE * WEIGHT_BUDGET,
+                      base_url=MAINNET_API_URL):
+    """Monitor positions for specified token and detect changes"""
+
+    last = None
+    poller = StatePoller(base_url, workers=workers, weight_per_minute=weight_per_minute)
+    cycle_floor = len(addresses) * USER_STATE_WEIGHT / weight_per_minute * 60
+    print(f"🚦 限流 {weight_per_minute:.0f} 权重/分钟，{len(addresses)} 个地址每轮至少 {cycle_floor:.1f} 秒")
+    failed_cycles = 0
+    try:
+        while True:
+            stats = poller.poll(addresses)
+            report_cycle(stats, addresses)
+            for address, count in poller.failures.items():
+                if count == FAILURE_WARN_THRESHOLD:
+                    print(f"⚠️ {address} 已连续失败 {count} 次，表中为该地址最后一次成功的持仓")
+            if poller.states:
+                last = process_snapshot(symbols, addresses, poller.states, last)
+            # 每轮都要等待：全部失败（如断网）时指数退避，否则补足到 interval 秒
+            failed_cycles = failed_cycles + 1 if len(stats["errors"]) == len(addresses) else 0
+            if failed_cycles:
+                print("network error! ⛔")
+                time.sleep(min(MIN_SLEEP * 2 ** (failed_cycles - 1), MAX_BACKOFF))
             else:
-                direction = "opposite"
-            
-            alert_filter(coin, direction, f"日期: {date_time_str}\n警报: {coin} {direction}\n {df_result.iloc[0:, col_idx]}")
+                time.sleep(max(interval - stats["cycle"], 0.05))
+    finally:
+        poller.close()
 
-        # 检测反手开仓
-        for col_idx in range(1, len(df_result.columns)):
-            current_coin_positions = df_result.iloc[1:, col_idx]
-            coin = df_result.iloc[0, col_idx]
-            count = 0
-            
-            for i in range(len(current_coin_positions)):
-                current_pos = current_coin_positions.iloc[i]
-                
-                # 检查是否有反手操作标记
-                if isinstance(current_pos, tuple) and len(current_pos) >= 3 and current_pos[2] in ["反手🟡"]:
-                    count += 1
-            
-            if count > 2:
-                send_feishu_text("多人反手报警", f"日期: {date_time_str}\n{coin}-{count}多人反手操作\n{df_result.iloc[0:, col_idx]}")
+class PositionTracker:
+    """websocket 模式下各地址的持仓
+    userFills 的每笔成交带有 startPosition，成交后持仓 = startPosition ± sz，不依赖本地累加；
+    REST 快照只在 (重)连接时用于同步，不会覆盖比快照更新的成交"""
+
+    def __init__(self, symbols):
+        self.symbols = set(symbols)
+        self.positions = {}  # 地址 -> {代币: [持仓, 均价, 最后成交时间(毫秒)]}
+        self.synced = set()  # 至少成功同步过一次的地址
+        self.tids = RecentTidSet(capacity=1000)
+        self.lock = threading.Lock()
+
+    def apply_state(self, address, state):
+        """用 clearinghouseState 覆盖持仓，返回与之前不同的 [(代币, 原持仓, 新持仓)]（首次同步不算变化）"""
+        snapshot_time = int(state.get("time", 0))
+        current = {p['position']['coin']: p['position'] for p in state.get('assetPositions', [])}
+        changes = []
+        with self.lock:
+            book = self.positions.setdefault(address, {})
+            first = address not in self.synced
+            self.synced.add(address)
+            for coin in self.symbols:
+                previous = book.get(coin, [0.0, 0.0, 0])
+                if previous[2] > snapshot_time:
+                    continue  # 快照之后已经收到成交
+                position = current.get(coin)
+                size = float(position['szi']) if position else 0.0
+                entry = float(position['entryPx']) if position and position.get('entryPx') else 0.0
+                book[coin] = [size, entry, previous[2]]
+                if not first and size != previous[0]:
+                    changes.append((coin, previous[0], size))
+        return changes
+
+    def apply_fill(self, address, fill):
+        """处理一笔成交，返回 (代币, 成交前持仓, 成交后持仓)；重复成交或不关注的代币返回 None"""
+        coin = fill.get("coin")
+        if coin not in self.symbols:
+            return None
+        with self.lock:
+            if not self.tids.add(address, fill.get("tid")):
+                return None
+            px = float(fill["px"])
+            start = float(fill["startPosition"])
+            qty = float(fill["sz"]) if fill["side"] == "B" else -float(fill["sz"])
+            book = self.positions.setdefault(address, {})
+            previous = book.get(coin, [0.0, 0.0, 0])
+            # 本地持仓与 startPosition 一致时沿用均价，否则（之前漏了成交）从本笔成交价开始
+            entry = previous[1] if start and abs(previous[0] - start) < 1e-9 else px
+            size, entry, _ = apply_average_cost(start, entry, qty, px)
+            size = round(size, 8)
+            book[coin] = [size, entry or 0.0, max(previous[2], int(fill.get("time", 0)))]
+            return coin, start, size
+
+    def user_states(self):
+        """转换为 process_snapshot 使用的 clearinghouseState 格式，只包含已同步的地址"""
+        with self.lock:
+            return {
+                address: {"assetPositions": [{"position": {"coin": coin, "szi": str(size), "entryPx": str(entry)}}
+                                             for coin, (size, entry, _) in book.items() if size]}
+                for address, book in self.positions.items() if address in self.synced
+            }
+
+
+class UserFillStream:
+    """一个 websocket 连接，订阅若干地址的 userFills，断线后自动重连
+    每次连接建立后在独立线程调用 on_connect(users) 通过 REST 重新同步，订阅时推送的历史成交 (isSnapshot) 忽略"""
+
+    def __init__(self, users, on_connect, on_fills, url=WS_URL):
+        self.users = list(users)
+        self.on_connect = on_connect
+        self.on_fills = on_fills
+        self.url = url
+        self.ws = None
+        self.running = True
+        self.connects = 0
+
+    def start(self):
+        threading.Thread(target=self.run, daemon=True).start()
+        threading.Thread(target=self._keepalive, daemon=True).start()
+
+    def run(self):
+        import websocket
+        while self.running:
+            self.ws = websocket.WebSocketApp(self.url, on_open=self._on_open, on_message=self._on_message,
+                                             on_error=self._on_error, on_close=self._on_close)
+            self.ws.run_forever(ping_interval=30, ping_timeout=10)
+            if self.running:
+                print(f"♻️ {RECONNECT_DELAY}秒后重连 ({len(self.users)} 个地址)")
+                time.sleep(RECONNECT_DELAY)
+
+    def _keepalive(self):
+        while self.running:
+            time.sleep(WS_PING_INTERVAL)
+            try:
+                if self.ws and self.ws.sock and self.ws.sock.connected:
+                    self.ws.send(json.dumps({"method": "ping"}))
+            except Exception as e:
+                print(f"⚠️ 心跳发送失败: {e}")
+
+    def _on_open(self, ws):
+        self.connects += 1
+        for user in self.users:
+            ws.send(json.dumps({"method": "subscribe", "subscription": {"type": "userFills", "user": user}}))
+        print(f"✅ WebSocket连接成功，订阅 {len(self.users)} 个地址的成交 @ {time.strftime('%H:%M:%S')}")
+        # REST 同步不阻塞消息接收，期间到达的成交由 startPosition 保证正确
+        threading.Thread(target=self.on_connect, args=(self.users,), daemon=True).start()
+
+    def _on_message(self, ws, message):
+        try:
+            msg = json.loads(message)
+        except ValueError:
+            return
+        channel = msg.get("channel")
+        if channel == "userFills":
+            data = msg.get("data", {})
+            if data.get("isSnapshot"):
+                return
+            self.on_fills(data.get("user", ""), data.get("fills", []))
+        elif channel == "error":
+            print(f"❌ 服务端错误: {msg.get('data')}")
+
+    def _on_error(self, ws, error):
+        print(f"❌ WebSocket错误: {error}")
+
+    def _on_close(self, ws, close_status_code, close_msg):
+        print(f"⛔ 连接关闭: Code={close_status_code}, Msg={close_msg}")
+
+    def close(self):
+        self.running = False
+        if self.ws:
+            self.ws.close()
+
+
+def print_event(event):
+    """立即打印一次持仓变化"""
+    kind, address, coin, previous, current = event[:5]
+    operation = classify_change(previous, current)
+    if not operation:
+        return
+    if kind == "fill":
+        fill, received = event[5], event[6]
+        print(f"⚡ {address} {coin} {operation} {previous:g} -> {current:g} @ {fill['px']} "
+              f"(成交后 {received * 1000 - fill['time']:.0f}ms)")
+    else:
+        print(f"🔄 {address} {coin} {operation} {previous:g} -> {current:g} (重连后 REST 同步)")
+
+
+def monitor_positions_ws(symbols, addresses, workers=8, interval=1.0, weight_per_minute=HL_WEIGHT_PER_MINUTE * WEIGHT_BUDGET,
+                         base_url=MAINNET_API_URL, ws_url=WS_URL, users_per_connection=WS_USERS_PER_CONNECTION):
+    """websocket 模式：前 MAX_WS_USERS 个地址订阅 userFills，成交到达时立即检测持仓变化，只在 (重)连接时用 REST 同步；
+    超出限制的地址仍按 interval 轮询"""
+    ws_users, rest_users = addresses[:MAX_WS_USERS], addresses[MAX_WS_USERS:]
+    if rest_users:
+        print(f"⚠️ 每个IP最多订阅 {MAX_WS_USERS} 个地址，其余 {len(rest_users)} 个地址使用 REST 轮询")
+    tracker = PositionTracker(symbols)
+    poller = StatePoller(base_url, workers=workers, weight_per_minute=weight_per_minute)
+    events = queue.Queue()
+    by_lower = {address.lower(): address for address in ws_users}
+    streams = []
+    attempted = set()  # 已经尝试过首次同步的地址，全部尝试后才开始输出表格，避免启动时地址陆续出现触发报警
+
+    def resync(users):
+        """连接建立后同步这些地址，失败的地址指数退避重试直到成功"""
+        pending, attempt = list(users), 0
+        while pending and any(stream.running for stream in streams):
+            stats = poller.poll(pending)
+            attempted.update(pending)
+            for address in pending:
+                if address not in stats["errors"]:
+                    for change in tracker.apply_state(address, poller.states[address]):
+                        events.put(("sync", address) + change)
+            print(f"🔄 REST 同步 {len(pending) - len(stats['errors'])}/{len(pending)} 个地址 {stats['cycle']:.2f}秒")
+            events.put(("synced", None, None, 0.0, 0.0))
+            pending = list(stats["errors"])
+            if pending:
+                time.sleep(min(MIN_SLEEP * 2 ** attempt, MAX_BACKOFF))
+                attempt += 1
+
+    def on_fills(user, fills):
+        address = by_lower.get(user.lower())
+        if address is None:
+            return
+        received = time.time()
+        for fill in fills:
+            change = tracker.apply_fill(address, fill)
+            if change:
+                events.put(("fill", address) + change + (fill, received))
+
+    for i in range(0, len(ws_users), max(users_per_connection, 1)):
+        streams.append(UserFillStream(ws_users[i:i + users_per_connection], resync, on_fills, ws_url))
+    for stream in streams:
+        stream.start()
+
+    last = None
+    next_poll = time.time()
+    failed_cycles = 0
+    try:
+        while True:
+            timeout = max(next_poll - time.time(), 0.05) if rest_users else 1.0
+            batch = []
+            try:
+                batch.append(events.get(timeout=timeout))
+                print_event(batch[0])
+                deadline = time.time() + EVENT_BATCH_WINDOW
+                while time.time() < deadline:
+                    try:
+                        batch.append(events.get(timeout=max(deadline - time.time(), 0.0)))
+                        print_event(batch[-1])
+                    except queue.Empty:
+                        break
+            except queue.Empty:
+                pass
+
+            polled = False
+            if rest_users and time.time() >= next_poll:
+                stats = poller.poll(rest_users)
+                report_cycle(stats, rest_users)
+                failed_cycles = failed_cycles + 1 if len(stats["errors"]) == len(rest_users) else 0
+                delay = min(MIN_SLEEP * 2 ** (failed_cycles - 1), MAX_BACKOFF) if failed_cycles else interval
+                next_poll = time.time() + delay
+                polled = True
 
-        last = df_result
+            if (batch or polled) and len(attempted) == len(ws_users):
+                states = tracker.user_states()
+                states.update({address: poller.states[address] for address in rest_users if address in poller.states})
+                if states:
+                    last = process_snapshot(symbols, addresses, states, last)
+    finally:
+        for stream in streams:
+            stream.close()
+        poller.close()
 
-        time.sleep(1)
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='实时监控Hyperliquid用户持仓')
     parser.add_argument('--file', '-f', type=str, default='./trading_data_cache/result.txt', help='要监控的账户地址文件')
+    parser.add_argument('--workers', '-w', type=int, default=8, help='并发请求线程数 (默认8)')
+    parser.add_argument('--interval', type=float, default=1.0, help='两轮开始之间的目标间隔秒数，地址多时受限流约束 (默认1)')
+    parser.add_argument('--ws', action='store_true', help=f'websocket 模式：订阅前 {MAX_WS_USERS} 个地址的 userFills，成交后立即检测变化')
+    parser.add_argument('--users_per_connection', type=int, default=WS_USERS_PER_CONNECTION, help=f'websocket 模式每个连接订阅的地址数 (默认{WS_USERS_PER_CONNECTION})')
+    parser.add_argument('--weight_per_minute', type=float, default=HL_WEIGHT_PER_MINUTE * WEIGHT_BUDGET,
+                        help=f'每分钟使用的请求权重 (默认 {HL_WEIGHT_PER_MINUTE * WEIGHT_BUDGET:.0f}，上限 {HL_WEIGHT_PER_MINUTE})')
     args = parser.parse_args()
     print(f"will read file {args.file}")
     with open(args.file, 'r') as f:
-        addresses = [line.strip() for line in f.readlines()]
+        # 跳过空行和重复地址
+        addresses = list(dict.fromkeys(line.strip() for line in f if line.strip()))
     
     print(f"开始实时监控 {addresses} {SYMBOLS} 持仓...")
     try:
-        monitor_positions(SYMBOLS, addresses)
+        if args.ws:
+            monitor_positions_ws(SYMBOLS, addresses, args.workers, args.interval, args.weight_per_minute,
+                                 users_per_connection=args.users_per_connection)
+        else:
+            monitor_positions(SYMBOLS, addresses, args.workers, args.interval, args.weight_per_minute)
     except KeyboardInterrupt:
         print("用户退出")